@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class AdmissionController(object):
+    # share of the current concurrency limit each priority class may occupy,
+    # lower classes are shed first when the server saturates
+    PRIORITY_SHARE = {
+        PRIORITY_HIGH: 1.0,
+        PRIORITY_NORMAL: 0.9,
+        PRIORITY_LOW: 0.75,
+    }
+    DECREASE_FACTOR = 0.9
+
+    def __init__(self, max_inflight=64, initial_limit=16, min_limit=1, target_latency=0.1, retry_after=1):
+        self.max_inflight = int(max_inflight)
+        self.min_limit = int(min_limit)
+        self.limit = float(min(max(initial_limit, min_limit), max_inflight))
+        self.target_latency = float(target_latency)
+        self.retry_after = int(retry_after)
+        self.inflight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        with self.lock:
+            allowed = max(1, int(self.limit * self.PRIORITY_SHARE[priority]))
+            if self.inflight >= allowed:
+                self.rejected += 1
+                return False
+            self.inflight += 1
+            self.admitted += 1
+            return True
+
+    def release(self, latency):
+        with self.lock:
+            self.inflight -= 1
+            if latency <= self.target_latency:
+                # additive increase, about +1 per limit requests served in time
+                self.limit = min(self.max_inflight, self.limit + 1.0 / self.limit)
+            else:
+                # multiplicative decrease, at most once per target latency so one
+                # slow burst does not collapse the limit to the floor
+                now = time.monotonic()
+                if now - self.last_decrease >= self.target_latency:
+                    self.last_decrease = now
+                    self.limit = max(self.min_limit, self.limit * self.DECREASE_FACTOR)
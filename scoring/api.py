@@ -1,17 +1,25 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
 import json
+import math
+import time
+import signal
 import datetime
 import logging
 import hashlib
-import uuid
 from optparse import OptionParser
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
 
+import admission
+import compression
 import field
+import requestid
 import scoring
 import store
+import transport
+from store import DeadlineExceeded
 
 SALT = "Otus"
 ADMIN_LOGIN = "admin"
@@ -22,13 +30,20 @@ FORBIDDEN = 403
 NOT_FOUND = 404
 INVALID_REQUEST = 422
 INTERNAL_ERROR = 500
+SERVICE_UNAVAILABLE = 503
+GATEWAY_TIMEOUT = 504
 ERRORS = {
     BAD_REQUEST: "Bad Request",
     FORBIDDEN: "Forbidden",
     NOT_FOUND: "Not Found",
     INVALID_REQUEST: "Invalid Request",
     INTERNAL_ERROR: "Internal Server Error",
+    SERVICE_UNAVAILABLE: "Service Unavailable",
+    GATEWAY_TIMEOUT: "Gateway Timeout",
 }
+CLIENTS_LIMIT_DEFAULT = 100
+CLIENTS_LIMIT_MAX = 1000
+SCORE_RESPONSE_TEMPLATE = b'{"response": {"score": %b}, "code": 200}'
 UNKNOWN = 0
 MALE = 1
 FEMALE = 2
@@ -52,6 +67,22 @@ class ClientsInterestsRequest(field.FieldHolder):
             raise ValueError('empty client ids list')
 
 
+class ClientsByInterestsRequest(field.FieldHolder):
+    interests = field.InterestsField(required=True)
+    operator = field.CharField(required=False, nullable=True)
+    cursor = field.IntegerField(required=False, nullable=True)
+    limit = field.IntegerField(required=False, nullable=True)
+
+    def validate(self):
+        super().validate()
+        if not self.interests:
+            raise ValueError('empty interests list')
+        if self.operator not in (None, 'and', 'or'):
+            raise ValueError("operator must be 'and' or 'or'")
+        if self.limit is not None and not 0 < self.limit <= CLIENTS_LIMIT_MAX:
+            raise ValueError('limit must be from 1 to {:d}'.format(CLIENTS_LIMIT_MAX))
+
+
 class OnlineScoreRequest(field.FieldHolder):
     first_name = field.CharField(required=False, nullable=True)
     last_name = field.CharField(required=False, nullable=True)
@@ -90,12 +121,17 @@ class MethodRequest(field.FieldHolder):
         return self.login == ADMIN_LOGIN
 
 
+def admin_token():
+    hash_str = '{:s}{:s}'.format(datetime.datetime.now().strftime("%Y%m%d%H"), ADMIN_SALT)
+    return hashlib.sha512(hash_str.encode('utf-8')).hexdigest()
+
+
 def check_auth(request):
     if request.is_admin():
-        hash_str = '{:s}{:s}'.format(datetime.datetime.now().strftime("%Y%m%d%H"), ADMIN_SALT)
+        digest = admin_token()
     else:
         hash_str = '{:s}{:s}{:s}'.format(request.account, request.login, SALT)
-    digest = hashlib.sha512(hash_str.encode('utf-8')).hexdigest()
+        digest = hashlib.sha512(hash_str.encode('utf-8')).hexdigest()
     if digest == request.token:
         return True
     return False
@@ -107,11 +143,26 @@ def clients_interests_handler(ctx, store, method_request):
 
     interests_dict = {}
     for client_id in clients_interests_request.client_ids:
+        store.check_deadline()
         interests_dict[client_id] = scoring.get_interests(store, client_id)
     ctx['nclients'] = clients_interests_request.nclients()
     return interests_dict, OK
 
 
+def clients_by_interests_handler(ctx, store, method_request):
+    clients_by_interests_request = ClientsByInterestsRequest(method_request.arguments)
+    clients_by_interests_request.validate()
+
+    if clients_by_interests_request.operator == 'and':
+        all_names, any_names = clients_by_interests_request.interests, []
+    else:
+        all_names, any_names = [], clients_by_interests_request.interests
+    client_ids, cursor = store.query_interests(all_names, any_names, clients_by_interests_request.cursor,
+                                               clients_by_interests_request.limit or CLIENTS_LIMIT_DEFAULT)
+    ctx['nclients'] = len(client_ids)
+    return {'client_ids': client_ids, 'cursor': cursor}, OK
+
+
 def online_score_handler(ctx, store, method_request):
     online_score_request = OnlineScoreRequest(method_request.arguments)
     online_score_request.validate()
@@ -132,10 +183,18 @@ def online_score_handler(ctx, store, method_request):
 
 
 def method_handler(request, ctx, store):
-    router = {'online_score': online_score_handler, 'clients_interests': clients_interests_handler}
+    router = {
+        'online_score': online_score_handler,
+        'clients_interests': clients_interests_handler,
+        'clients_by_interests': clients_by_interests_handler,
+    }
     response, code = None, None
 
     method_request = MethodRequest(request['body'])
+    if ctx.get('request_id') is not None:
+        store = store.with_request_id(ctx['request_id'])
+    if ctx.get('deadline') is not None:
+        store = store.with_deadline(ctx['deadline'])
     try:
         method_request.validate()
         if check_auth(method_request):
@@ -148,88 +207,234 @@ def method_handler(request, ctx, store):
             response, code = "Invalid token", FORBIDDEN
     except ValueError as e:
         response, code = str(e), INVALID_REQUEST
+    except DeadlineExceeded as e:
+        response, code = str(e), GATEWAY_TIMEOUT
     return response, code
 
 
-class MainHTTPHandler(BaseHTTPRequestHandler):
+def get_request_deadline(headers):
+    deadline = headers.get('X-Request-Deadline')
+    if deadline is not None:
+        return float(deadline)
+    timeout = headers.get('X-Request-Timeout')
+    if timeout is not None:
+        return time.time() + float(timeout)
+    return None
+
+
+def get_request_priority(request):
+    if not isinstance(request, dict):
+        return admission.PRIORITY_NORMAL
+    if request.get('login') == ADMIN_LOGIN:
+        # admission runs before the request is validated, so the admin login
+        # is trusted only with the admin token; a bare claim is served last
+        if request.get('token') == admin_token():
+            return admission.PRIORITY_HIGH
+        return admission.PRIORITY_LOW
+    if request.get('method') in ('clients_interests', 'clients_by_interests'):
+        return admission.PRIORITY_LOW
+    return admission.PRIORITY_NORMAL
+
+
+def encode_response(response, code, r):
+    # common success shape is filled into a prepared template, its output is
+    # byte for byte what json.dumps gives
+    if code == OK and type(response) is dict and len(response) == 1:
+        score = response.get('score')
+        if type(score) in (int, float) and math.isfinite(score):
+            return SCORE_RESPONSE_TEMPLATE % repr(score).encode('ascii')
+    return json.dumps(r).encode("utf-8")
+
+
+class MainHTTPHandler(transport.PersistentHTTPRequestHandler):
     router = {"method": method_handler}
-
-    def get_request_id(self, headers):
-        return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
+    admission = None
+    connection_stats = transport.ConnectionStats()
 
     def do_GET(self):
         code = INVALID_REQUEST
-        context = {"request_id": self.get_request_id(self.headers)}
+        context = {"request_id": requestid.begin(self.headers)}
+        if self.profile_endpoint and self.path.startswith(profiler.PATH):
+            # stacks show the data being served, only the admin may see them
+            return profiler.serve_profile(self, self.headers.get(profiler.TOKEN_HEADER) == admin_token())
 
+        response = None
         path = self.path.strip("/")
         if path == 'ping':
             code = OK
+        elif path == 'metrics':
+            response, code = self.connection_stats.snapshot(), OK
         else:
             code = NOT_FOUND
 
-        self.make_response(None, code, context)
+        self.make_response(response, code, context)
         return
 
     def do_POST(self):
-        response, code = {}, INVALID_REQUEST
-        context = {"request_id": self.get_request_id(self.headers)}
+        response, code, headers = {}, INVALID_REQUEST, None
+        context = {"request_id": requestid.begin(self.headers)}
         request = None
         data_string = None
         try:
+            # json decodes utf-8 bytes itself, no intermediate str
             data_string = self.rfile.read(int(self.headers['Content-Length']))
-            request = json.loads(data_string.decode('utf-8'))
+            request = json.loads(data_string)
+            context["deadline"] = get_request_deadline(self.headers)
         except Exception as e:
-            logging.exception("Read/parse error: %s" % e)
-            code = BAD_REQUEST
+            logging.exception("Read/parse error: %s", e)
+            request, code = None, BAD_REQUEST
+            # the rest of the connection can not be trusted to start a request
+            self.close_connection = True
 
         if request:
             path = self.path.strip("/")
-            logging.info("%s: %s %s" % (self.path, data_string, context["request_id"]))
-            if path in self.router:
-                try:
-                    response, code = self.router[path]({"body": request, "headers": self.headers}, context, self.store)
-                except Exception as e:
-                    logging.exception("Unexpected error: %s" % e)
-                    code = INTERNAL_ERROR
+            logging.info("%s: %s", self.path, data_string)
+            if context["deadline"] is not None and context["deadline"] <= time.time():
+                response, code = 'request deadline exceeded', GATEWAY_TIMEOUT
+            elif path in self.router:
+                if self.admission is None or self.admission.acquire(get_request_priority(request)):
+                    response, code = self.route(path, request, context)
+                else:
+                    response, code = 'server overloaded', SERVICE_UNAVAILABLE
+                    headers = {'Retry-After': str(self.admission.retry_after)}
             else:
                 code = NOT_FOUND
 
-        self.make_response(response, code, context)
+        self.make_response(response, code, context, headers)
         return
 
-    def make_response(self, response, code, context):
-        self.send_response(code)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
+    def route(self, path, request, context):
+        started = time.monotonic()
+        try:
+            return self.router[path]({"body": request, "headers": self.headers}, context, self.store)
+        except Exception as e:
+            logging.exception("Unexpected error: %s" % e)
+            return {}, INTERNAL_ERROR
+        finally:
+            if self.admission is not None:
+                self.admission.release(time.monotonic() - started)
+
+    def make_response(self, response, code, context, headers=None):
         if code not in ERRORS:
             r = {"response": response, "code": code}
         else:
             r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
         context.update(r)
         logging.info(context)
-        self.wfile.write(json.dumps(r).encode("utf-8"))
+        body, encoding = compression.encode_body(encode_response(response, code, r), self.headers.get('Accept-Encoding'))
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header(requestid.HEADER, context["request_id"])
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
         return
 
     def log_message(self, format, *args):
         logging.info('HTTP: ' + format, *args)
 
 
+def prewarm():
+    # runs what the first request would otherwise pay for: first use of
+    # hashing, date formatting and parsing, json encoding, every field
+    # conversion; called in each worker before serving
+    arguments = {'phone': '79175002040', 'email': 'stupnikov@otus.ru', 'first_name': 'a',
+                 'last_name': 'b', 'birthday': '01.01.1990', 'gender': 1}
+    token = hashlib.sha512((datetime.datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT).encode('utf-8')).hexdigest()
+    request = {'account': '', 'login': ADMIN_LOGIN, 'method': 'online_score', 'token': token, 'arguments': arguments}
+    response, code = method_handler({'body': json.loads(json.dumps(request)), 'headers': {}}, {}, None)
+    encode_response(response, code, {'response': response, 'code': code})
+    online_score_request = OnlineScoreRequest(arguments)
+    online_score_request.validate()
+    for field_name in online_score_request.field_dict:
+        getattr(online_score_request, field_name)
+    ClientsInterestsRequest({'client_ids': [1], 'date': '20.07.2017'}).validate()
+
+
+def interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
 if __name__ == "__main__":
     op = OptionParser()
     op.add_option("-p", "--port", action="store", type=int, default=8080)
+    op.add_option("-u", "--unix", action="store", default=None)
     op.add_option("-l", "--log", action="store", default=None)
     op.add_option("-s", "--storage", action="store", default="localhost,8010,10,3")
+    op.add_option("-r", "--replica", action="append", default=[])
+    op.add_option("-m", "--model", action="store", default=None)
+    op.add_option("--max-inflight", action="store", type=int, default=64)
+    op.add_option("--target-latency", action="store", type=float, default=0.1)
+    op.add_option("-w", "--workers", action="store", type=int, default=1)
+    op.add_option("--idle-timeout", action="store", type=float, default=5.0)
+    op.add_option("--max-requests", action="store", type=int, default=1000)
+    op.add_option("--profile", action="store", default=None)
+    op.add_option("--profile-endpoint", action="store_true", default=False)
+    op.add_option("--shm-cache", action="store", type=int, default=0)
+    op.add_option("--no-prewarm", action="store_false", dest="prewarm", default=True)
     (opts, args) = op.parse_args()
-    logging.basicConfig(
-        filename=opts.log,
-        level=logging.INFO,
-        format='[%(asctime)s] %(levelname).1s %(message)s',
-        datefmt='%Y.%m.%d %H:%M:%S')
-    MainHTTPHandler.store = store.StoreKVS(*opts.storage.split(','))
-    server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
-    logging.info("Starting server at %s" % opts.port)
+    log_pipeline = requestid.setup_logging(opts.log)
+    MainHTTPHandler.timeout = opts.idle_timeout
+    MainHTTPHandler.max_requests = opts.max_requests
+    if opts.profile or opts.profile_endpoint:
+        # cProfile and pstats are large imports, only paid when profiling
+        import profiler
+        MainHTTPHandler.profile_endpoint = opts.profile_endpoint
+        if opts.profile:
+            MainHTTPHandler.profile_collector = profiler.ProfileCollector()
+    if opts.unix:
+        server = transport.ThreadingUnixHTTPServer(opts.unix, MainHTTPHandler)
+    else:
+        server = ThreadingHTTPServer(("localhost", opts.port), MainHTTPHandler)
+    near_cache = None
+    if opts.shm_cache > 0:
+        # multiprocessing is a large import, only paid when the cache is used
+        import shmcache
+        near_cache = shmcache.SharedCache(opts.shm_cache)
+    # workers share the listening socket and the near cache segment, anything
+    # owning threads or connections is created after the fork
+    workers = []
+    for _ in range(opts.workers - 1):
+        pid = os.fork()
+        if pid == 0:
+            workers = None
+            break
+        workers.append(pid)
+    if opts.model:
+        scoring.model_holder.watch(opts.model)
+
+        def reload_model(signum, frame):
+            scoring.model_holder.reload()
+            for pid in workers or []:
+                os.kill(pid, signal.SIGHUP)
+        signal.signal(signal.SIGHUP, reload_model)
+    if workers or opts.profile:
+        # the profile is written on the way out
+        signal.signal(signal.SIGTERM, interrupt)
+    MainHTTPHandler.store = store.StoreKVS(
+        *store.parse_storage_config(opts.storage), replicas=opts.replica, near_cache=near_cache)
+    MainHTTPHandler.admission = admission.AdmissionController(
+        max_inflight=opts.max_inflight, target_latency=opts.target_latency)
+    if opts.prewarm:
+        prewarm()
+    logging.info("Starting server at %s, pid %d" % (opts.unix or opts.port, os.getpid()))
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         pass
+    if opts.profile:
+        MainHTTPHandler.profile_collector.dump(profiler.profile_path(opts.profile, workers is None))
+    if workers is None:
+        log_pipeline.stop()
+        os._exit(0)
+    for pid in workers:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    if near_cache is not None:
+        near_cache.unlink()
     server.server_close()
+    log_pipeline.stop()
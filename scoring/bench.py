@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import datetime
+import hashlib
+import logging
+import tempfile
+import threading
+import statistics
+import subprocess
+import tracemalloc
+import http.client
+from optparse import OptionParser
+
+import api
+import store
+import transport
+
+STARTUP_TARGET = 0.25
+
+
+class BenchHandler(api.MainHTTPHandler):
+    # handler driven without a socket, request and response go through
+    # in-memory files
+    def __init__(self, body, headers):
+        self.rfile = io.BytesIO(body)
+        self.wfile = io.BytesIO()
+        self.headers = headers
+        self.path = '/method'
+        self.command = 'POST'
+        self.request_version = 'HTTP/1.1'
+        self.requestline = 'POST /method HTTP/1.1'
+        self.client_address = ('bench', 0)
+        self.requests_served = 1
+        self.close_connection = False
+
+
+def make_token(account, login):
+    if login == api.ADMIN_LOGIN:
+        return hashlib.sha512((datetime.datetime.now().strftime("%Y%m%d%H") + api.ADMIN_SALT).encode('utf-8')).hexdigest()
+    return hashlib.sha512((account + login + api.SALT).encode('utf-8')).hexdigest()
+
+
+def make_requests():
+    score_arguments = {'phone': '79175002040', 'email': 'stupnikov@otus.ru', 'first_name': 'a',
+                       'last_name': 'b', 'birthday': '01.01.1990', 'gender': 1}
+    cases = [
+        ('online_score', 'h&f', 'online_score', score_arguments),
+        ('online_score admin', api.ADMIN_LOGIN, 'online_score', score_arguments),
+        ('clients_interests', 'h&f', 'clients_interests', {'client_ids': [1, 2, 3, 4], 'date': '20.07.2017'}),
+    ]
+    requests = {}
+    for name, login, method, method_arguments in cases:
+        request = {'account': 'horns&hoofs', 'login': login, 'method': method, 'arguments': method_arguments}
+        request['token'] = make_token(request['account'], request['login'])
+        requests[name] = json.dumps(request).encode('utf-8')
+    return requests
+
+
+def run(body, count):
+    headers = http.client.parse_headers(io.BytesIO(
+        'Content-Length: {:d}\r\nContent-Type: application/json\r\n\r\n'.format(len(body)).encode('ascii')))
+    BenchHandler(body, headers).do_POST()
+    tracemalloc.start()
+    peak = 0
+    for _ in range(count):
+        handler = BenchHandler(body, headers)
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        handler.do_POST()
+        peak += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    started = time.perf_counter()
+    for _ in range(count):
+        BenchHandler(body, headers).do_POST()
+    elapsed = time.perf_counter() - started
+    return peak / count, elapsed / count
+
+
+def cache_client(connect, seed, count):
+    # 4 reads per write over a key set larger than a hot working set, on one
+    # persistent connection
+    rnd = random.Random(seed)
+    headers = {'Content-Type': 'application/json'}
+    for _ in range(count):
+        key = 'uid:%d' % rnd.randrange(10000)
+        if rnd.random() < 0.2:
+            connect.request('POST', '/cache_set', json.dumps({'key': key, 'value': 1.5, 'timeout': 60}), headers)
+        else:
+            connect.request('POST', '/cache_get', json.dumps({'key': key}), headers)
+        connect.getresponse().read()
+
+
+def run_cache(threads, count, runs=3):
+    # operations per second a threaded kvs.py serves to client threads, best
+    # of runs; the clients connect before the clock starts
+    here = os.path.dirname(os.path.abspath(__file__))
+    rates = []
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'kvs.sock')
+        process = subprocess.Popen([sys.executable, os.path.join(here, 'kvs.py'), '-u', path, '-s', root,
+                                    '--max-requests', str(runs * count + 1)],
+                                   stderr=subprocess.DEVNULL)
+        try:
+            wait_ping(path, time.perf_counter() + 10)
+            connects = []
+            for _ in range(threads):
+                # a request makes the server accept the connection before the next one
+                connect = transport.UnixHTTPConnection(path, 5)
+                connect.request('GET', '/ping')
+                connect.getresponse().read()
+                connects.append(connect)
+            for run in range(runs):
+                clients = [threading.Thread(target=cache_client, args=(connect, run * threads + num, count))
+                           for num, connect in enumerate(connects)]
+                started = time.perf_counter()
+                for thread in clients:
+                    thread.start()
+                for thread in clients:
+                    thread.join()
+                rates.append(threads * count / (time.perf_counter() - started))
+            for connect in connects:
+                connect.close()
+        finally:
+            process.terminate()
+            process.wait()
+    return max(rates)
+
+
+def import_time(module, count):
+    return statistics.median(import_time_once(module) for _ in range(count))
+
+
+def import_time_once(module):
+    # cumulative time python -X importtime reports for the module
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stderr=subprocess.PIPE, check=True).stderr.decode('utf-8')
+    for line in reversed(output.splitlines()):
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1e6
+    raise ValueError('no import time of {:s}'.format(module))
+
+
+def wait_ping(path, deadline):
+    while True:
+        connect = transport.UnixHTTPConnection(path, 1)
+        try:
+            connect.request('GET', '/ping', headers={'Connection': 'close'})
+            response = connect.getresponse()
+            response.read()
+            if response.status == 200:
+                return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+        finally:
+            connect.close()
+        time.sleep(0.001)
+
+
+def first_requests(path, body):
+    # latencies of the first and the second request a fresh server serves
+    latencies = []
+    connect = transport.UnixHTTPConnection(path, 5)
+    try:
+        for _ in range(2):
+            started = time.perf_counter()
+            connect.request('POST', '/method', body, {'Content-Type': 'application/json'})
+            connect.getresponse().read()
+            latencies.append(time.perf_counter() - started)
+    finally:
+        connect.close()
+    return latencies
+
+
+def run_startup(script, count):
+    # seconds from spawning the server until it answers /ping
+    here = os.path.dirname(os.path.abspath(__file__))
+    body = make_requests()['online_score admin']
+    ready, first, second = [], [], []
+    for _ in range(count):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'server.sock')
+            storage = 'unix:{:s},1,1'.format(os.path.join(root, 'kvs.sock')) if script == 'api.py' else root
+            started = time.perf_counter()
+            process = subprocess.Popen([sys.executable, os.path.join(here, script), '-u', path, '-s', storage],
+                                       stderr=subprocess.DEVNULL)
+            try:
+                wait_ping(path, started + 10)
+                ready.append(time.perf_counter() - started)
+                if script == 'api.py':
+                    latencies = first_requests(path, body)
+                    first.append(latencies[0])
+                    second.append(latencies[1])
+            finally:
+                process.terminate()
+                process.wait()
+    return statistics.median(ready), first and statistics.median(first), second and statistics.median(second)
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-n", "--count", action="store", type=int, default=100)
+    op.add_option("--cache", action="store_true", default=False)
+    op.add_option("--startup", action="store_true", default=False)
+    (opts, args) = op.parse_args()
+    if opts.startup:
+        for module in ['api', 'kvs']:
+            ready, first, second = run_startup(module + '.py', opts.count)
+            print('{:s}: import {:.1f} ms, ready in {:.1f} ms (target {:.0f} ms)'.format(
+                module, import_time(module, opts.count) * 1e3, ready * 1e3, STARTUP_TARGET * 1e3))
+            if first:
+                print('{:s}: first request {:.2f} ms, second {:.2f} ms'.format(module, first * 1e3, second * 1e3))
+        sys.exit(0)
+    if opts.cache:
+        for threads in [1, 4, 16]:
+            print('kvs cache, {:d} client threads: {:.0f} ops/s'.format(
+                threads, run_cache(threads, opts.count * 100 // threads)))
+        sys.exit(0)
+    logging.basicConfig(level=logging.INFO, handlers=[logging.NullHandler()])
+    api.MainHTTPHandler.store = store.StoreMemory()
+    for cid in range(1, 5):
+        api.MainHTTPHandler.store.set('i:%d' % cid, ['books', 'music'])
+    for method, body in make_requests().items():
+        peak, elapsed = run(body, opts.count)
+        print('{:s}: {:.0f} bytes allocated at peak, {:.1f} us per request'.format(method, peak, elapsed * 1e6))
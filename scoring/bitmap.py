@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import array
+import bisect
+
+CONTAINER_BITS = 16
+LOW_MASK = (1 << CONTAINER_BITS) - 1
+ARRAY_LIMIT = 4096
+
+
+def container_len(container):
+    if isinstance(container, int):
+        return bin(container).count('1')
+    return len(container)
+
+
+def container_iter(container, start=0):
+    if isinstance(container, int):
+        container >>= start
+        while container:
+            lowest = container & -container
+            yield start + lowest.bit_length() - 1
+            container ^= lowest
+    else:
+        yield from container[bisect.bisect_left(container, start):]
+
+
+def to_bitset(container):
+    if isinstance(container, int):
+        return container
+    bitset = 0
+    for low in container:
+        bitset |= 1 << low
+    return bitset
+
+
+def normalize(container):
+    # roaring keeps sparse containers as sorted arrays and dense as bitsets
+    if isinstance(container, int):
+        if container_len(container) > ARRAY_LIMIT:
+            return container
+        return array.array('H', container_iter(container))
+    if len(container) > ARRAY_LIMIT:
+        return to_bitset(container)
+    return container
+
+
+class Bitmap(object):
+    def __init__(self, values=()):
+        self.containers = {}
+        for value in values:
+            self.add(value)
+
+    def add(self, value):
+        high, low = value >> CONTAINER_BITS, value & LOW_MASK
+        container = self.containers.get(high)
+        if container is None:
+            self.containers[high] = array.array('H', [low])
+        elif isinstance(container, int):
+            self.containers[high] = container | (1 << low)
+        else:
+            position = bisect.bisect_left(container, low)
+            if position == len(container) or container[position] != low:
+                container.insert(position, low)
+                self.containers[high] = normalize(container)
+
+    def discard(self, value):
+        high, low = value >> CONTAINER_BITS, value & LOW_MASK
+        container = self.containers.get(high)
+        if container is None:
+            return
+        if isinstance(container, int):
+            container &= ~(1 << low)
+        else:
+            position = bisect.bisect_left(container, low)
+            if position < len(container) and container[position] == low:
+                del container[position]
+        if container_len(container):
+            self.containers[high] = normalize(container)
+        else:
+            del self.containers[high]
+
+    def __contains__(self, value):
+        container = self.containers.get(value >> CONTAINER_BITS)
+        if container is None:
+            return False
+        low = value & LOW_MASK
+        if isinstance(container, int):
+            return bool(container >> low & 1)
+        position = bisect.bisect_left(container, low)
+        return position < len(container) and container[position] == low
+
+    def __len__(self):
+        return sum(container_len(container) for container in self.containers.values())
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, start):
+        start_high = start >> CONTAINER_BITS
+        for high in sorted(self.containers):
+            if high < start_high:
+                continue
+            low_start = start & LOW_MASK if high == start_high else 0
+            for low in container_iter(self.containers[high], low_start):
+                yield high << CONTAINER_BITS | low
+
+    def __and__(self, other):
+        result = Bitmap()
+        for high in self.containers.keys() & other.containers.keys():
+            left, right = self.containers[high], other.containers[high]
+            if isinstance(left, int) and isinstance(right, int):
+                container = left & right
+            elif isinstance(left, int) or isinstance(right, int):
+                bitset, other_container = (left, right) if isinstance(left, int) else (right, left)
+                container = array.array('H', (low for low in other_container if bitset >> low & 1))
+            else:
+                container = array.array('H', sorted(set(left) & set(right)))
+            if container_len(container):
+                result.containers[high] = normalize(container)
+        return result
+
+    def __or__(self, other):
+        result = Bitmap()
+        for high in self.containers.keys() | other.containers.keys():
+            left, right = self.containers.get(high), other.containers.get(high)
+            if left is None or right is None:
+                container = left if right is None else right
+                result.containers[high] = container if isinstance(container, int) else array.array('H', container)
+            elif isinstance(left, int) or isinstance(right, int):
+                result.containers[high] = normalize(to_bitset(left) | to_bitset(right))
+            else:
+                result.containers[high] = normalize(array.array('H', sorted(set(left) | set(right))))
+        return result
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import base64
+import datetime
+import hashlib
+
+TAG_NONE = b'N'
+TAG_STR = b'S'
+TAG_INT = b'I'
+TAG_DATE = b'D'
+DIGEST_SIZE = 16
+
+
+def encode(*values):
+    chunks = []
+    for value in values:
+        if value is None:
+            chunks.append(TAG_NONE)
+            continue
+        if isinstance(value, datetime.date):
+            tag, data = TAG_DATE, value.isoformat().encode('ascii')
+        elif isinstance(value, int):
+            tag, data = TAG_INT, str(value).encode('ascii')
+        else:
+            tag, data = TAG_STR, str(value).encode('utf-8')
+        chunks.append(tag)
+        chunks.append(len(data).to_bytes(4, 'big'))
+        chunks.append(data)
+    return b''.join(chunks)
+
+
+def digest(*values):
+    # blake2b is the fastest 128-bit hash available in the standard library,
+    # its strength is a by-product, keys only need to be well distributed
+    return hashlib.blake2b(encode(*values), digest_size=DIGEST_SIZE).digest()
+
+
+def make_key(prefix, *values):
+    return prefix + base64.urlsafe_b64encode(digest(*values)).rstrip(b'=').decode('ascii')
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import zlib
+import gzip
+import collections
+import re
+from optparse import OptionParser
+
+RECORD_MARK = b'\x00'
+CODEC_ZLIB = b'z'
+CODEC_ZDICT = b'd'
+RECORD_MIN_SIZE = 16
+BODY_MIN_SIZE = 1024
+BODY_MAX_SIZE = 16 * 1024 * 1024
+ZDICT_SIZE = 4096
+LEVEL = 6
+DEFLATE = 'deflate'
+GZIP = 'gzip'
+TOKEN_RE = re.compile(rb'\\?"[^"\\]*\\?"|[\[\]{}:,]\s*|-?\d+(?:\.\d+)?')
+
+DEFAULT_SAMPLES = [
+    b'["cars", "pets"]',
+    b'["travel", "hi-tech"]',
+    b'["sport", "music"]',
+    b'["books", "tv"]',
+    b'["geek", "otus"]',
+    b'"[\\"cars\\", \\"pets\\", \\"travel\\", \\"hi-tech\\", \\"sport\\", \\"music\\", \\"books\\", \\"tv\\"]"',
+]
+
+
+def train_zdict(samples, size=ZDICT_SIZE):
+    # zlib looks for matches in the preset dictionary, so it should hold the
+    # substrings which save the most bytes, the most valuable closer to the end
+    counter = collections.Counter()
+    for sample in samples:
+        counter.update(TOKEN_RE.findall(sample))
+    tokens = sorted(counter, key=lambda token: counter[token] * len(token))
+    zdict = b''
+    for token in reversed(tokens):
+        if len(zdict) + len(token) > size:
+            break
+        zdict = token + zdict
+    return zdict
+
+
+DEFAULT_ZDICT = train_zdict(DEFAULT_SAMPLES)
+
+
+class RecordCodec(object):
+    def __init__(self, compress=False, zdict=None, min_size=RECORD_MIN_SIZE):
+        self.compress = compress
+        self.min_size = min_size
+        self.zdict = zdict
+        self.zdicts = {}
+        for known_zdict in [DEFAULT_ZDICT, zdict]:
+            if known_zdict:
+                self.zdicts[self.zdict_id(known_zdict)] = known_zdict
+
+    @staticmethod
+    def zdict_id(zdict):
+        return zlib.adler32(zdict).to_bytes(4, 'big')
+
+    def encode(self, data):
+        if not self.compress or len(data) < self.min_size:
+            return data
+        if self.zdict:
+            compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=self.zdict)
+            record = RECORD_MARK + CODEC_ZDICT + self.zdict_id(self.zdict)
+            record += compressor.compress(data) + compressor.flush()
+        else:
+            compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+            record = RECORD_MARK + CODEC_ZLIB + compressor.compress(data) + compressor.flush()
+        # json text never starts with a zero byte, so plain records stay readable
+        return record if len(record) < len(data) else data
+
+    def decode(self, record):
+        if record[:1] != RECORD_MARK:
+            return record
+        codec = record[1:2]
+        if codec == CODEC_ZLIB:
+            return zlib.decompress(record[2:], -zlib.MAX_WBITS)
+        if codec == CODEC_ZDICT:
+            zdict = self.zdicts.get(record[2:6])
+            if zdict is None:
+                raise ValueError('record compressed with unknown dictionary')
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=zdict)
+            return decompressor.decompress(record[6:]) + decompressor.flush()
+        raise ValueError('unknown record codec')
+
+
+def accepted_encodings(accept_encoding):
+    encodings = set()
+    for item in (accept_encoding or '').split(','):
+        encoding, _, params = item.partition(';')
+        name, _, value = params.strip().partition('=')
+        try:
+            if name.strip() == 'q' and float(value) == 0:
+                continue
+        except ValueError:
+            continue
+        encodings.add(encoding.strip().lower())
+    return encodings
+
+
+def encode_body(body, accept_encoding, min_size=BODY_MIN_SIZE):
+    if len(body) < min_size:
+        return body, None
+    encodings = accepted_encodings(accept_encoding)
+    if GZIP in encodings:
+        return gzip.compress(body, LEVEL), GZIP
+    if DEFLATE in encodings:
+        return zlib.compress(body, LEVEL), DEFLATE
+    return body, None
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+def decode_body(body, content_encoding, max_size=BODY_MAX_SIZE):
+    # a few KB of deflate expand to gigabytes, so a body is inflated at most
+    # to max_size bytes, None for no limit on trusted peers
+    if not content_encoding:
+        return body
+    content_encoding = content_encoding.strip().lower()
+    if content_encoding == DEFLATE:
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+    elif content_encoding == GZIP:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    else:
+        raise ValueError('unsupported content encoding {:s}'.format(content_encoding))
+    if max_size is None:
+        data = decompressor.decompress(body)
+    else:
+        data = decompressor.decompress(body, max_size + 1)
+        if len(data) > max_size:
+            raise BodyTooLarge('decoded body exceeds {:d} bytes'.format(max_size))
+    if not decompressor.eof:
+        raise ValueError('truncated {:s} body'.format(content_encoding))
+    return data
+
+
+def iter_records(root):
+    for dir_path, dir_names, file_names in os.walk(root):
+        for file_name in file_names:
+            if file_name.endswith('.rec'):
+                with open(os.path.join(dir_path, file_name), 'rb') as record_file:
+                    try:
+                        yield RecordCodec().decode(record_file.read())
+                    except (ValueError, zlib.error):
+                        continue
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-s", "--storage", action="store", default='.')
+    op.add_option("-o", "--output", action="store", default='zdict.bin')
+    op.add_option("--size", action="store", type=int, default=ZDICT_SIZE)
+    (opts, args) = op.parse_args()
+    with open(opts.output, 'wb') as zdict_file:
+        zdict_file.write(train_zdict(iter_records(opts.storage), opts.size))
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import datetime
+import functools
+
+DATE_FORMAT = "%d.%m.%Y"
+MEMO_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=MEMO_SIZE)
+def parse_date(value):
+    # DD.MM.YYYY of ascii digits is parsed by hand, anything else strptime
+    # accepts for the format (unpadded numbers, a space before the day, ...)
+    # goes to strptime, so both accept and reject the same strings
+    if (len(value) == 10 and value[2] == '.' and value[5] == '.' and value.isascii()
+            and value[0:2].isdigit() and value[3:5].isdigit() and value[6:10].isdigit()):
+        return datetime.date(int(value[6:10]), int(value[3:5]), int(value[0:2]))
+    return datetime.datetime.strptime(value, DATE_FORMAT).date()
+
+
+class Today(object):
+    # date.today() goes through localtime() on every call, the date only
+    # changes at midnight
+    def __init__(self):
+        self.date = None
+        self.expire = 0.0
+
+    def __call__(self):
+        now = time.time()
+        if now >= self.expire:
+            self.date = datetime.date.fromtimestamp(now)
+            midnight = datetime.datetime.combine(self.date + datetime.timedelta(days=1), datetime.time())
+            self.expire = midnight.timestamp()
+        return self.date
+
+
+today = Today()
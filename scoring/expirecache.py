@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import heapq
+import itertools
+import threading
+import collections
+
+CacheRecord = collections.namedtuple('CacheRecord', 'value expire')
+
+
+class ExpiringCache(object):
+    # one dict under one lock: under the GIL segments with locks of their own
+    # served no more requests through kvs.py, see bench.py --cache
+    SWEEP_BATCH = 16
+    # the heap is rebuilt from the live records once it holds more than
+    # twice as many entries, overwrites of long lived keys would grow it
+    # with write rate times timeout otherwise
+    COMPACT_MIN = 64
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = {}
+        # (expire, seq, key) of records with a timeout, soonest first; entries
+        # of overwritten records stay until swept and are skipped then
+        self.expiring = []
+        self.seq = itertools.count()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            record = self.records.get(key)
+            if record is None:
+                return None
+            if record.expire is not None and record.expire < now:
+                del self.records[key]
+                return None
+            return record.value
+
+    def set(self, key, value, timeout=None):
+        now = time.time()
+        expire = None if timeout is None else now + timeout
+        with self.lock:
+            self.records[key] = CacheRecord(value, expire)
+            if expire is not None:
+                heapq.heappush(self.expiring, (expire, next(self.seq), key))
+            if self.expiring and self.expiring[0][0] < now:
+                self.sweep_expired(now, self.SWEEP_BATCH)
+            if len(self.expiring) > max(self.COMPACT_MIN, 2 * len(self.records)):
+                self.compact()
+
+    def compact(self):
+        # called with the lock held
+        self.expiring = [(record.expire, next(self.seq), key)
+                         for key, record in self.records.items() if record.expire is not None]
+        heapq.heapify(self.expiring)
+
+    def sweep_expired(self, now, limit=None):
+        # called with the lock held
+        swept = 0
+        expiring = self.expiring
+        while expiring and expiring[0][0] < now and (limit is None or swept < limit):
+            expire, _, key = heapq.heappop(expiring)
+            record = self.records.get(key)
+            if record is not None and record.expire == expire:
+                del self.records[key]
+            swept += 1
+        return swept
+
+    def sweep(self):
+        with self.lock:
+            return self.sweep_expired(time.time())
+
+    def __len__(self):
+        return len(self.records)
@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import re
-import datetime
+import string
+import itertools
+import collections
+import concurrent.futures
+
+import dates
 
 
 class Field(object):
@@ -48,6 +52,21 @@ class FieldHolderMeta(type):
         return super().__new__(cls, name, bases, attrs)
 
 
+def validate_each(holder_class, structs):
+    for struct in structs:
+        holder = holder_class(struct)
+        try:
+            holder.validate()
+        except ValueError as e:
+            yield None, e
+        else:
+            yield holder, None
+
+
+def validate_chunk(holder_class, structs):
+    return list(validate_each(holder_class, structs))
+
+
 class FieldHolderBase(object):
     def __init__(self, struct):
         self.struct_orig = struct
@@ -66,6 +85,27 @@ class FieldHolderBase(object):
         for field_name, value in struct.items():
             setattr(self, field_name, value)
 
+    @classmethod
+    def validate_many(cls, structs, processes=None, chunk_size=1000):
+        # yields (holder, None) for a valid struct and (None, error) for an
+        # invalid one, in input order; with processes the structs are validated
+        # by a process pool in chunks, at most two chunks per process in flight
+        if not processes:
+            yield from validate_each(cls, structs)
+            return
+        structs = iter(structs)
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            futures = collections.deque()
+            while True:
+                while len(futures) < 2 * processes:
+                    chunk = list(itertools.islice(structs, chunk_size))
+                    if not chunk:
+                        break
+                    futures.append(executor.submit(validate_chunk, cls, chunk))
+                if not futures:
+                    break
+                yield from futures.popleft().result()
+
     def dump_fields(self):
         print("Dump: {!s}".format(self))
         for field_name in self.field_dict:
@@ -100,11 +140,29 @@ class ArgumentsField(Field):
 
 
 class EmailField(CharField):
-    VALIDATE_EMAIL_RE = re.compile("^.+\\@(\\[?)[a-zA-Z0-9\\-\\.]+\\.([a-zA-Z]{2,3}|[0-9]{1,3})(\\]?)$")
+    DOMAIN_CHARS = string.ascii_letters + string.digits + '-.'
 
     @staticmethod
     def is_valid_email(email):
-        return len(email) > 7 and re.match(EmailField.VALIDATE_EMAIL_RE, email) is not None
+        # linear time equivalent of
+        # re.match(r"^.+\@(\[?)[a-zA-Z0-9\-\.]+\.([a-zA-Z]{2,3}|[0-9]{1,3})(\]?)$"):
+        # the domain has no '@', so it follows the last one; '$' also
+        # matches before a trailing newline
+        if len(email) <= 7:
+            return False
+        local, _, domain = email.rpartition('@')
+        if not local or '\n' in local:
+            return False
+        if domain[-1:] == '\n':
+            domain = domain[:-1]
+        if domain[:1] == '[':
+            domain = domain[1:]
+        if domain[-1:] == ']':
+            domain = domain[:-1]
+        host, _, tld = domain.rpartition('.')
+        if not host or host.strip(EmailField.DOMAIN_CHARS) or len(tld) > 3 or not tld.isascii():
+            return False
+        return tld.isdigit() or (len(tld) > 1 and tld.isalpha())
 
     def validate_convert_value(self, value):
         value = super().validate_convert_value(value)
@@ -114,11 +172,13 @@ class EmailField(CharField):
 
 
 class PhoneField(Field):
-    VALIDATE_PHONE_RE = re.compile("^7\\d+$")
-
     @staticmethod
     def is_valid_phone(phone):
-        return len(phone) == 11 and re.match(PhoneField.VALIDATE_PHONE_RE, phone) is not None
+        # equivalent of re.match(r"^7\d+$"), \d being any unicode decimal digit
+        if len(phone) != 11 or phone[0] != '7':
+            return False
+        digits = phone[1:-1] if phone.endswith('\n') else phone[1:]
+        return digits.isdecimal()
 
     def validate_convert_value(self, value):
         value = super().validate_convert_value(value)
@@ -133,18 +193,18 @@ class PhoneField(Field):
 
 
 class DateField(CharField):
-    DATE_FIELD_FORMAT = "%d.%m.%Y"
+    DATE_FIELD_FORMAT = dates.DATE_FORMAT
 
     def validate_convert_value(self, value):
         value = super().validate_convert_value(value)
-        value = datetime.datetime.strptime(value, DateField.DATE_FIELD_FORMAT).date()
+        value = dates.parse_date(value)
         return value
 
 
 class BirthDayField(DateField):
     @staticmethod
     def is_valid_birthday(date):
-        td = datetime.date.today()
+        td = dates.today()
         years = td.year - date.year
         if td.month < date.month or (td.month == date.month and td.day < date.day):
             years -= 1
@@ -175,3 +235,21 @@ class ClientIDsField(Field):
         elif not all(isinstance(x, int) for x in value):
             raise ValueError('field must be list of numbers')
         return value
+
+
+class IntegerField(Field):
+    def validate_convert_value(self, value):
+        value = super().validate_convert_value(value)
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError('field must be number')
+        return value
+
+
+class InterestsField(Field):
+    def validate_convert_value(self, value):
+        value = super().validate_convert_value(value)
+        if not isinstance(value, list):
+            raise ValueError('field must be list')
+        elif not all(isinstance(x, str) for x in value):
+            raise ValueError('field must be list of strings')
+        return value
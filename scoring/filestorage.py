@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import base64
+import hashlib
+import logging
+import threading
+import collections
+
+import compression
+import interests
+import keyindex
+
+
+class FileStorage(object):
+    SUFFIX = '.rec'
+    INTERESTS_PREFIX = 'i:'
+    CATEGORIES_FILE = 'categories.jsonl'
+
+    def __init__(self, root, fd_cache_size=0, codec=None):
+        self.root = str(root)
+        self.codec = codec or compression.RecordCodec()
+        self.categories = interests.CategoryTable(os.path.join(self.root, self.CATEGORIES_FILE))
+        self.index = interests.InterestIndex()
+        self.index_lock = threading.Lock()
+        self.key_index = keyindex.KeyIndex()
+        # set once build_indexes is done, writes keep the indexes current
+        # meanwhile but keys not written since start are missing until then
+        self.indexes_ready = threading.Event()
+        self.fd_cache_size = fd_cache_size
+        self.fd_cache = collections.OrderedDict()
+        # bumped under the lock after every write, a descriptor opened before
+        # a write may point to the replaced file and is not cached
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        key_bytes = key.encode('utf-8')
+        # 2 levels x 256 directories keep every directory small,
+        # urlsafe base64 never produces a path separator
+        shard = hashlib.md5(key_bytes).hexdigest()
+        name = base64.urlsafe_b64encode(key_bytes).decode('ascii') + self.SUFFIX
+        return os.path.join(self.root, shard[0:2], shard[2:4], name)
+
+    def legacy_path(self, key):
+        return os.path.join(self.root, base64.b64encode(key.encode('utf-8')).decode('ascii') + self.SUFFIX)
+
+    def read_fd(self, fd):
+        size = os.fstat(fd).st_size
+        return os.pread(fd, size, 0)
+
+    def read(self, key, migrate=True):
+        with self.lock:
+            fd = self.fd_cache.get(key)
+            if fd is not None:
+                self.fd_cache.move_to_end(key)
+                return self.read_fd(fd)
+            generation = self.generation
+        legacy = False
+        try:
+            fd = os.open(self.path(key), os.O_RDONLY)
+        except FileNotFoundError:
+            try:
+                if migrate:
+                    if not self.migrate_key(key):
+                        raise KeyError(key)
+                    fd = os.open(self.path(key), os.O_RDONLY)
+                else:
+                    fd, legacy = os.open(self.legacy_path(key), os.O_RDONLY), True
+            except FileNotFoundError:
+                raise KeyError(key)
+        try:
+            data = self.read_fd(fd)
+        except BaseException:
+            os.close(fd)
+            raise
+        if self.fd_cache_size and not legacy:
+            self.cache_fd(key, fd, generation)
+        else:
+            os.close(fd)
+        return data
+
+    def cache_fd(self, key, fd, generation):
+        with self.lock:
+            if generation != self.generation:
+                os.close(fd)
+                return
+            old_fd = self.fd_cache.pop(key, None)
+            self.fd_cache[key] = fd
+            if old_fd is not None:
+                os.close(old_fd)
+            while len(self.fd_cache) > self.fd_cache_size:
+                _, evicted_fd = self.fd_cache.popitem(last=False)
+                os.close(evicted_fd)
+
+    def uncache_fd(self, key):
+        with self.lock:
+            self.generation += 1
+            fd = self.fd_cache.pop(key, None)
+            if fd is not None:
+                os.close(fd)
+
+    def write(self, key, data, tmp_suffix):
+        path = self.path(key)
+        path_tmp = '{:s}.{:s}.tmp'.format(path, tmp_suffix)
+        try:
+            try:
+                fd = os.open(path_tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            except FileNotFoundError:
+                # shard directories are made by the first write into them
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd = os.open(path_tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            os.replace(path_tmp, path)
+        finally:
+            if os.path.exists(path_tmp):
+                os.unlink(path_tmp)
+        # a cached descriptor still points to the replaced file
+        self.uncache_fd(key)
+
+    def get(self, key):
+        data = self.read(key)
+        if interests.is_record(data):
+            return interests.decode_record(data, self.categories)
+        return json.loads(self.codec.decode(data).decode('utf-8'))
+
+    def get_codes(self, key):
+        data = self.read(key)
+        if interests.is_record(data):
+            return interests.decode_codes(data)
+        return None
+
+    def get_index_codes(self, key, migrate=True):
+        data = self.read(key, migrate)
+        if interests.is_record(data):
+            return interests.decode_codes(data)
+        # plain json record written before interests encoding
+        return self.categories.encode(interests.parse(json.loads(self.codec.decode(data).decode('utf-8'))))
+
+    def set(self, key, value, tmp_suffix):
+        cid = self.interests_client_id(key)
+        if cid is None:
+            self.write(key, self.codec.encode(json.dumps(value).encode('utf-8')), tmp_suffix)
+            self.key_index.add(key)
+            return
+        data = interests.encode_record(value, self.categories)
+        if data is None:
+            data = self.codec.encode(json.dumps(value).encode('utf-8'))
+        # old codes, write and index update must not interleave with another writer of the key
+        with self.index_lock:
+            # a flat record is read in place, the write below supersedes it
+            # and migrate drops it
+            try:
+                old_codes = self.get_index_codes(key, migrate=False)
+            except (KeyError, ValueError, OverflowError):
+                old_codes = []
+            self.write(key, data, tmp_suffix)
+            self.index.update(cid, old_codes, interests.decode_codes(data) if interests.is_record(data) else [])
+        self.key_index.add(key)
+
+    def interests_client_id(self, key):
+        if not key.startswith(self.INTERESTS_PREFIX):
+            return None
+        cid = key[len(self.INTERESTS_PREFIX):]
+        return int(cid) if cid.isascii() and cid.isdigit() else None
+
+    def keys(self):
+        for dir_path, dir_names, file_names in os.walk(self.root):
+            legacy = dir_path == self.root
+            for file_name in file_names:
+                if not file_name.endswith(self.SUFFIX):
+                    continue
+                name = file_name[:-len(self.SUFFIX)]
+                try:
+                    if legacy:
+                        yield base64.b64decode(name, validate=True).decode('utf-8')
+                    else:
+                        yield base64.urlsafe_b64decode(name).decode('utf-8')
+                except ValueError:
+                    continue
+
+    def scan(self, prefix=None, start=None, end=None, cursor=None):
+        lower = max(bound for bound in [prefix, start, ''] if bound is not None)
+        if cursor is not None and cursor >= lower:
+            keys = self.key_index.iter_from(cursor, inclusive=False)
+        else:
+            keys = self.key_index.iter_from(lower)
+        for key in keys:
+            if end is not None and key >= end:
+                return
+            if prefix is not None and not key.startswith(prefix):
+                return
+            try:
+                value = self.get(key)
+            except KeyError:
+                # the record file is gone, later scans need not look again
+                self.key_index.discard(key)
+                continue
+            yield key, value
+
+    def build_indexes(self):
+        # walks the whole tree and reads every interests record, so the cost
+        # grows with the dataset; kvs.py runs it in background while serving
+        keys = list(self.keys())
+        self.key_index.update(keys)
+        indexed = 0
+        for key in keys:
+            cid = self.interests_client_id(key)
+            if cid is None:
+                continue
+            # a set of the key between the read and the update would be undone
+            with self.index_lock:
+                try:
+                    codes = self.get_index_codes(key)
+                except (KeyError, ValueError, OverflowError):
+                    continue
+                self.index.update(cid, [], codes)
+            indexed += 1
+        self.indexes_ready.set()
+        logging.info("Indexed %d keys and interests of %d clients in %s" % (len(keys), indexed, self.root))
+        return indexed
+
+    def migrate_key(self, key):
+        path, legacy_path = self.path(key), self.legacy_path(key)
+        # link never replaces a record a concurrent set has just written in
+        # the sharded layout, the flat copy is stale then and only removed
+        try:
+            try:
+                os.link(legacy_path, path)
+            except FileNotFoundError:
+                if not os.path.exists(legacy_path):
+                    return False
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.link(legacy_path, path)
+        except FileExistsError:
+            pass
+        except FileNotFoundError:
+            # another thread migrated the key in between
+            return os.path.exists(path)
+        try:
+            os.unlink(legacy_path)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def migrate(self):
+        migrated = 0
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.endswith(self.SUFFIX):
+                    continue
+                try:
+                    key = base64.b64decode(entry.name[:-len(self.SUFFIX)], validate=True).decode('utf-8')
+                except ValueError:
+                    logging.warning("Skip unknown record file %s" % entry.name)
+                    continue
+                if self.migrate_key(key):
+                    migrated += 1
+        logging.info("Migrated %d records to sharded layout in %s" % (migrated, self.root))
+        return migrated
+
+    def close(self):
+        with self.lock:
+            while self.fd_cache:
+                _, fd = self.fd_cache.popitem()
+                os.close(fd)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import array
+import threading
+import functools
+import itertools
+
+import bitmap
+import compression
+
+CODEC_INTERESTS = b'i'
+KIND_LIST = b'l'
+KIND_JSON = b's'
+HEADER_SIZE = 3
+MAX_CATEGORIES = 1 << 16
+
+
+class CategoryTable(object):
+    def __init__(self, path=None):
+        self.path = path
+        self.names = []
+        self.codes = {}
+        self.lock = threading.Lock()
+        if path is not None and os.path.isfile(path):
+            with open(path, encoding='utf-8') as table_file:
+                for line in table_file:
+                    self.append(json.loads(line))
+
+    def __len__(self):
+        return len(self.names)
+
+    def append(self, name):
+        name = sys.intern(name)
+        self.codes[name] = len(self.names)
+        self.names.append(name)
+
+    def extend(self, names):
+        with self.lock:
+            for name in names:
+                if name not in self.codes:
+                    self.append(name)
+
+    def encode(self, names):
+        codes = array.array('H')
+        for name in names:
+            code = self.codes.get(name)
+            if code is None:
+                code = self.add(name)
+            codes.append(code)
+        return codes
+
+    def add(self, name):
+        with self.lock:
+            if name in self.codes:
+                return self.codes[name]
+            if len(self.names) >= MAX_CATEGORIES:
+                raise OverflowError('category table is full')
+            if self.path is not None:
+                # persisted before any record refers to the new code
+                with open(self.path, 'a', encoding='utf-8') as table_file:
+                    table_file.write(json.dumps(name) + '\n')
+            self.append(name)
+            return self.codes[name]
+
+    def decode(self, codes):
+        names = self.names
+        return [names[code] for code in codes]
+
+    def since(self, offset):
+        return self.names[offset:]
+
+
+def parse(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = json.loads(value)
+    if not isinstance(value, list) or not all(isinstance(name, str) for name in value):
+        raise ValueError('interests must be list of strings')
+    return value
+
+
+def is_record(data):
+    return data[:2] == compression.RECORD_MARK + CODEC_INTERESTS
+
+
+def encode_record(value, table):
+    kind = KIND_JSON if isinstance(value, str) else KIND_LIST
+    try:
+        codes = table.encode(parse(value))
+    except (ValueError, OverflowError):
+        return None
+    if kind == KIND_JSON and json.dumps(table.decode(codes)) != value:
+        # the value would not survive a roundtrip byte for byte, keep it as is
+        return None
+    if sys.byteorder != 'little':
+        codes.byteswap()
+    return compression.RECORD_MARK + CODEC_INTERESTS + kind + codes.tobytes()
+
+
+def decode_codes(data):
+    codes = array.array('H')
+    codes.frombytes(data[HEADER_SIZE:])
+    if sys.byteorder != 'little':
+        codes.byteswap()
+    return codes
+
+
+def decode_record(data, table):
+    names = table.decode(decode_codes(data))
+    if data[2:3] == KIND_JSON:
+        return json.dumps(names)
+    return names
+
+
+class InterestIndex(object):
+    def __init__(self):
+        self.bitmaps = {}
+        self.lock = threading.Lock()
+
+    def update(self, cid, old_codes, new_codes):
+        old_codes, new_codes = set(old_codes), set(new_codes)
+        with self.lock:
+            for code in old_codes - new_codes:
+                if code in self.bitmaps:
+                    self.bitmaps[code].discard(cid)
+            for code in new_codes - old_codes:
+                self.bitmaps.setdefault(code, bitmap.Bitmap()).add(cid)
+
+    def query(self, all_codes=(), any_codes=(), cursor=None, limit=100):
+        start = 0 if cursor is None else cursor + 1
+        with self.lock:
+            bitmaps = [self.bitmaps.get(code, bitmap.Bitmap()) for code in all_codes]
+            if any_codes:
+                bitmaps.append(functools.reduce(lambda left, right: left | right,
+                                                [self.bitmaps.get(code, bitmap.Bitmap()) for code in any_codes]))
+            if not bitmaps:
+                return [], None
+            result = functools.reduce(lambda left, right: left & right, bitmaps)
+            ids = list(itertools.islice(result.iter_from(start), limit + 1))
+        if len(ids) > limit:
+            return ids[:limit], ids[limit - 1]
+        return ids, None
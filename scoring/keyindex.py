@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import heapq
+import bisect
+import itertools
+import threading
+
+
+class KeyIndex(object):
+    # sorted list of sorted blocks: insertion moves at most 2 * BLOCK_SIZE
+    # references instead of the whole keyspace
+    BLOCK_SIZE = 1000
+
+    def __init__(self, keys=()):
+        self.lock = threading.Lock()
+        self.load(sorted(set(keys)))
+
+    def load(self, keys):
+        # keys sorted and unique
+        self.blocks = [keys[start:start + self.BLOCK_SIZE] for start in range(0, len(keys), self.BLOCK_SIZE)]
+        self.maxes = [block[-1] for block in self.blocks]
+        self.size = len(keys)
+
+    def update(self, keys):
+        # many keys at once, as a walk of the storage finds them: sorted
+        # outside the lock, then merged with the keys added meanwhile
+        keys = sorted(set(keys))
+        with self.lock:
+            merged = heapq.merge(keys, itertools.chain.from_iterable(self.blocks))
+            self.load([key for key, _ in itertools.groupby(merged)])
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, key):
+        with self.lock:
+            block_num = bisect.bisect_left(self.maxes, key)
+            if block_num == len(self.blocks):
+                return False
+            block = self.blocks[block_num]
+            position = bisect.bisect_left(block, key)
+            return position < len(block) and block[position] == key
+
+    def add(self, key):
+        with self.lock:
+            if not self.blocks:
+                self.blocks.append([key])
+                self.maxes.append(key)
+                self.size += 1
+                return
+            block_num = min(bisect.bisect_left(self.maxes, key), len(self.blocks) - 1)
+            block = self.blocks[block_num]
+            position = bisect.bisect_left(block, key)
+            if position < len(block) and block[position] == key:
+                return
+            block.insert(position, key)
+            self.maxes[block_num] = block[-1]
+            self.size += 1
+            if len(block) > 2 * self.BLOCK_SIZE:
+                self.blocks[block_num:block_num + 1] = [block[:self.BLOCK_SIZE], block[self.BLOCK_SIZE:]]
+                self.maxes[block_num:block_num + 1] = [block[self.BLOCK_SIZE - 1], block[-1]]
+
+    def discard(self, key):
+        with self.lock:
+            block_num = bisect.bisect_left(self.maxes, key)
+            if block_num == len(self.blocks):
+                return
+            block = self.blocks[block_num]
+            position = bisect.bisect_left(block, key)
+            if position == len(block) or block[position] != key:
+                return
+            del block[position]
+            self.size -= 1
+            if block:
+                self.maxes[block_num] = block[-1]
+            else:
+                del self.blocks[block_num]
+                del self.maxes[block_num]
+
+    def iter_from(self, start=None, inclusive=True):
+        key = start
+        while True:
+            with self.lock:
+                # copy one block at a time, writers are blocked only for a slice
+                chunk = self.block_from(key, inclusive)
+            if not chunk:
+                return
+            yield from chunk
+            key, inclusive = chunk[-1], False
+
+    def block_from(self, key, inclusive):
+        if key is None:
+            return list(self.blocks[0]) if self.blocks else []
+        find = bisect.bisect_left if inclusive else bisect.bisect_right
+        block_num = find(self.maxes, key)
+        if block_num == len(self.blocks):
+            return []
+        block = self.blocks[block_num]
+        return block[find(block, key):]
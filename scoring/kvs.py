@@ -1,35 +1,55 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
 import json
-import datetime
+import signal
 import logging
-import hashlib
-import uuid
-import pathlib
-import base64
 import time
+import threading
+import itertools
 import collections
 from optparse import OptionParser
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import compression
+import expirecache
+import filestorage
+import requestid
+import transport
 
 OK = 200
 BAD_REQUEST = 400
 FORBIDDEN = 403
 NOT_FOUND = 404
+REQUEST_TOO_LARGE = 413
 INVALID_REQUEST = 422
 INTERNAL_ERROR = 500
+SERVICE_UNAVAILABLE = 503
+GATEWAY_TIMEOUT = 504
 ERRORS = {
     BAD_REQUEST: "Bad Request",
     FORBIDDEN: "Forbidden",
     NOT_FOUND: "Not Found",
+    REQUEST_TOO_LARGE: "Request Entity Too Large",
     INVALID_REQUEST: "Invalid Request",
     INTERNAL_ERROR: "Internal Server Error",
+    SERVICE_UNAVAILABLE: "Service Unavailable",
+    GATEWAY_TIMEOUT: "Gateway Timeout",
 }
 
-CacheRecord = collections.namedtuple('CacheRecord', 'value expire')
+SCAN_LIMIT_MAX = 10000
+SCAN_CHUNK_SIZE = 100
+CACHE_SWEEP_INTERVAL = 1.0
+# how long index_query and data_scan wait for the indexes built at start
+INDEX_WAIT = 1.0
+
+ScanStream = collections.namedtuple('ScanStream', 'items limit')
+RawResponse = collections.namedtuple('RawResponse', 'body')
 
-cache = {}
+cache = expirecache.ExpiringCache()
+storage = None
+dispatcher = None
 
 
 def cache_get(request, headers, context):
@@ -38,16 +58,8 @@ def cache_get(request, headers, context):
     key = request['key']
     if key is None:
         return 'key is empty', INVALID_REQUEST
-    value = None
-
-    if key in cache:
-        record = cache[key]
-        if record.expire is None or record.expire >= time.time():
-            value = record.value
-        else:
-            del cache[key]
 
-    return value, OK
+    return cache.get(key), OK
 
 
 def cache_set(request, headers, context):
@@ -61,7 +73,7 @@ def cache_set(request, headers, context):
 
     value = request.get('value', None)
     timeout = request.get('timeout', None)
-    cache[request['key']] = CacheRecord(value, None if timeout is None else time.time() + timeout)
+    cache.set(key, value, timeout)
 
     return None, OK
 
@@ -74,11 +86,14 @@ def data_get(request, headers, context):
         return 'key is empty', INVALID_REQUEST
     value = None
 
-    key = base64.b64encode(request['key'].encode('utf-8')).decode('utf-8')
-    path_rec = pathlib.Path(opts.storage) / (key + '.rec')
-    if not path_rec.is_file():
-        return 'no data found', INVALID_REQUEST
-    value = json.loads(path_rec.read_text())
+    try:
+        if request.get('encoding') == 'codes':
+            codes = storage.get_codes(key)
+            value = {'value': storage.get(key)} if codes is None else {'codes': codes.tolist()}
+        else:
+            value = storage.get(key)
+    except KeyError:
+        return 'no data found', NOT_FOUND
 
     return value, OK
 
@@ -92,52 +107,168 @@ def data_set(request, headers, context):
     if 'value' not in request:
         return 'value not found', INVALID_REQUEST
 
-    key = base64.b64encode(request['key'].encode('utf-8')).decode('utf-8')
-    path_rec = pathlib.Path(opts.storage) / (key + '.rec')
-    path_rec_tmp = path_rec.with_suffix('{:s}.{:s}.tmp'.format(path_rec.suffix, context['request_id']))
-    try:
-        path_rec_tmp.write_text(json.dumps(request['value']))
-        path_rec_tmp.rename(path_rec)
-    finally:
-        if path_rec_tmp.is_file():
-            path_rec_tmp.unlink()
+    # the request id may come from a client, the temporary file gets an id of
+    # this process so concurrent writers never share it
+    storage.set(key, request['value'], requestid.generate())
 
     return None, OK
 
 
-class MainHTTPHandler(BaseHTTPRequestHandler):
-    router = {"cache_get": cache_get, "cache_set": cache_set, "data_get": data_get, "data_set": data_set}
+def categories_get(request, headers, context):
+    offset = request.get('offset', 0)
+    if not isinstance(offset, int) or offset < 0:
+        return 'offset must be non negative number', INVALID_REQUEST
+    return storage.categories.since(offset), OK
+
+
+def index_query(request, headers, context):
+    all_names, any_names = request.get('all', []), request.get('any', [])
+    if not isinstance(all_names, list) or not isinstance(any_names, list):
+        return 'all and any must be lists of interests', INVALID_REQUEST
+    cursor, limit = request.get('cursor'), request.get('limit', 100)
+    if cursor is not None and not isinstance(cursor, int):
+        return 'cursor must be number', INVALID_REQUEST
+    if not isinstance(limit, int) or limit <= 0:
+        return 'limit must be positive number', INVALID_REQUEST
+    if not storage.indexes_ready.wait(INDEX_WAIT):
+        return 'indexes are being built', SERVICE_UNAVAILABLE
+    codes = storage.categories.codes
+    if any(name not in codes for name in all_names):
+        return {'ids': [], 'cursor': None}, OK
+    any_codes = [codes[name] for name in any_names if name in codes]
+    if any_names and not any_codes:
+        return {'ids': [], 'cursor': None}, OK
+    ids, cursor = storage.index.query([codes[name] for name in all_names], any_codes, cursor, limit)
+    return {'ids': ids, 'cursor': cursor}, OK
+
+
+def data_scan(request, headers, context):
+    bounds = {}
+    for name in ['prefix', 'start', 'end', 'cursor']:
+        bounds[name] = request.get(name)
+        if bounds[name] is not None and not isinstance(bounds[name], str):
+            return '{:s} must be string'.format(name), INVALID_REQUEST
+    limit = request.get('limit', 100)
+    if not isinstance(limit, int) or not 0 < limit <= SCAN_LIMIT_MAX:
+        return 'limit must be from 1 to {:d}'.format(SCAN_LIMIT_MAX), INVALID_REQUEST
+    if not storage.indexes_ready.wait(INDEX_WAIT):
+        return 'indexes are being built', SERVICE_UNAVAILABLE
+    return ScanStream(storage.scan(**bounds), limit), OK
+
+
+def make_forward(method):
+    def forward(request, headers, context):
+        key = request.get('key')
+        if key is None:
+            return 'key is empty', INVALID_REQUEST
+        status, body = dispatcher.forward(str(key), method, request, headers, context['request_id'])
+        return RawResponse(body), status
+    return forward
+
+
+def dispatch_data_get(request, headers, context):
+    if request.get('encoding') != 'codes' or request.get('key') is None:
+        return make_forward('/data_get')(request, headers, context)
+    return dispatcher.get_codes(str(request['key']), request, headers, context['request_id'])
+
+
+def dispatch_categories_get(request, headers, context):
+    offset = request.get('offset', 0)
+    if not isinstance(offset, int) or offset < 0:
+        return 'offset must be non negative number', INVALID_REQUEST
+    return dispatcher.categories.since(offset), OK
+
+
+def dispatch_index_query(request, headers, context):
+    limit = request.get('limit', 100)
+    if not isinstance(limit, int) or limit <= 0:
+        return 'limit must be positive number', INVALID_REQUEST
+    return dispatcher.query_index(request, headers, limit, context['request_id'])
+
+
+def dispatch_data_scan(request, headers, context):
+    limit = request.get('limit', 100)
+    if not isinstance(limit, int) or not 0 < limit <= SCAN_LIMIT_MAX:
+        return 'limit must be from 1 to {:d}'.format(SCAN_LIMIT_MAX), INVALID_REQUEST
+    items, code = dispatcher.scan(request, headers, limit, context['request_id'])
+    if code != OK:
+        return items, code
+    return ScanStream(iter(items), limit), OK
+
+
+DISPATCH_ROUTER = {
+    "cache_get": make_forward('/cache_get'),
+    "cache_set": make_forward('/cache_set'),
+    "data_get": dispatch_data_get,
+    "data_set": make_forward('/data_set'),
+    "categories_get": dispatch_categories_get,
+    "index_query": dispatch_index_query,
+    "data_scan": dispatch_data_scan,
+}
+
 
-    def get_request_id(self, headers):
-        return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
+class MainHTTPHandler(transport.PersistentHTTPRequestHandler):
+    connection_stats = transport.ConnectionStats()
+    router = {
+        "cache_get": cache_get,
+        "cache_set": cache_set,
+        "data_get": data_get,
+        "data_set": data_set,
+        "categories_get": categories_get,
+        "index_query": index_query,
+        "data_scan": data_scan,
+    }
+
+    def is_expired(self, headers):
+        deadline = headers.get('X-Request-Deadline')
+        if deadline is None:
+            return False
+        try:
+            return float(deadline) <= time.time()
+        except ValueError:
+            return False
 
     def do_GET(self):
         code = NOT_FOUND
-        context = {"request_id": self.get_request_id(self.headers)}
+        context = {"request_id": requestid.begin(self.headers)}
+        if self.profile_endpoint and self.path.startswith(profiler.PATH):
+            # kvs.py has no auth, only local users reach its unix socket
+            return profiler.serve_profile(self, isinstance(self.server, transport.UnixHTTPServer))
 
+        response = None
         path = self.path.strip("/")
         if path == 'ping':
             code = OK
+        elif path == 'metrics':
+            response, code = self.connection_stats.snapshot(), OK
 
-        self.make_response(None, code, context)
+        self.make_response(response, code, context)
         return
 
     def do_POST(self):
         response, code = {}, OK
-        context = {"request_id": self.get_request_id(self.headers)}
+        context = {"request_id": requestid.begin(self.headers)}
         request = None
         data_string = None
         try:
             data_string = self.rfile.read(int(self.headers['Content-Length']))
+            data_string = compression.decode_body(data_string, self.headers.get('Content-Encoding'))
             request = json.loads(data_string.decode("utf-8"))
+        except compression.BodyTooLarge as e:
+            logging.warning("Rejected request body: %s", e)
+            code = REQUEST_TOO_LARGE
+            self.close_connection = True
         except Exception as e:
             logging.exception(e)
             code = BAD_REQUEST
+            self.close_connection = True
 
         if request:
             path = self.path.strip("/")
-            logging.info("%s: %s %s" % (self.path, data_string, context["request_id"]))
-            if path in self.router:
+            logging.info("%s: %s" % (self.path, data_string))
+            if self.is_expired(self.headers):
+                response, code = 'request deadline exceeded', GATEWAY_TIMEOUT
+            elif path in self.router:
                 try:
                     response, code = self.router[path](request, self.headers, context)
                 except Exception as e:
@@ -150,37 +281,206 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
         return
 
     def make_response(self, response, code, context):
+        if isinstance(response, ScanStream):
+            return self.make_stream_response(response, code, context)
+        if isinstance(response, RawResponse):
+            # a worker response is passed on as it is
+            context["code"] = code
+            data = response.body
+        else:
+            if code not in ERRORS:
+                r = {"response": response, "code": code}
+            else:
+                r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
+            context.update(r)
+            data = json.dumps(r).encode("utf-8")
+        logging.info(context)
+        body, encoding = compression.encode_body(data, self.headers.get('Accept-Encoding'))
         self.send_response(code)
         self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Encoding", compression.DEFLATE)
+        self.send_header(requestid.HEADER, context["request_id"])
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
         self.end_headers()
-        if code not in ERRORS:
-            r = {"response": response, "code": code}
+        self.wfile.write(body)
+        return
+
+    def make_stream_response(self, stream, code, context):
+        # items are sent as they are read, a page is never held in memory whole,
+        # so the length is unknown: chunked for HTTP/1.1, closed for HTTP/1.0
+        items = iter(stream.items)
+        try:
+            # a scan that fails on its first read still gets an error response
+            first = next(items, None)
+        except Exception as e:
+            logging.exception("Unexpected error: %s" % e)
+            return self.make_response(None, INTERNAL_ERROR, context)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header(requestid.HEADER, context["request_id"])
+        if self.chunked():
+            self.send_header("Transfer-Encoding", "chunked")
         else:
-            r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
-        context.update(r)
+            self.close_connection = True
+        self.end_headers()
+        try:
+            count, cursor = self.write_scan_items(itertools.chain([first] if first else [], items), stream.limit)
+        except Exception as e:
+            # the status is out already: the body is cut short without its
+            # last chunk and the connection closed, a client sees an
+            # incomplete response rather than a short page
+            logging.exception("Scan failed after the response started: %s" % e)
+            self.close_connection = True
+            context.update({"code": INTERNAL_ERROR})
+            logging.info(context)
+            return
+        self.write_chunk('], "cursor": {:s}}}, "code": {:d}}}'.format(json.dumps(cursor), code).encode('utf-8'))
+        self.end_chunks()
+        context.update({"code": code, "count": count, "cursor": cursor})
         logging.info(context)
-        self.wfile.write(json.dumps(r).encode("utf-8"))
-        return
+
+    def write_scan_items(self, items, limit):
+        self.write_chunk(b'{"response": {"items": [')
+        count, last_key, cursor, chunk = 0, None, None, []
+        for key, value in items:
+            if count == limit:
+                cursor = last_key
+                break
+            chunk.append([key, value])
+            last_key = key
+            count += 1
+            if len(chunk) == SCAN_CHUNK_SIZE:
+                self.write_scan_chunk(chunk, count == len(chunk))
+                chunk = []
+        if chunk:
+            self.write_scan_chunk(chunk, count == len(chunk))
+        return count, cursor
+
+    def write_scan_chunk(self, chunk, first):
+        data = json.dumps(chunk)[1:-1]
+        self.write_chunk((data if first else ', ' + data).encode('utf-8'))
+        self.wfile.flush()
 
     def log_message(self, format, *args):
         logging.info('HTTP: ' + format, *args)
 
 
+def open_storage(path, opts, codec):
+    global cache
+    cache = expirecache.ExpiringCache()
+    threading.Thread(target=sweep_cache, args=(CACHE_SWEEP_INTERVAL,), daemon=True).start()
+    storage = filestorage.FileStorage(path, opts.fd_cache, codec)
+    threading.Thread(target=storage.build_indexes, daemon=True).start()
+    if opts.migrate:
+        threading.Thread(target=storage.migrate, daemon=True).start()
+    return storage
+
+
+def sweep_cache(interval):
+    while True:
+        time.sleep(interval)
+        cache.sweep()
+
+
+def interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def serve_worker(index, opts, codec):
+    global storage
+    signal.signal(signal.SIGTERM, interrupt)
+    path = os.path.join(opts.storage, partition.WORKER_DIR.format(index))
+    os.makedirs(path, exist_ok=True)
+    storage = open_storage(path, opts, codec)
+    server = transport.ThreadingUnixHTTPServer(
+        os.path.join(opts.storage, partition.WORKER_SOCKET.format(index)), MainHTTPHandler)
+    logging.info("Starting worker %d, pid %d" % (index, os.getpid()))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    # a second SIGTERM, from the dispatcher after the process group, must not
+    # cut the shutdown short
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    server.server_close()
+    storage.close()
+    if opts.profile:
+        MainHTTPHandler.profile_collector.dump(profiler.profile_path(opts.profile, True))
+    log_pipeline.stop()
+    os._exit(0)
+
+
 if __name__ == "__main__":
     op = OptionParser()
     op.add_option("-p", "--port", action="store", type=int, default=8010)
+    op.add_option("-u", "--unix", action="store", default=None)
     op.add_option("-l", "--log", action="store", default=None)
     op.add_option("-s", "--storage", action="store", default='.')
+    op.add_option("-w", "--workers", action="store", type=int, default=1)
+    op.add_option("--fd-cache", action="store", type=int, default=0)
+    op.add_option("--migrate", action="store_true", default=False)
+    op.add_option("--compress", action="store_true", default=False)
+    op.add_option("--zdict", action="store", default=None)
+    op.add_option("--idle-timeout", action="store", type=float, default=5.0)
+    op.add_option("--max-requests", action="store", type=int, default=1000)
+    op.add_option("--profile", action="store", default=None)
+    op.add_option("--profile-endpoint", action="store_true", default=False)
     (opts, args) = op.parse_args()
-    logging.basicConfig(
-        filename=opts.log,
-        level=logging.INFO,
-        format='[%(asctime)s] %(levelname).1s %(message)s',
-        datefmt='%Y.%m.%d %H:%M:%S')
-    server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
-    logging.info("Starting server at %s" % opts.port)
+    log_pipeline = requestid.setup_logging(opts.log)
+    zdict = None
+    if opts.zdict:
+        with open(opts.zdict, 'rb') as zdict_file:
+            zdict = zdict_file.read()
+    codec = compression.RecordCodec(opts.compress, zdict or compression.DEFAULT_ZDICT)
+    MainHTTPHandler.timeout = opts.idle_timeout
+    MainHTTPHandler.max_requests = opts.max_requests
+    if opts.profile or opts.profile_endpoint:
+        # cProfile and pstats are large imports, only paid when profiling
+        import profiler
+        MainHTTPHandler.profile_endpoint = opts.profile_endpoint
+        if opts.profile:
+            MainHTTPHandler.profile_collector = profiler.ProfileCollector()
+    # with several workers each one owns the keys partitioned to it in its own
+    # storage directory and this process only dispatches requests to them
+    workers = []
+    if opts.workers > 1:
+        # the dispatcher and its thread pool are only needed with workers
+        import partition
+        for index in range(opts.workers):
+            pid = os.fork()
+            if pid == 0:
+                serve_worker(index, opts, codec)
+            workers.append(pid)
+        signal.signal(signal.SIGTERM, interrupt)
+        dispatcher = partition.Dispatcher(opts.storage, opts.workers)
+        dispatcher.wait_ready()
+        MainHTTPHandler.router = DISPATCH_ROUTER
+    else:
+        storage = open_storage(opts.storage, opts, codec)
+        if opts.profile:
+            # the profile is written on the way out
+            signal.signal(signal.SIGTERM, interrupt)
+    # a persistent connection holds its handler, connections are served in
+    # threads so an idle one does not block the others
+    if opts.unix:
+        server = transport.ThreadingUnixHTTPServer(opts.unix, MainHTTPHandler)
+    else:
+        server = ThreadingHTTPServer(("localhost", opts.port), MainHTTPHandler)
+    logging.info("Starting server at %s" % (opts.unix or opts.port))
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         pass
     server.server_close()
+    if dispatcher is not None:
+        dispatcher.close()
+    for pid in workers:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+    if storage is not None:
+        storage.close()
+    if opts.profile:
+        MainHTTPHandler.profile_collector.dump(profiler.profile_path(opts.profile, False))
+    log_pipeline.stop()
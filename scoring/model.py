@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import abc
+import os
+import json
+import time
+import logging
+import threading
+
+import dates
+
+COST_CHEAP = 0
+COST_EXPENSIVE = 1
+COSTS = {
+    'cheap': COST_CHEAP,
+    'expensive': COST_EXPENSIVE,
+}
+FIELDS = ('phone', 'email', 'birthday', 'gender', 'first_name', 'last_name')
+
+
+class ScoreModel(abc.ABC):
+    # cheap models are evaluated inline on every request, expensive ones
+    # are worth a cache round trip to the store
+    cost = COST_EXPENSIVE
+    version = None
+
+    @abc.abstractmethod
+    def score(self, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+        pass
+
+
+class PresenceScoreModel(ScoreModel):
+    cost = COST_CHEAP
+    version = 'presence-1'
+    PHONE_WEIGHT = 1.5
+    EMAIL_WEIGHT = 1.5
+    BIRTHDAY_GENDER_WEIGHT = 1.5
+    NAME_WEIGHT = 0.5
+
+    def __init__(self):
+        weights = [self.PHONE_WEIGHT, self.EMAIL_WEIGHT, self.BIRTHDAY_GENDER_WEIGHT, self.NAME_WEIGHT]
+        self.table = []
+        for mask in range(1 << len(weights)):
+            self.table.append(sum(weight for bit, weight in enumerate(weights) if mask & (1 << bit)))
+
+    def score(self, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+        mask = 0
+        if phone:
+            mask |= 1
+        if email:
+            mask |= 2
+        if birthday and gender:
+            mask |= 4
+        if first_name and last_name:
+            mask |= 8
+        return self.table[mask]
+
+
+def transform_present(params):
+    return lambda value: 1.0 if value else 0.0
+
+
+def transform_equals(params):
+    expected = params['value']
+    return lambda value: 1.0 if value == expected else 0.0
+
+
+def transform_age_between(params):
+    low, high = params.get('min', 0), params.get('max', 200)
+
+    def transform(value):
+        if value is None:
+            return 0.0
+        today = dates.today()
+        age = today.year - value.year - ((today.month, today.day) < (value.month, value.day))
+        return 1.0 if low <= age <= high else 0.0
+
+    return transform
+
+
+TRANSFORMS = {
+    'present': transform_present,
+    'equals': transform_equals,
+    'age_between': transform_age_between,
+}
+
+
+class CompiledScoreModel(ScoreModel):
+    def __init__(self, version, cost, evaluate):
+        self.version = version
+        self.cost = cost
+        self.evaluate = evaluate
+
+    def score(self, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+        return self.evaluate(phone, email, birthday, gender, first_name, last_name)
+
+
+def compile_model(spec):
+    features = {}
+    for feature_name, feature in spec['features'].items():
+        if feature['field'] not in FIELDS:
+            raise ValueError('unknown field {!s} in feature {:s}'.format(feature['field'], feature_name))
+        if feature['transform'] not in TRANSFORMS:
+            raise ValueError('unknown transform {!s} in feature {:s}'.format(feature['transform'], feature_name))
+        features[feature_name] = (FIELDS.index(feature['field']), TRANSFORMS[feature['transform']](feature))
+    terms = []
+    for term in spec['terms']:
+        terms.append((float(term['weight']), [features[feature_name] for feature_name in term['features']]))
+    bias = float(spec.get('bias', 0))
+
+    def evaluate(*values):
+        score = bias
+        for weight, term_features in terms:
+            for field_index, transform in term_features:
+                weight *= transform(values[field_index])
+                if not weight:
+                    break
+            score += weight
+        return score
+
+    cost = COSTS[spec.get('cost', 'expensive')]
+    if all(feature['transform'] == 'present' for feature in spec['features'].values()):
+        # presence only models depend on 2^6 truthiness combinations,
+        # evaluate all of them once and serve from a table
+        table = []
+        for mask in range(1 << len(FIELDS)):
+            table.append(evaluate(*[bool(mask & (1 << bit)) for bit in range(len(FIELDS))]))
+
+        def evaluate(*values):
+            mask = 0
+            for bit, value in enumerate(values):
+                if value:
+                    mask |= 1 << bit
+            return table[mask]
+
+        cost = COST_CHEAP
+    return CompiledScoreModel(str(spec['version']), cost, evaluate)
+
+
+def load_model(path):
+    with open(path) as model_file:
+        return compile_model(json.load(model_file))
+
+
+class ModelHolder(object):
+    def __init__(self, model, check_interval=1.0):
+        self.model = model
+        self.path = None
+        self.mtime = None
+        self.check_interval = check_interval
+        self.next_check = 0
+        self.lock = threading.Lock()
+
+    def current(self):
+        if self.path is not None and time.monotonic() >= self.next_check:
+            self.next_check = time.monotonic() + self.check_interval
+            try:
+                if os.stat(self.path).st_mtime != self.mtime:
+                    self.reload()
+            except OSError as e:
+                logging.error("Model file check failed: %s" % e)
+        return self.model
+
+    def watch(self, path):
+        mtime = os.stat(path).st_mtime
+        model = load_model(path)
+        with self.lock:
+            self.path, self.mtime, self.model = path, mtime, model
+        logging.info("Score model %s loaded from %s" % (model.version, path))
+
+    def reload(self):
+        with self.lock:
+            try:
+                mtime = os.stat(self.path).st_mtime
+                model = load_model(self.path)
+            except Exception as e:
+                # a spec of the wrong shape fails in any way compile_model
+                # happens to touch it, none of them may take the server down
+                logging.exception("Score model reload failed, keep %s: %s" % (self.model.version, e))
+                return False
+            # a single reference assignment, requests in flight keep the old model
+            self.mtime, self.model = mtime, model
+        logging.info("Score model %s loaded from %s" % (model.version, self.path))
+        return True
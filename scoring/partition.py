@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import heapq
+import itertools
+import hashlib
+import threading
+import http.client
+import concurrent.futures
+
+import interests
+import requestid
+import transport
+
+OK = 200
+WORKER_DIR = 'worker-{:d}'
+WORKER_SOCKET = 'worker-{:d}.sock'
+FORWARD_HEADERS = ('X-Request-Deadline',)
+
+
+def partition(key, count):
+    # md5 like the storage shards, so the split does not depend on
+    # PYTHONHASHSEED and survives restarts
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big') % count
+
+
+class WorkerClient(object):
+    # connections to one worker are shared by all request threads: taken from
+    # the pool for a request and put back after it, at most POOL_SIZE idle
+    # ones are kept and the rest closed, so threads that come and go with
+    # client connections do not leave a connection each behind
+    POOL_SIZE = 16
+
+    def __init__(self, path, timeout):
+        self.path = path
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.pool = []
+
+    def acquire(self):
+        with self.lock:
+            if self.pool:
+                return self.pool.pop()
+        return transport.UnixHTTPConnection(self.path, self.timeout)
+
+    def release(self, connect):
+        with self.lock:
+            if len(self.pool) < self.POOL_SIZE:
+                self.pool.append(connect)
+                return
+        connect.close()
+
+    def close(self):
+        with self.lock:
+            pool, self.pool = self.pool, []
+        for connect in pool:
+            connect.close()
+
+    def request(self, method, body, headers):
+        connect = self.acquire()
+        reused = connect.sock is not None
+        try:
+            try:
+                connect.request('POST', method, body, headers)
+                response = connect.getresponse()
+            except (ConnectionResetError, BrokenPipeError):
+                # the worker closed an idle connection, the request was not served
+                if not reused:
+                    raise
+                connect.close()
+                connect.request('POST', method, body, headers)
+                response = connect.getresponse()
+            result = response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            connect.close()
+            raise
+        self.release(connect)
+        return result
+
+
+class Dispatcher(object):
+    # front of kvs.py running as several worker processes: keyed requests go to
+    # the worker owning the key, index queries and scans are asked from every
+    # worker and merged; category codes are per worker, so they are translated
+    # to a table of the dispatcher which clients mirror
+    def __init__(self, root, count, timeout=10.0):
+        self.root = str(root)
+        self.count = count
+        self.workers = [WorkerClient(self.socket_path(index), timeout) for index in range(count)]
+        self.mirrors = [interests.CategoryTable() for _ in range(count)]
+        self.categories = interests.CategoryTable(os.path.join(self.root, 'categories.jsonl'))
+        self.executor = concurrent.futures.ThreadPoolExecutor(count)
+
+    def wait_ready(self, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        for index in range(self.count):
+            while True:
+                connect = transport.UnixHTTPConnection(self.socket_path(index), 1)
+                try:
+                    connect.request('GET', '/ping', headers={'Connection': 'close'})
+                    response = connect.getresponse()
+                    response.read()
+                    if response.status == OK:
+                        break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise
+                finally:
+                    connect.close()
+                time.sleep(0.05)
+
+    def storage_path(self, index):
+        return os.path.join(self.root, WORKER_DIR.format(index))
+
+    def socket_path(self, index):
+        return os.path.join(self.root, WORKER_SOCKET.format(index))
+
+    def request(self, index, method, request, headers, request_id=None):
+        # the id is passed along rather than read from the thread, broadcast
+        # sends from the threads of the executor
+        forward = {'Content-Type': 'application/json'}
+        for name in FORWARD_HEADERS:
+            if headers.get(name) is not None:
+                forward[name] = headers[name]
+        if request_id is not None:
+            forward[requestid.HEADER] = request_id
+        return self.workers[index].request(method, json.dumps(request), forward)
+
+    def forward(self, key, method, request, headers, request_id=None):
+        return self.request(partition(key, self.count), method, request, headers, request_id)
+
+    def broadcast(self, method, request, headers, request_id=None):
+        futures = [self.executor.submit(self.request, index, method, request, headers, request_id)
+                   for index in range(self.count)]
+        return [future.result() for future in futures]
+
+    def translate_codes(self, index, codes, headers, request_id=None):
+        mirror = self.mirrors[index]
+        if codes and max(codes) >= len(mirror):
+            status, body = self.request(index, '/categories_get', {'offset': len(mirror)}, headers, request_id)
+            mirror.extend(json.loads(body.decode('utf-8'))['response'])
+        return self.categories.encode(mirror.decode(codes)).tolist()
+
+    def get_codes(self, key, request, headers, request_id=None):
+        index = partition(key, self.count)
+        status, body = self.request(index, '/data_get', request, headers, request_id)
+        response = json.loads(body.decode('utf-8'))
+        if response['code'] != OK:
+            return response.get('error'), response['code']
+        value = response['response']
+        if 'codes' in value:
+            value = {'codes': self.translate_codes(index, value['codes'], headers, request_id)}
+        return value, OK
+
+    def query_index(self, request, headers, limit, request_id=None):
+        # one id more than the page from every worker tells if the merged
+        # result goes on past the page
+        ids = []
+        for status, body in self.broadcast('/index_query', dict(request, limit=limit + 1), headers, request_id):
+            response = json.loads(body.decode('utf-8'))
+            if response['code'] != OK:
+                return response.get('error'), response['code']
+            ids.extend(response['response']['ids'])
+        ids.sort()
+        if len(ids) > limit:
+            return {'ids': ids[:limit], 'cursor': ids[limit - 1]}, OK
+        return {'ids': ids, 'cursor': None}, OK
+
+    def scan(self, request, headers, limit, request_id=None):
+        # every worker returns at most limit items in key order, the first
+        # limit of their merge is the page; a trailing blank item marks that more
+        # items follow, which is all the scan stream needs to set a cursor
+        pages, more = [], False
+        for status, body in self.broadcast('/data_scan', request, headers, request_id):
+            response = json.loads(body.decode('utf-8'))
+            if response['code'] != OK:
+                return response.get('error'), response['code']
+            pages.append([tuple(item) for item in response['response']['items']])
+            more = more or response['response']['cursor'] is not None
+        items = list(itertools.islice(heapq.merge(*pages), limit + 1))
+        if more and len(items) == limit:
+            items.append((None, None))
+        return items, OK
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        for worker in self.workers:
+            worker.close()
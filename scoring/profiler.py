@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import marshal
+import pstats
+import cProfile
+import threading
+import collections
+import urllib.parse
+
+PATH = '/debug/profile'
+OK = 200
+BAD_REQUEST = 400
+FORBIDDEN = 403
+CONFLICT = 409
+DEFAULT_SECONDS = 10.0
+MAX_SECONDS = 300.0
+DEFAULT_INTERVAL = 0.005
+MIN_INTERVAL = 0.001
+COLLAPSED = 'collapsed'
+PSTATS = 'pstats'
+TOKEN_HEADER = 'X-Admin-Token'
+CONTENT_TYPES = {
+    COLLAPSED: 'text/plain; charset=utf-8',
+    PSTATS: 'application/octet-stream',
+}
+
+
+class Sampler(object):
+    # wall clock sampling of the stacks of all threads but the sampling one,
+    # driven by a thread rather than a signal so the threads serving requests
+    # are seen and not only the main one; a stack is a tuple of
+    # (file, first line, function) from the outermost frame in
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+
+    def sample(self, ignore):
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == ignore:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+        self.samples += 1
+
+    def run(self, seconds):
+        ignore = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            self.sample(ignore)
+            time.sleep(self.interval)
+        return self
+
+    def collapsed(self):
+        # one line per stack, frames outermost first joined by ';' and the
+        # number of samples, as flame graph tools read it
+        lines = []
+        for stack, count in self.stacks.most_common():
+            frames = ';'.join('{:s} ({:s}:{:d})'.format(name, os.path.basename(filename), line)
+                              for filename, line, name in stack)
+            lines.append('{:s} {:d}\n'.format(frames, count))
+        return ''.join(lines)
+
+    def stats(self):
+        # samples in the layout of pstats: the count of samples a function is
+        # on the stack stands for its calls, its time is that count times the
+        # interval, own time counts the samples it is the innermost frame
+        stats = {}
+        for stack, count in self.stacks.items():
+            seconds = count * self.interval
+            seen = set()
+            for depth, function in enumerate(stack):
+                innermost = depth == len(stack) - 1
+                cc, nc, tt, ct, callers = stats.get(function, (0, 0, 0.0, 0.0, {}))
+                if function not in seen:
+                    cc, nc, ct = cc + count, nc + count, ct + seconds
+                    seen.add(function)
+                if innermost:
+                    tt += seconds
+                if depth:
+                    caller = stack[depth - 1]
+                    edge = callers.get(caller, (0, 0, 0.0, 0.0))
+                    callers[caller] = (edge[0] + count, edge[1] + count,
+                                       edge[2] + (seconds if innermost else 0.0), edge[3] + seconds)
+                stats[function] = (cc, nc, tt, ct, callers)
+        return stats
+
+    def dump(self, output):
+        if output == PSTATS:
+            return marshal.dumps(self.stats())
+        return self.collapsed().encode('utf-8')
+
+
+def parse_query(path):
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(path).query)
+    seconds = float(query.get('seconds', [DEFAULT_SECONDS])[0])
+    interval = float(query.get('interval', [DEFAULT_INTERVAL])[0])
+    output = query.get('format', [COLLAPSED])[0]
+    if not 0 < seconds <= MAX_SECONDS:
+        raise ValueError('seconds must be from 0 to {:.0f}'.format(MAX_SECONDS))
+    if not MIN_INTERVAL <= interval <= seconds:
+        raise ValueError('interval must be from {:.3f} to seconds'.format(MIN_INTERVAL))
+    if output not in CONTENT_TYPES:
+        raise ValueError('format must be {:s} or {:s}'.format(COLLAPSED, PSTATS))
+    return seconds, interval, output
+
+
+sampling = threading.Lock()
+
+
+def serve_profile(handler, allowed):
+    # GET /debug/profile?seconds=N&interval=S&format=collapsed|pstats samples
+    # the process for N seconds in the requesting thread, one profile at a time;
+    # the server tells if the client may profile it
+    if not allowed:
+        return send(handler, FORBIDDEN, b'profile not allowed', CONTENT_TYPES[COLLAPSED])
+    try:
+        seconds, interval, output = parse_query(handler.path)
+    except ValueError as e:
+        return send(handler, BAD_REQUEST, str(e).encode('utf-8'), CONTENT_TYPES[COLLAPSED])
+    if not sampling.acquire(blocking=False):
+        return send(handler, CONFLICT, b'profile already running', CONTENT_TYPES[COLLAPSED])
+    try:
+        body = Sampler(interval).run(seconds).dump(output)
+    finally:
+        sampling.release()
+    return send(handler, OK, body, CONTENT_TYPES[output])
+
+
+def send(handler, code, body, content_type):
+    handler.send_response(code)
+    handler.send_header('Content-Type', content_type)
+    handler.send_header('Content-Length', str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+class ProfileCollector(object):
+    # deterministic profile of the server for --profile: cProfile follows one
+    # thread, so every connection thread runs under a profiler of its own and
+    # their stats are merged when the thread is done
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = None
+
+    def runcall(self, func, *args):
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args)
+        finally:
+            with self.lock:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+
+    def dump(self, path):
+        with self.lock:
+            if self.stats is not None:
+                self.stats.dump_stats(path)
+
+
+def profile_path(path, worker):
+    # workers of one server write next to each other
+    return path if not worker else '{:s}.{:d}'.format(path, os.getpid())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import queue
+import logging
+import itertools
+import threading
+import logging.handlers
+
+HEADER = 'X-Request-Id'
+MAX_LENGTH = 128
+LOG_FORMAT = '[%(asctime)s] %(levelname).1s %(request_id)s %(message)s'
+LOG_DATEFMT = '%Y.%m.%d %H:%M:%S'
+NO_REQUEST = '-'
+
+local = threading.local()
+
+
+class IdGenerator(object):
+    # ids are pid, process start time and a counter in hex: unique while pids
+    # are not reused within a second, and next() on a count is atomic under
+    # the GIL, so no lock and no random bytes per request
+    def __init__(self):
+        self.reset()
+        os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        self.prefix = '{:x}-{:x}-'.format(os.getpid(), int(time.time()))
+        self.counter = itertools.count(1)
+
+    def __call__(self):
+        return '%s%x' % (self.prefix, next(self.counter))
+
+
+generate = IdGenerator()
+
+
+def begin(headers):
+    # id of the request the current thread serves: the one of the client if it
+    # sent a sane one, a new one otherwise
+    request_id = headers.get(HEADER)
+    if not request_id or len(request_id) > MAX_LENGTH or not request_id.isprintable():
+        request_id = generate()
+    local.request_id = request_id
+    return request_id
+
+
+def current():
+    return getattr(local, 'request_id', None)
+
+
+class RequestIdFilter(logging.Filter):
+    # runs in the thread emitting the record, before it is queued
+    def filter(self, record):
+        record.request_id = getattr(local, 'request_id', None) or NO_REQUEST
+        return True
+
+
+class LogPipeline(object):
+    # records are stamped with the request id and queued by request threads,
+    # a listener thread formats and writes them; a forked child gets a
+    # listener of its own as threads do not survive fork
+    def __init__(self, handler):
+        self.queue = queue.SimpleQueue()
+        self.handler = handler
+        self.queue_handler = logging.handlers.QueueHandler(self.queue)
+        self.queue_handler.addFilter(RequestIdFilter())
+        self.listener = None
+        self.start()
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def start(self):
+        self.listener = logging.handlers.QueueListener(self.queue, self.handler)
+        self.listener.start()
+
+    def after_fork(self):
+        if self.listener is not None:
+            self.start()
+
+    def stop(self):
+        # writes out the records queued so far
+        self.listener.stop()
+        self.listener = None
+
+
+def setup_logging(filename=None, level=logging.INFO):
+    handler = logging.FileHandler(filename) if filename else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATEFMT))
+    pipeline = LogPipeline(handler)
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(pipeline.queue_handler)
+    return pipeline
@@ -1,35 +1,27 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import hashlib
-import json
+import cachekey
+import model as score_model
 
+model_holder = score_model.ModelHolder(score_model.PresenceScoreModel())
 
-def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
-    key_parts = [
-        first_name or "",
-        last_name or "",
-        birthday.strftime("%Y%m%d") if birthday is not None else "",
-    ]
-    key = "uid:" + hashlib.md5("".join(key_parts).encode('utf-8')).hexdigest()
+
+def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None, model=None):
+    model = model or model_holder.current()
+    if model.cost == score_model.COST_CHEAP:
+        return model.score(phone, email, birthday, gender, first_name, last_name)
+    key = cachekey.make_key("uid:{!s}:".format(model.version), phone, email, birthday, gender, first_name, last_name)
     # try get from cache,
     # fallback to heavy calculation in case of cache miss
     score = store.cache_get(key) or 0
     if score:
         return score
-    if phone:
-        score += 1.5
-    if email:
-        score += 1.5
-    if birthday and gender:
-        score += 1.5
-    if first_name and last_name:
-        score += 0.5
+    score = model.score(phone, email, birthday, gender, first_name, last_name)
     # cache for 60 minutes
     store.cache_set(key, score, 60 * 60)
     return score
 
 
 def get_interests(store, cid):
-    r = store.get("i:%s" % cid)
-    return json.loads(r) if r else []
+    return store.get_interests("i:%s" % cid)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import struct
+import hashlib
+import multiprocessing
+import multiprocessing.shared_memory
+
+DIGEST_SIZE = 16
+FLAG_USED = 1
+FLAG_REFERENCED = 2
+
+
+class SharedCache(object):
+    # fixed size open addressing table of float values in one shared memory
+    # segment, created before api.py forks its workers and inherited by them;
+    # slots are split into stripes, each guarded by its own lock, a key probes
+    # only the slots of the stripe its hash falls in; every stripe has a
+    # header with its CLOCK hand and hit and miss counts, so the counts are
+    # those of all workers
+    SLOT = struct.Struct('<B16sdd')
+    STRIPE = struct.Struct('<IQQ')
+    HAND = struct.Struct('<I')
+    COUNTER = struct.Struct('<Q')
+    HITS_OFFSET = HAND.size
+    MISSES_OFFSET = HAND.size + COUNTER.size
+    PROBE_LIMIT = 8
+
+    def __init__(self, slots=65536, stripes=64, ttl=60.0):
+        self.stripes = max(1, min(int(stripes), int(slots)))
+        self.stripe_size = max(int(slots) // self.stripes, 1)
+        self.slots = self.stripe_size * self.stripes
+        self.probe_limit = min(self.PROBE_LIMIT, self.stripe_size)
+        self.ttl = float(ttl)
+        self.locks = [multiprocessing.Lock() for _ in range(self.stripes)]
+        self.slots_offset = self.STRIPE.size * self.stripes
+        self.memory = multiprocessing.shared_memory.SharedMemory(
+            create=True, size=self.slots_offset + self.SLOT.size * self.slots)
+        self.memory.buf[:self.memory.size] = bytes(self.memory.size)
+
+    def locate(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=DIGEST_SIZE).digest()
+        home = int.from_bytes(digest[:8], 'little') % self.slots
+        return digest, home // self.stripe_size, home % self.stripe_size
+
+    def window(self, stripe, offset):
+        start = stripe * self.stripe_size
+        for i in range(self.probe_limit):
+            yield self.slots_offset + self.SLOT.size * (start + (offset + i) % self.stripe_size)
+
+    def get(self, key):
+        digest, stripe, offset = self.locate(key)
+        now = time.time()
+        buf = self.memory.buf
+        with self.locks[stripe]:
+            for position in self.window(stripe, offset):
+                flags, slot_digest, expire, value = self.SLOT.unpack_from(buf, position)
+                if not flags & FLAG_USED or slot_digest != digest:
+                    continue
+                if expire < now:
+                    buf[position] = 0
+                    break
+                buf[position] = FLAG_USED | FLAG_REFERENCED
+                self.count(stripe, self.HITS_OFFSET)
+                return value
+            self.count(stripe, self.MISSES_OFFSET)
+        return None
+
+    def count(self, stripe, offset):
+        position = self.STRIPE.size * stripe + offset
+        self.COUNTER.pack_into(self.memory.buf, position, self.COUNTER.unpack_from(self.memory.buf, position)[0] + 1)
+
+    def total(self, offset):
+        return sum(self.COUNTER.unpack_from(self.memory.buf, self.STRIPE.size * stripe + offset)[0]
+                   for stripe in range(self.stripes))
+
+    def hits(self):
+        return self.total(self.HITS_OFFSET)
+
+    def misses(self):
+        return self.total(self.MISSES_OFFSET)
+
+    def set(self, key, value, timeout=None):
+        digest, stripe, offset = self.locate(key)
+        now = time.time()
+        ttl = self.ttl if timeout is None else min(float(timeout), self.ttl)
+        buf = self.memory.buf
+        with self.locks[stripe]:
+            free = None
+            positions = list(self.window(stripe, offset))
+            for position in positions:
+                flags, slot_digest, expire, _ = self.SLOT.unpack_from(buf, position)
+                if flags & FLAG_USED and slot_digest == digest:
+                    free = position
+                    break
+                if free is None and (not flags & FLAG_USED or expire < now):
+                    free = position
+            if free is None:
+                free = self.evict(stripe, positions)
+            self.SLOT.pack_into(buf, free, FLAG_USED, digest, now + ttl, float(value))
+
+    def evict(self, stripe, positions):
+        # CLOCK over the probe window: the hand of the stripe sweeps the window
+        # clearing reference bits until it meets a slot not used since last pass
+        buf = self.memory.buf
+        hand_position = self.STRIPE.size * stripe
+        hand = self.HAND.unpack_from(buf, hand_position)[0]
+        for _ in range(2 * len(positions)):
+            position = positions[hand % len(positions)]
+            hand += 1
+            if buf[position] & FLAG_REFERENCED:
+                buf[position] = FLAG_USED
+                continue
+            break
+        self.HAND.pack_into(buf, hand_position, hand % 0xffffffff)
+        return position
+
+    def close(self):
+        self.memory.close()
+
+    def unlink(self):
+        self.memory.close()
+        self.memory.unlink()
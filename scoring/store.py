@@ -1,20 +1,60 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import sys
 import time
+import copy
 import collections
 import json
+import zlib
+import threading
+import concurrent.futures
 import http.client
 
+import compression
+import interests
+import requestid
+import transport
+
+
+DEADLINE_HEADER = 'X-Request-Deadline'
+NOT_FOUND = 404
+DEADLINE_EXCEEDED = 504
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class NotFoundError(KeyError):
+    pass
+
 
 class StoreMemory(object):
     CacheRecord = collections.namedtuple('CacheRecord', 'value expire')
+    deadline = None
+    request_id = None
 
     def __init__(self):
         self.data = {}
         self.cache = {}
 
+    def with_deadline(self, deadline):
+        store = copy.copy(self)
+        store.deadline = deadline
+        return store
+
+    def with_request_id(self, request_id):
+        store = copy.copy(self)
+        store.request_id = request_id
+        return store
+
+    def check_deadline(self):
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise DeadlineExceeded('request deadline exceeded')
+
     def cache_get(self, key):
+        self.check_deadline()
         value = None
         if key in self.cache:
             record = self.cache[key]
@@ -25,64 +65,410 @@ class StoreMemory(object):
         return value
 
     def cache_set(self, key, value, timeout):
+        self.check_deadline()
         self.cache[key] = self.CacheRecord(value, None if timeout is None else time.time() + timeout)
 
     def get(self, key):
+        self.check_deadline()
+        if key not in self.data:
+            raise NotFoundError(key)
         return self.data[key]
 
     def set(self, key, value):
+        self.check_deadline()
         self.data[key] = value
 
+    def get_interests(self, key):
+        return [sys.intern(name) for name in interests.parse(self.get(key))]
 
-class StoreKVS(object):
-    def __init__(self, host, port, timeout=10, tries=3):
+    def scan(self, prefix=None, start=None, end=None, page_size=100):
+        for key in sorted(self.data):
+            if prefix is not None and not key.startswith(prefix):
+                continue
+            if (start is None or key >= start) and (end is None or key < end):
+                yield key, self.data[key]
+
+    def query_interests(self, all_names=(), any_names=(), cursor=None, limit=100):
+        self.check_deadline()
+        if not all_names and not any_names:
+            return [], None
+        ids = []
+        for key, value in self.data.items():
+            cid = key[2:]
+            if not key.startswith('i:') or not cid.isascii() or not cid.isdigit():
+                continue
+            if cursor is not None and int(cid) <= cursor:
+                continue
+            try:
+                names = set(interests.parse(value))
+            except ValueError:
+                continue
+            if all(name in names for name in all_names) and (not any_names or names.intersection(any_names)):
+                ids.append(int(cid))
+        ids.sort()
+        if len(ids) > limit:
+            return ids[:limit], ids[limit - 1]
+        return ids, None
+
+
+class CircuitOpenError(ConnectionError):
+    pass
+
+
+class CircuitBreaker(object):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=5.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # let exactly one probe through, everyone else keeps failing fast
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class NegativeCache(object):
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.expires = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            expire = self.expires.get(key)
+            if expire is None:
+                return False
+            if expire < time.monotonic():
+                del self.expires[key]
+                return False
+            return True
+
+    def add(self, key):
+        with self.lock:
+            self.expires.pop(key, None)
+            self.expires[key] = time.monotonic() + self.ttl
+            while len(self.expires) > self.size:
+                self.expires.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.expires.pop(key, None)
+
+
+class KVSNode(object):
+    LATENCY_WINDOW = 100
+    LATENCY_MIN_SAMPLES = 20
+
+    def __init__(self, host, port, timeout):
         self.host = host
-        self.port = int(port)
+        self.port = 0 if transport.is_unix(host) else int(port)
+        self.timeout = float(timeout)
+        self.breaker = CircuitBreaker()
+        self.latencies = collections.deque(maxlen=self.LATENCY_WINDOW)
+        self.compress_requests = False
+        self.lock = threading.Lock()
+        self.pool = [self.make_connection()]
+
+    def make_connection(self):
+        if transport.is_unix(self.host):
+            return transport.UnixHTTPConnection(transport.unix_path(self.host), self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, self.timeout)
+
+    def acquire(self, timeout):
+        with self.lock:
+            connect = self.pool.pop() if self.pool else None
+        if connect is None:
+            connect = self.make_connection()
+        connect.timeout = timeout
+        sock = getattr(connect, 'sock', None)
+        if sock is not None:
+            sock.settimeout(timeout)
+        return connect
+
+    def release(self, connect):
+        with self.lock:
+            self.pool.append(connect)
+
+    def close(self):
+        with self.lock:
+            pool, self.pool = self.pool, []
+        for connect in pool:
+            connect.close()
+
+    def latency_p95(self):
+        # request threads append while this runs, sorting the deque itself
+        # could raise on a mutation during iteration
+        with self.lock:
+            latencies = list(self.latencies)
+        if len(latencies) < self.LATENCY_MIN_SAMPLES:
+            return None
+        latencies.sort()
+        return latencies[int(len(latencies) * 0.95) - 1]
+
+    def request(self, method, request_str, timeout, headers=None):
+        if not self.breaker.allow():
+            raise CircuitOpenError('kvs node {:s}:{:d} circuit is open'.format(self.host, self.port))
+        body, request_headers = request_str, {'Accept-Encoding': compression.DEFLATE}
+        if self.compress_requests:
+            body, encoding = compression.encode_body(request_str.encode('utf-8'), compression.DEFLATE)
+            if encoding:
+                request_headers['Content-Encoding'] = encoding
+        request_headers.update(headers or {})
+        connect = self.acquire(timeout)
+        reused = getattr(connect, 'sock', None) is not None
+        started = time.monotonic()
+        try:
+            try:
+                connect.request('POST', method, body, request_headers)
+                response = connect.getresponse()
+            except (ConnectionResetError, BrokenPipeError):
+                # kvs.py closes idle keep-alive connections, a pooled one may
+                # be gone before it is used; such a request was never served
+                if not reused:
+                    raise
+                connect.close()
+                connect.request('POST', method, body, request_headers)
+                response = connect.getresponse()
+            # responses of our own kvs are not capped, a data_scan page may be large
+            data = compression.decode_body(response.read(), response.getheader('Content-Encoding'), None)
+            response_decoded = json.loads(data.decode('utf-8'))
+        except (OSError, http.client.HTTPException, ValueError, zlib.error) as e:
+            connect.close()
+            self.breaker.failure()
+            if isinstance(e, (ConnectionError, ValueError)):
+                raise
+            raise ConnectionError('kvs node {:s}:{:d}: {!s}'.format(self.host, self.port, e)) from e
+        with self.lock:
+            self.latencies.append(time.monotonic() - started)
+        if response.status >= 500 and response.status != DEADLINE_EXCEEDED:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+        # kvs.py advertises the encodings it can read in its responses
+        if compression.DEFLATE in compression.accepted_encodings(response.getheader('Accept-Encoding')):
+            self.compress_requests = True
+        self.release(connect)
+        return response.status, response_decoded
+
+
+def parse_storage_config(config):
+    # HOST,PORT,TIMEOUT,TRIES[,BUDGET] or unix:PATH,TIMEOUT,TRIES[,BUDGET]
+    args = config.split(',')
+    if transport.is_unix(args[0]):
+        args.insert(1, 0)
+    return args
+
+
+class StoreKVS(object):
+    HEDGE_WORKERS = 4
+    HEDGE_METHODS = frozenset(['/data_get'])
+    NEGATIVE_CACHE_SIZE = 10000
+    NEGATIVE_CACHE_TTL = 5.0
+    # only scores go to the near cache, they are the one hot numeric value
+    NEAR_CACHE_PREFIX = 'uid:'
+    deadline = None
+    request_id = None
+
+    def __init__(self, host, port, timeout=10, tries=3, budget=None, replicas=None, near_cache=None):
+        self.near_cache = near_cache
         self.timeout = float(timeout)
         self.tries = int(tries)
-        self.connect = http.client.HTTPConnection(self.host, self.port, self.timeout)
+        self.budget = self.timeout if budget is None else float(budget)
+        self.nodes = [KVSNode(host, port, self.timeout)]
+        for replica in replicas or []:
+            if transport.is_unix(replica):
+                replica_host, replica_port = replica, 0
+            elif isinstance(replica, str):
+                replica_host, replica_port = replica.rsplit(':', 1)
+            else:
+                replica_host, replica_port = replica
+            self.nodes.append(KVSNode(replica_host, replica_port, self.timeout))
+        self.not_found = NegativeCache(self.NEGATIVE_CACHE_SIZE, self.NEGATIVE_CACHE_TTL)
+        self.categories = interests.CategoryTable()
+        self.executor = None
+        if len(self.nodes) > 1:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.HEDGE_WORKERS)
+
+    def with_deadline(self, deadline):
+        store = copy.copy(self)
+        store.deadline = deadline
+        return store
+
+    def with_request_id(self, request_id):
+        store = copy.copy(self)
+        store.request_id = request_id
+        return store
+
+    def check_deadline(self):
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise DeadlineExceeded('request deadline exceeded')
+
+    def request_node(self, node, method, request_str, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise ConnectionError('kvs request budget exhausted')
+        headers = {}
+        if self.deadline is not None:
+            headers[DEADLINE_HEADER] = repr(self.deadline)
+        if self.request_id is not None:
+            headers[requestid.HEADER] = self.request_id
+        return node.request(method, request_str, min(node.timeout, remaining), headers)
+
+    def request_hedged(self, method, request_str, deadline):
+        primary = self.nodes[0]
+        futures = [self.executor.submit(self.request_node, primary, method, request_str, deadline)]
+        hedge_after = primary.latency_p95()
+        if hedge_after is None:
+            hedge_after = deadline - time.monotonic()
+        concurrent.futures.wait(futures, timeout=max(0, hedge_after))
+        if not futures[0].done() or futures[0].exception() is not None:
+            # primary is slower than its p95 or already failed, race a replica
+            for replica in self.nodes[1:]:
+                futures.append(self.executor.submit(self.request_node, replica, method, request_str, deadline))
+        error = None
+        try:
+            for future in concurrent.futures.as_completed(futures, timeout=max(0, deadline - time.monotonic())):
+                error = future.exception()
+                if error is None:
+                    return future.result()
+        except concurrent.futures.TimeoutError:
+            raise ConnectionError('kvs request budget exhausted')
+        raise error
 
     def make_request(self, method, request):
         request_str = json.dumps(request)
+        self.check_deadline()
+        deadline = time.monotonic() + self.budget
+        if self.deadline is not None:
+            deadline = min(deadline, time.monotonic() + self.deadline - time.time())
+        # codes are numbered by the category table of the node that answers,
+        # the mirror follows the primary only, so a replica must not answer
+        hedged = self.executor is not None and method in self.HEDGE_METHODS and 'encoding' not in request
         try_num = 0
         while (True):
             try_num += 1
             try:
-                self.connect.request('POST', method, request_str)
-                response = self.connect.getresponse()
-                response_decoded = json.loads(response.read().decode('utf-8'))
-                if response.status == 200 and 'response' in response_decoded:
+                if hedged:
+                    status, response_decoded = self.request_hedged(method, request_str, deadline)
+                else:
+                    status, response_decoded = self.request_node(self.nodes[0], method, request_str, deadline)
+                if status == 200 and 'response' in response_decoded:
                     return response_decoded['response']
+                if status == DEADLINE_EXCEEDED:
+                    raise DeadlineExceeded(response_decoded.get('error', 'request deadline exceeded'))
+                if status == NOT_FOUND:
+                    raise NotFoundError(response_decoded.get('error', 'no data found'))
                 raise KeyError(response_decoded.get('error', 'kvs service invalid response'))
-            except (ConnectionError, json.JSONDecodeError, KeyError):
-                self.connect = http.client.HTTPConnection(self.host, self.port, self.timeout)
-                if try_num < self.tries:
-                    time.sleep(try_num * 0.1)
+            except (CircuitOpenError, NotFoundError):
+                raise
+            except (ConnectionError, json.JSONDecodeError, KeyError) as e:
+                if self.deadline is not None and time.time() >= self.deadline:
+                    raise DeadlineExceeded('request deadline exceeded') from e
+                delay = try_num * 0.1
+                if try_num < self.tries and deadline - time.monotonic() > delay:
+                    time.sleep(delay)
                 else:
                     raise
 
+    def near_cached(self, key):
+        return self.near_cache is not None and key.startswith(self.NEAR_CACHE_PREFIX)
+
     def cache_get(self, key):
+        if self.near_cached(key):
+            value = self.near_cache.get(key)
+            if value is not None:
+                return value
         request = {
             'key': key,
         }
         try:
-            return self.make_request('/cache_get', request)
+            value = self.make_request('/cache_get', request)
         except (ConnectionError, KeyError):
             return None
+        if self.near_cached(key) and isinstance(value, (int, float)):
+            self.near_cache.set(key, value)
+        return value
 
     def cache_set(self, key, value, timeout):
+        if self.near_cached(key) and isinstance(value, (int, float)):
+            self.near_cache.set(key, value, timeout)
         request = {'key': key, 'value': value, 'timeout': timeout}
         try:
             self.make_request('/cache_set', request)
         except (ConnectionError, KeyError):
             return None
 
+    def read(self, key, request):
+        if key in self.not_found:
+            raise NotFoundError(key)
+        try:
+            return self.make_request('/data_get', request)
+        except NotFoundError:
+            self.not_found.add(key)
+            raise
+
     def get(self, key):
         request = {
             'key': key,
         }
-        return self.make_request('/data_get', request)
+        return self.read(key, request)
+
+    def get_interests(self, key):
+        response = self.read(key, {'key': key, 'encoding': 'codes'})
+        if 'codes' not in response:
+            return [sys.intern(name) for name in interests.parse(response['value'])]
+        codes = response['codes']
+        if codes and max(codes) >= len(self.categories):
+            self.categories.extend(self.make_request('/categories_get', {'offset': len(self.categories)}))
+        return self.categories.decode(codes)
+
+    def scan(self, prefix=None, start=None, end=None, page_size=100):
+        request = {'prefix': prefix, 'start': start, 'end': end, 'cursor': None, 'limit': page_size}
+        while True:
+            response = self.make_request('/data_scan', request)
+            for key, value in response['items']:
+                yield key, value
+            if response['cursor'] is None:
+                return
+            request['cursor'] = response['cursor']
+
+    def query_interests(self, all_names=(), any_names=(), cursor=None, limit=100):
+        request = {'all': list(all_names), 'any': list(any_names), 'cursor': cursor, 'limit': limit}
+        response = self.make_request('/index_query', request)
+        return response['ids'], response['cursor']
 
     def set(self, key, value):
         request = {'key': key, 'value': value}
+        self.not_found.discard(key)
         self.make_request('/data_set', request)
+
+    def close(self):
+        for node in self.nodes:
+            node.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+import unittest.mock
+
+import admission
+import api
+from test_base import cases
+
+
+class TestSuite(unittest.TestCase):
+    def test_inflight_limit(self):
+        controller = admission.AdmissionController(max_inflight=4, initial_limit=4)
+        for _ in range(4):
+            self.assertTrue(controller.acquire(admission.PRIORITY_HIGH))
+        self.assertFalse(controller.acquire(admission.PRIORITY_HIGH))
+        controller.release(0)
+        self.assertTrue(controller.acquire(admission.PRIORITY_HIGH))
+        self.assertEqual(controller.rejected, 1)
+
+    def test_priority_shed_order(self):
+        controller = admission.AdmissionController(max_inflight=20, initial_limit=20)
+        admitted = {}
+        for priority in [admission.PRIORITY_LOW, admission.PRIORITY_NORMAL, admission.PRIORITY_HIGH]:
+            admitted[priority] = 0
+            while controller.acquire(priority):
+                admitted[priority] += 1
+        self.assertEqual(admitted[admission.PRIORITY_LOW], 15)
+        self.assertEqual(admitted[admission.PRIORITY_NORMAL], 3)
+        self.assertEqual(admitted[admission.PRIORITY_HIGH], 2)
+
+    def test_additive_increase(self):
+        controller = admission.AdmissionController(max_inflight=8, initial_limit=4, target_latency=0.1)
+        for _ in range(100):
+            controller.acquire()
+            controller.release(0.01)
+        self.assertEqual(controller.limit, 8)
+
+    def test_multiplicative_decrease(self):
+        controller = admission.AdmissionController(max_inflight=8, initial_limit=8, target_latency=0.1)
+        with unittest.mock.patch('time.monotonic', return_value=10.0):
+            controller.acquire()
+            controller.release(1.0)
+            self.assertAlmostEqual(controller.limit, 7.2)
+            controller.acquire()
+            controller.release(1.0)
+            self.assertAlmostEqual(controller.limit, 7.2)
+        with unittest.mock.patch('time.monotonic', return_value=11.0):
+            for _ in range(100):
+                controller.acquire()
+                controller.release(1.0)
+                controller.last_decrease = 0
+        self.assertEqual(controller.limit, controller.min_limit)
+        self.assertTrue(controller.acquire(admission.PRIORITY_LOW))
+        self.assertEqual(controller.inflight, 1)
+
+    @cases([
+        ({"login": "admin", "method": "clients_interests", "token": api.admin_token()}, admission.PRIORITY_HIGH),
+        ({"login": "admin", "method": "online_score"}, admission.PRIORITY_LOW),
+        ({"login": "admin", "method": "online_score", "token": "forged"}, admission.PRIORITY_LOW),
+        ({"login": "h&f", "method": "online_score"}, admission.PRIORITY_NORMAL),
+        ({"login": "h&f", "method": "clients_interests"}, admission.PRIORITY_LOW),
+        ([], admission.PRIORITY_NORMAL),
+    ])
+    def test_request_priority(self, request, priority):
+        self.assertEqual(api.get_request_priority(request), priority)
@@ -1,15 +1,20 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import sys
 import hashlib
 import datetime
 import unittest
+import subprocess
 import unittest.mock
 import pathlib
 import shutil
 import json
+import time
 
 import api
+import bench
 import store
 from test_base import cases, ManageKVS, ManageAPI
 
@@ -151,6 +156,19 @@ class TestSuite(object):
         self.assertEqual(api.INVALID_REQUEST, code, msg=request)
         self.assertTrue(len(response))
 
+    @cases([
+        {"phone": "89175002040", "email": "stupnikov@otus.ru"},
+        {"phone": "79175002040", "email": "stupnikovotus.ru"},
+        {"phone": "79175002040", "email": "stupnikov@otus.ru", "birthday": "XXX"},
+        {"phone": "79175002040", "email": "stupnikov@otus.ru", "birthday": "01.01.1800"},
+        {"phone": "79175002040", "email": "stupnikov@otus.ru", "birthday": "01.01.1900"},
+    ])
+    def test_admin_score_invalid(self, arguments):
+        request = {"account": "horns&hoofs", "login": "admin", "method": "online_score", "arguments": arguments}
+        self.set_valid_auth(request)
+        response, code = self.get_response(request)
+        self.assertEqual(code, api.INVALID_REQUEST, msg=response)
+
     @cases([
         {
             "phone": "79175002040",
@@ -196,6 +214,7 @@ class TestSuite(object):
         self.assertTrue(isinstance(score, (int, float)) and score >= 0, msg=request)
         if hasattr(self, 'context'):
             self.assertEqual(sorted(self.context["has"]), sorted(arguments.keys()), msg=request)
+            self.assertIsInstance(self.context["has"], dict)
 
     def test_ok_score_admin_request(self):
         arguments = {"phone": "79175002040", "email": "stupnikov@otus.ru"}
@@ -262,6 +281,46 @@ class TestSuite(object):
         if hasattr(self, 'context'):
             self.assertEqual(self.context.get("nclients"), len(arguments["client_ids"]), msg=request)
 
+    @cases([
+        ({"interests": ["cars", "travel"]}, [0, 1]),
+        ({"interests": ["cars", "travel"], "operator": "or"}, [0, 1]),
+        ({"interests": ["cars", "pets"], "operator": "and"}, [0]),
+        ({"interests": ["cars", "travel"], "operator": "and"}, []),
+        ({"interests": ["unknown"]}, []),
+    ])
+    def test_ok_clients_by_interests_request(self, arguments, client_ids):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_by_interests", "arguments": arguments}
+        self.set_valid_auth(request)
+        response, code = self.get_response(request)
+        self.assertEqual(api.OK, code, msg=request)
+        self.assertEqual(response, {"client_ids": client_ids, "cursor": None}, msg=request)
+
+    def test_clients_by_interests_pagination(self):
+        arguments = {"interests": ["cars", "travel", "sport"], "limit": 2}
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_by_interests", "arguments": arguments}
+        self.set_valid_auth(request)
+        response, code = self.get_response(request)
+        self.assertEqual(api.OK, code)
+        self.assertEqual(response, {"client_ids": [0, 1], "cursor": 1})
+        arguments["cursor"] = response["cursor"]
+        response, code = self.get_response(request)
+        self.assertEqual(api.OK, code)
+        self.assertEqual(response, {"client_ids": [2], "cursor": None})
+
+    @cases([
+        {},
+        {"interests": []},
+        {"interests": [1]},
+        {"interests": ["cars"], "operator": "xor"},
+        {"interests": ["cars"], "limit": 0},
+        {"interests": ["cars"], "cursor": "1"},
+    ])
+    def test_invalid_clients_by_interests_request(self, arguments):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_by_interests", "arguments": arguments}
+        self.set_valid_auth(request)
+        response, code = self.get_response(request)
+        self.assertEqual(api.INVALID_REQUEST, code, msg=request)
+
 
 class TestIntegrationSuite(TestSuite, unittest.TestCase):
     @classmethod
@@ -279,16 +338,111 @@ class TestIntegrationSuite(TestSuite, unittest.TestCase):
 
     @classmethod
     def tearDownClass(cls):
+        cls.store.close()
         cls.api.stop()
         cls.kvs.stop()
         if cls.root.is_dir():
             shutil.rmtree(str(cls.root))
 
-    def get_response(self, request):
-        response = self.api.make_request('/method', json.dumps(request))
+    def test_unknown_client_interests(self):
+        # a client without interests fails the request with an internal
+        # error, as before kvs.py answered 404 for unknown keys
+        arguments = {"client_ids": [0, 100500]}
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "arguments": arguments}
+        self.set_valid_auth(request)
+        _, code = self.get_response(request)
+        self.assertEqual(api.INTERNAL_ERROR, code)
+
+    def get_response(self, request, headers=None):
+        response = self.api.make_request('/method', json.dumps(request), headers)
         response_decoded = json.loads(response.read().decode('utf-8'))
         return response_decoded.get('response', response_decoded.get('error')), response_decoded['code']
 
+    @cases([
+        {
+            'X-Request-Deadline': str(time.time() - 1)
+        },
+        {
+            'X-Request-Timeout': '-1'
+        },
+    ])
+    def test_deadline_exceeded(self, headers):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests"}
+        request["arguments"] = {"client_ids": [1, 2]}
+        self.set_valid_auth(request)
+        _, code = self.get_response(request, headers)
+        self.assertEqual(api.GATEWAY_TIMEOUT, code)
+
+    def test_keep_alive(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                   "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}}
+        self.set_valid_auth(request)
+        connect = self.api.make_connection(1)
+        try:
+            for _ in range(2):
+                connect.request('POST', '/method', json.dumps(request))
+                response = connect.getresponse()
+                self.assertEqual(json.loads(response.read().decode('utf-8'))['code'], api.OK)
+                self.assertFalse(response.will_close)
+            connect.request('GET', '/metrics')
+            metrics = json.loads(connect.getresponse().read().decode('utf-8'))['response']
+            self.assertGreaterEqual(metrics['requests_reused'], 2)
+            self.assertGreaterEqual(metrics['connections_active'], 1)
+        finally:
+            connect.close()
+
+    def test_request_id(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                   "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}}
+        self.set_valid_auth(request)
+        response = self.api.make_request('/method', json.dumps(request), {'X-Request-Id': 'trace-1'})
+        response.read()
+        self.assertEqual(response.getheader('X-Request-Id'), 'trace-1')
+        request_ids = set()
+        for _ in range(2):
+            response = self.api.make_request('/method', json.dumps(request))
+            response.read()
+            request_ids.add(response.getheader('X-Request-Id'))
+        self.assertEqual(len(request_ids), 2)
+
+    def test_deadline_not_exceeded(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests"}
+        request["arguments"] = {"client_ids": [1, 2]}
+        self.set_valid_auth(request)
+        _, code = self.get_response(request, {'X-Request-Timeout': '10'})
+        self.assertEqual(api.OK, code)
+
+
+class TestUnixIntegrationSuite(TestIntegrationSuite):
+    @classmethod
+    def setUpClass(cls):
+        cls.root = pathlib.Path('./test_api_integration_unix')
+        if cls.root.is_dir():
+            shutil.rmtree(str(cls.root))
+        cls.root.mkdir(parents=True)
+        kvs_path = cls.root / 'kvs.sock'
+        cls.kvs = ManageKVS(8014, cls.root, kvs_path)
+        cls.api = ManageAPI(8084, cls.root, 'unix:{!s},10,3'.format(kvs_path), cls.root / 'api.sock')
+        cls.kvs.start()
+        cls.api.start()
+        cls.store = store.StoreKVS(*store.parse_storage_config('unix:{!s}'.format(kvs_path)))
+        TestSuite.setUpClass.__func__(cls)
+
+
+class TestWorkersIntegrationSuite(TestIntegrationSuite):
+    @classmethod
+    def setUpClass(cls):
+        cls.root = pathlib.Path('./test_api_integration_workers')
+        if cls.root.is_dir():
+            shutil.rmtree(str(cls.root))
+        cls.root.mkdir(parents=True)
+        cls.kvs = ManageKVS(8015, cls.root)
+        cls.api = ManageAPI(8085, cls.root, 'localhost,8015,10,3', options='--workers 3 --shm-cache 1024')
+        cls.kvs.start()
+        cls.api.start()
+        cls.store = store.StoreKVS('localhost', 8015)
+        TestSuite.setUpClass.__func__(cls)
+
 
 class TestMethodSuite(TestSuite, unittest.TestCase):
     @classmethod
@@ -302,3 +456,77 @@ class TestMethodSuite(TestSuite, unittest.TestCase):
 
     def get_response(self, request):
         return api.method_handler({"body": request, "headers": self.headers}, self.context, self.store)
+
+    def test_unknown_client_interests(self):
+        arguments = {"client_ids": [0, 100500]}
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "arguments": arguments}
+        self.set_valid_auth(request)
+        with self.assertRaises(KeyError):
+            self.get_response(request)
+
+    @cases([
+        ("online_score", {"phone": "79175002040", "email": "stupnikov@otus.ru"}, api.OK),
+        ("clients_interests", {"client_ids": [1, 2]}, api.GATEWAY_TIMEOUT),
+    ])
+    def test_deadline_exceeded(self, method, arguments, expected_code):
+        # online_score with the default cheap model does no store I/O at all
+        request = {"account": "horns&hoofs", "login": "h&f", "method": method, "arguments": arguments}
+        self.set_valid_auth(request)
+        self.context["deadline"] = time.time() - 1
+        _, code = self.get_response(request)
+        self.assertEqual(expected_code, code)
+
+    def test_request_id_store(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1]}}
+        self.set_valid_auth(request)
+        self.context["request_id"] = 'trace-1'
+        with unittest.mock.patch('scoring.get_interests', return_value=[]) as get_interests:
+            _, code = self.get_response(request)
+        self.assertEqual(api.OK, code)
+        self.assertEqual(get_interests.call_args[0][0].request_id, 'trace-1')
+        self.assertIsNone(self.store.request_id)
+
+    def test_get_request_deadline(self):
+        self.assertIsNone(api.get_request_deadline({}))
+        self.assertEqual(api.get_request_deadline({'X-Request-Deadline': '123.5'}), 123.5)
+        with unittest.mock.patch('time.time', return_value=100.0):
+            self.assertEqual(api.get_request_deadline({'X-Request-Timeout': '2.5'}), 102.5)
+
+    @cases([
+        ({"score": 5.0}, api.OK),
+        ({"score": 42}, api.OK),
+        ({"score": 0.1 + 0.2}, api.OK),
+        ({"score": True}, api.OK),
+        ({"score": float('nan')}, api.OK),
+        ({"1": ["books"]}, api.OK),
+        ("Invalid token", api.FORBIDDEN),
+    ])
+    def test_encode_response(self, response, code):
+        if code not in api.ERRORS:
+            r = {"response": response, "code": code}
+        else:
+            r = {"error": response, "code": code}
+        self.assertEqual(api.encode_response(response, code, r), json.dumps(r).encode('utf-8'))
+
+    def test_prewarm(self):
+        with unittest.mock.patch.object(api, 'check_auth', wraps=api.check_auth) as check_auth:
+            api.prewarm()
+        self.assertEqual(check_auth.call_count, 1)
+
+    @cases([
+        ('api', ['shmcache', 'multiprocessing', 'uuid', 'profiler', 'cProfile']),
+        ('kvs', ['partition', 'uuid', 'profiler', 'cProfile']),
+    ])
+    def test_deferred_imports(self, module, deferred):
+        code = 'import sys, {:s}; print(" ".join(sorted(sys.modules)))'.format(module)
+        modules = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True).stdout.split()
+        for name in deferred:
+            self.assertNotIn(name.encode('ascii'), modules)
+
+    @unittest.skipUnless(os.environ.get('SCORING_BENCHMARK'), 'set SCORING_BENCHMARK=1 to run benchmarks')
+    def test_startup_benchmark(self):
+        for script in ['api.py', 'kvs.py']:
+            ready, first, second = bench.run_startup(script, 10)
+            print('\n{:s} ready in {:.1f} ms'.format(script, ready * 1e3))
+            self.assertLess(ready, bench.STARTUP_TARGET)
@@ -11,6 +11,8 @@ import time
 import json
 import unittest
 
+import transport
+
 
 def cases(cases):
     def decorator(f):
@@ -30,11 +32,17 @@ def cases(cases):
 
 
 class ManageService(object):
-    def __init__(self, port, command):
+    def __init__(self, port, command, unix_path=None):
         self.port = port
         self.command = command
+        self.unix_path = unix_path
         self.process = None
 
+    def make_connection(self, timeout):
+        if self.unix_path is not None:
+            return transport.UnixHTTPConnection(str(self.unix_path), timeout)
+        return http.client.HTTPConnection('localhost', self.port, timeout)
+
     def start(self):
         if self.process is not None:
             self.stop()
@@ -42,7 +50,7 @@ class ManageService(object):
         try_num = 0
         while True:
             try_num += 1
-            connect = http.client.HTTPConnection('localhost', self.port, 1)
+            connect = self.make_connection(1)
             try:
                 connect.request('GET', '/ping', headers={'connection': 'close'})
                 response = connect.getresponse()
@@ -50,7 +58,7 @@ class ManageService(object):
                     response_decoded = json.loads(response.read().decode('utf-8'))
                     if response_decoded.get('code', None) == 200:
                         return
-            except ConnectionError as e:
+            except (ConnectionError, FileNotFoundError) as e:
                 if try_num < 3:
                     time.sleep(try_num * 0.1)
                 else:
@@ -75,10 +83,14 @@ class ManageService(object):
         self.stop()
         self.start()
 
-    def make_request(self, path, request):
-        connect = http.client.HTTPConnection('localhost', self.port, 1)
+    def make_request(self, path, request, headers=None):
+        connect = self.make_connection(1)
+        # the response is read after the connection is closed, so it must
+        # not be a persistent one
+        headers = dict(headers or {})
+        headers.setdefault('Connection', 'close')
         try:
-            connect.request('POST', path, request)
+            connect.request('POST', path, request, headers)
             response = connect.getresponse()
         finally:
             connect.close()
@@ -86,10 +98,20 @@ class ManageService(object):
 
 
 class ManageKVS(ManageService):
-    def __init__(self, port, root):
-        super().__init__(port, "./kvs.py -p {:d} -s {!s} -l {!s}".format(port, root, root / 'report_kvs.log'))
+    def __init__(self, port, root, unix_path=None, options=None):
+        command = "./kvs.py -p {:d} -s {!s} -l {!s}".format(port, root, root / 'report_kvs.log')
+        if unix_path is not None:
+            command += " -u {!s}".format(unix_path)
+        if options:
+            command += " " + options
+        super().__init__(port, command, unix_path)
 
 
 class ManageAPI(ManageService):
-    def __init__(self, port, root, storage_cfg):
-        super().__init__(port, "./api.py -p {:d} -s {:s} -l {!s}".format(port, storage_cfg, root / 'report_api.log'))
+    def __init__(self, port, root, storage_cfg, unix_path=None, options=None):
+        command = "./api.py -p {:d} -s {:s} -l {!s}".format(port, storage_cfg, root / 'report_api.log')
+        if unix_path is not None:
+            command += " -u {!s}".format(unix_path)
+        if options:
+            command += " " + options
+        super().__init__(port, command, unix_path)
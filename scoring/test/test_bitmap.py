@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import random
+import unittest
+
+import bitmap
+from test_base import cases
+
+
+class TestSuite(unittest.TestCase):
+    @cases([10, 5000, 70000])
+    def test_set_operations(self, size):
+        generator = random.Random(size)
+        left = set(generator.sample(range(200000), size))
+        right = set(generator.sample(range(200000), size))
+        left_bitmap, right_bitmap = bitmap.Bitmap(left), bitmap.Bitmap(right)
+        self.assertEqual(list(left_bitmap), sorted(left))
+        self.assertEqual(len(left_bitmap), len(left))
+        self.assertEqual(list(left_bitmap & right_bitmap), sorted(left & right))
+        self.assertEqual(list(left_bitmap | right_bitmap), sorted(left | right))
+        middle = sorted(left)[size // 2]
+        self.assertEqual(list(left_bitmap.iter_from(middle)), [value for value in sorted(left) if value >= middle])
+
+    def test_add_discard(self):
+        values = bitmap.Bitmap()
+        for value in range(bitmap.ARRAY_LIMIT + 1):
+            values.add(value * 2)
+        self.assertIsInstance(values.containers[0], int)
+        values.add(2)
+        self.assertEqual(len(values), bitmap.ARRAY_LIMIT + 1)
+        self.assertIn(4, values)
+        self.assertNotIn(3, values)
+        for value in range(0, 2 * bitmap.ARRAY_LIMIT, 2):
+            values.discard(value)
+        self.assertEqual(list(values), [2 * bitmap.ARRAY_LIMIT])
+        self.assertNotIsInstance(values.containers[0], int)
+        values.discard(2 * bitmap.ARRAY_LIMIT)
+        values.discard(1 << 40)
+        self.assertEqual(values.containers, {})
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime
+import unittest
+
+import cachekey
+from test_base import cases
+
+
+class TestSuite(unittest.TestCase):
+    @cases([
+        (('ab', 'c'), ('a', 'bc')),
+        (('', None), (None, '')),
+        ((1, None), ('1', None)),
+        ((datetime.date(2000, 1, 2), ), ('2000-01-02', )),
+        (('79175002040', None, None), ('79175002041', None, None)),
+        ((None, None, None, 1), (None, None, None, 2)),
+    ])
+    def test_no_collision(self, values, other_values):
+        self.assertNotEqual(cachekey.encode(*values), cachekey.encode(*other_values))
+        self.assertNotEqual(cachekey.make_key('uid:', *values), cachekey.make_key('uid:', *other_values))
+
+    def test_stable(self):
+        values = ('79175002040', 'a@b.ru', datetime.date(2000, 1, 2), 1, 'a', 'b')
+        self.assertEqual(cachekey.make_key('uid:', *values), cachekey.make_key('uid:', *values))
+
+    def test_compact(self):
+        self.assertEqual(len(cachekey.digest('a')), 16)
+        key = cachekey.make_key('uid:', 'a', 'b')
+        self.assertTrue(key.startswith('uid:'))
+        self.assertEqual(len(key), len('uid:') + 22)
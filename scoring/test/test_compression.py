@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import gzip
+import zlib
+import unittest
+
+import compression
+from test_base import cases
+
+
+class TestSuite(unittest.TestCase):
+    @cases([
+        b'["cars", "pets"]',
+        b'"[\\"travel\\", \\"hi-tech\\"]"',
+        json.dumps([str(i) for i in range(100)]).encode('utf-8'),
+        b'1',
+    ])
+    def test_record_roundtrip(self, data):
+        for codec in [compression.RecordCodec(True), compression.RecordCodec(True, compression.DEFAULT_ZDICT)]:
+            record = codec.encode(data)
+            self.assertLessEqual(len(record), len(data))
+            self.assertEqual(compression.RecordCodec().decode(record), data)
+
+    def test_record_plain(self):
+        data = json.dumps(['cars'] * 100).encode('utf-8')
+        self.assertEqual(compression.RecordCodec().encode(data), data)
+        self.assertEqual(compression.RecordCodec(True).decode(data), data)
+
+    def test_record_zdict(self):
+        data = b'["cars", "pets", "travel"]'
+        plain = compression.RecordCodec(True).encode(data)
+        with_zdict = compression.RecordCodec(True, compression.DEFAULT_ZDICT).encode(data)
+        self.assertLess(len(with_zdict), len(plain))
+
+    def test_record_unknown_zdict(self):
+        samples = [b'["alpha", "beta", "gamma", "delta"]'] * 10
+        zdict = compression.train_zdict(samples)
+        self.assertIn(b'"alpha"', zdict)
+        record = compression.RecordCodec(True, zdict).encode(samples[0])
+        self.assertEqual(compression.RecordCodec(zdict=zdict).decode(record), samples[0])
+        with self.assertRaises(ValueError):
+            compression.RecordCodec().decode(record)
+
+    @cases([
+        (None, None),
+        ('identity', None),
+        ('deflate', 'deflate'),
+        ('gzip, deflate', 'gzip'),
+        ('gzip;q=0, deflate;q=0.5', 'deflate'),
+    ])
+    def test_encode_body(self, accept_encoding, encoding):
+        body = json.dumps(['cars'] * 1000).encode('utf-8')
+        encoded, used_encoding = compression.encode_body(body, accept_encoding)
+        self.assertEqual(used_encoding, encoding)
+        self.assertEqual(compression.decode_body(encoded, used_encoding), body)
+
+    def test_encode_body_small(self):
+        self.assertEqual(compression.encode_body(b'{}', 'gzip'), (b'{}', None))
+
+    def test_decode_body(self):
+        self.assertEqual(compression.decode_body(gzip.compress(b'1'), 'gzip'), b'1')
+        self.assertEqual(compression.decode_body(zlib.compress(b'1'), 'deflate'), b'1')
+        with self.assertRaises(ValueError):
+            compression.decode_body(b'1', 'br')
+        with self.assertRaises(ValueError):
+            compression.decode_body(zlib.compress(b'12345678')[:-4], 'deflate')
+
+    @cases(['deflate', 'gzip'])
+    def test_decode_body_limit(self, encoding):
+        body = b'0' * (compression.BODY_MAX_SIZE + 1)
+        encoded = zlib.compress(body, 9) if encoding == 'deflate' else gzip.compress(body, 9)
+        self.assertLess(len(encoded), 64 * 1024)
+        with self.assertRaises(compression.BodyTooLarge):
+            compression.decode_body(encoded, encoding)
+        self.assertEqual(compression.decode_body(encoded, encoding, None), body)
+        self.assertEqual(compression.decode_body(zlib.compress(body[:100]), 'deflate', 100), body[:100])
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import random
+import datetime
+import unittest
+import unittest.mock
+
+import dates
+from test_base import cases
+
+
+def parse_date_strptime(value):
+    return datetime.datetime.strptime(value, dates.DATE_FORMAT).date()
+
+
+def synthetic_dates(count, seed=0):
+    rnd = random.Random(seed)
+    start = datetime.date(1940, 1, 1).toordinal()
+    return [datetime.date.fromordinal(start + rnd.randrange(30000)).strftime(dates.DATE_FORMAT)
+            for _ in range(count)]
+
+
+class TestSuite(unittest.TestCase):
+    @cases([
+        '01.01.2000',
+        '29.02.2000',
+        '31.12.1999',
+        '1.1.2000',
+        ' 1.01.2000',
+        '01.1.2000',
+        '29.02.2001',
+        '31.04.2000',
+        '00.01.2000',
+        '01.00.2000',
+        '01.13.2000',
+        '01.01.0000',
+        '01.01.200',
+        '01.01.20000',
+        '01-01-2000',
+        '01.01.2000 ',
+        '٠١.٠١.٢٠٠٠',
+        '+1.01.2000',
+        '0x.01.2000',
+        '',
+    ])
+    def test_same_as_strptime(self, value):
+        try:
+            expected = parse_date_strptime(value)
+        except ValueError:
+            with self.assertRaises(ValueError, msg=value):
+                dates.parse_date(value)
+        else:
+            self.assertEqual(dates.parse_date(value), expected, msg=value)
+
+    def test_random_same_as_strptime(self):
+        for value in synthetic_dates(10000, seed=1):
+            self.assertEqual(dates.parse_date(value), parse_date_strptime(value))
+
+    def test_today(self):
+        today = dates.Today()
+        moment = datetime.datetime(2020, 5, 17, 23, 59, 59).timestamp()
+        with unittest.mock.patch('time.time', return_value=moment):
+            self.assertEqual(today(), datetime.date(2020, 5, 17))
+        with unittest.mock.patch('time.time', return_value=moment + 0.5):
+            self.assertEqual(today(), datetime.date(2020, 5, 17))
+        with unittest.mock.patch('time.time', return_value=moment + 1):
+            self.assertEqual(today(), datetime.date(2020, 5, 18))
+        # the shared instance reads the same patched clock, two reads of the
+        # real one may fall on either side of midnight
+        moment = datetime.datetime(2021, 3, 1, 12, 0, 0).timestamp()
+        with unittest.mock.patch('time.time', return_value=moment), \
+                unittest.mock.patch.multiple(dates.today, date=None, expire=0.0):
+            self.assertEqual(dates.today(), datetime.date(2021, 3, 1))
+        self.assertNotEqual(dates.today(), datetime.date(2021, 3, 1))
+
+    @unittest.skipUnless(os.environ.get('SCORING_BENCHMARK'), 'set SCORING_BENCHMARK=1 to run benchmarks')
+    def test_benchmark(self):
+        values = synthetic_dates(1000000)
+        timings = {}
+        for name, parse in [('strptime', parse_date_strptime), ('parse_date', dates.parse_date)]:
+            started = time.perf_counter()
+            for value in values:
+                parse(value)
+            timings[name] = time.perf_counter() - started
+        print('\n1M dates: strptime {strptime:.2f}s, parse_date {parse_date:.2f}s'.format(**timings))
+        self.assertLess(timings['parse_date'], timings['strptime'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import unittest
+import unittest.mock
+
+import expirecache
+
+
+class TestSuite(unittest.TestCase):
+    def setUp(self):
+        self.cache = expirecache.ExpiringCache()
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('a', {'b': 1})
+        self.cache.set(1, 'one')
+        self.assertEqual(self.cache.get('a'), {'b': 1})
+        self.assertEqual(self.cache.get(1), 'one')
+        self.assertEqual(len(self.cache), 2)
+
+    def test_expire(self):
+        with unittest.mock.patch('time.time', return_value=100):
+            self.cache.set('a', 1, 10)
+            self.cache.set('b', 2)
+        with unittest.mock.patch('time.time', return_value=110):
+            self.assertEqual(self.cache.get('a'), 1)
+        with unittest.mock.patch('time.time', return_value=111):
+            self.assertIsNone(self.cache.get('a'))
+            self.assertEqual(self.cache.get('b'), 2)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_sweep(self):
+        with unittest.mock.patch('time.time', return_value=100):
+            for num in range(100):
+                self.cache.set(num, num, 1 if num % 2 else 100)
+            self.cache.set(1, 'kept', None)
+            self.cache.set(3, 'longer', 50)
+        with unittest.mock.patch('time.time', return_value=102):
+            self.cache.sweep()
+        self.assertEqual(len(self.cache), 52)
+        with unittest.mock.patch('time.time', return_value=102):
+            self.assertEqual(self.cache.get(1), 'kept')
+            self.assertEqual(self.cache.get(3), 'longer')
+            self.assertIsNone(self.cache.get(5))
+
+    def test_sweep_on_set(self):
+        with unittest.mock.patch('time.time', return_value=100):
+            for num in range(1000):
+                self.cache.set('old:%d' % num, num, 1)
+        with unittest.mock.patch('time.time', return_value=102):
+            for num in range(1000):
+                self.cache.set('new:%d' % num, num)
+        self.assertEqual(len(self.cache), 1000)
+
+    def test_heap_compacted(self):
+        cache = self.cache
+        with unittest.mock.patch('time.time', return_value=100):
+            for num in range(10000):
+                cache.set('k:%d' % (num % 10), num, 3600)
+        self.assertLessEqual(len(cache.expiring), expirecache.ExpiringCache.COMPACT_MIN)
+        self.assertEqual(len(cache), 10)
+        with unittest.mock.patch('time.time', return_value=100):
+            self.assertEqual(cache.get('k:9'), 9999)
+        with unittest.mock.patch('time.time', return_value=4000):
+            cache.sweep()
+        self.assertEqual((len(cache), cache.expiring), (0, []))
+
+    def test_threads(self):
+        errors = []
+
+        def worker(num):
+            try:
+                for i in range(2000):
+                    key = 'k:%d' % (i % 50)
+                    self.cache.set(key, num, 0 if i % 3 else None)
+                    self.cache.get(key)
+                    if i % 100 == 0:
+                        self.cache.sweep()
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=worker, args=(num,)) for num in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,101 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import re
+import sys
+import time
+import random
 import datetime
 import unittest
 
 import field
 from test_base import cases
 
+# the regular expressions the validators replaced, kept as their specification
+VALIDATE_EMAIL_RE = re.compile(r"^.+\@(\[?)[a-zA-Z0-9\-\.]+\.([a-zA-Z]{2,3}|[0-9]{1,3})(\]?)$")
+VALIDATE_PHONE_RE = re.compile(r"^7\d+$")
+ALPHABET = 'aZ09.-@[]\n _\xe9\u0663'
+
+
+def is_valid_email_re(email):
+    return len(email) > 7 and VALIDATE_EMAIL_RE.match(email) is not None
+
+
+def is_valid_phone_re(phone):
+    return len(phone) == 11 and VALIDATE_PHONE_RE.match(phone) is not None
+
+
+def mutate(rnd, value, alphabet=ALPHABET):
+    value = list(value)
+    for _ in range(rnd.randrange(1, 4)):
+        position = rnd.randrange(len(value) + 1)
+        operation = rnd.randrange(3)
+        if operation == 0:
+            value.insert(position, rnd.choice(alphabet))
+        elif position < len(value):
+            if operation == 1:
+                del value[position]
+            else:
+                value[position] = rnd.choice(alphabet)
+    return ''.join(value)
+
+
+def synthetic_emails(count, seed=0):
+    rnd = random.Random(seed)
+    valid = ['aaa@bbb.ccc', '123 aaa@bbb.ccc', 'a@b@[10.0.0.1]', 'stupnikov@otus.ru', 'x@[ya-1.ru]\n', 'u@v.w.123']
+    for _ in range(count):
+        kind = rnd.randrange(3)
+        if kind == 0:
+            yield ''.join(rnd.choice(ALPHABET) for _ in range(rnd.randrange(20)))
+        elif kind == 1:
+            yield mutate(rnd, rnd.choice(valid))
+        else:
+            yield '{:s}@{:s}{:s}.{:s}{:s}'.format(
+                ''.join(rnd.choice(ALPHABET) for _ in range(rnd.randrange(4))),
+                rnd.choice(['', '[']),
+                ''.join(rnd.choice('ab1.-') for _ in range(rnd.randrange(6))),
+                ''.join(rnd.choice('aZ9\xe9\u0663') for _ in range(rnd.randrange(5))),
+                rnd.choice(['', ']', '\n', ']\n', '\n\n']))
+
+
+def synthetic_phones(count, seed=0):
+    rnd = random.Random(seed)
+    digits = '0123456789\u0663\uff19a \n'
+    for _ in range(count):
+        phone = '7' + ''.join(rnd.choice('0123456789') for _ in range(10))
+        yield mutate(rnd, phone, digits) if rnd.randrange(4) else phone
+
+
+class BulkHolder(field.FieldHolder):
+    name = field.CharField(required=True, nullable=False)
+    email = field.EmailField(required=False, nullable=True)
+    birthday = field.BirthDayField(required=False, nullable=True)
+    gender = field.GenderField(required=False, nullable=True)
+
+    def validate(self):
+        super().validate()
+        if self.name == 'nobody':
+            raise ValueError('nobody is not a name')
+
+
+def bulk_structs(count, seed=0):
+    rnd = random.Random(seed)
+    values = {
+        'name': ['a', 'nobody', 1, None],
+        'email': ['stupnikov@otus.ru', 'a@b', 1, None],
+        'birthday': ['01.01.2000', '01.01.1800', '2000-01-01', None],
+        'gender': [0, 2, 3, None],
+    }
+    for _ in range(count):
+        yield {name: rnd.choice(choices) for name, choices in values.items() if rnd.random() < 0.8}
+
+
+def bulk_result(holder, error):
+    if error is not None:
+        return 'error', str(error)
+    return 'valid', {field_name: getattr(holder, field_name) for field_name in holder.field_dict}
+
 
 class TestSuite(unittest.TestCase):
     @cases([({
@@ -62,6 +151,19 @@ class TestSuite(unittest.TestCase):
     @cases([
         'aaa.bbb.ccc',
         'bbb@ccc',
+        'aaa@bbb.c',
+        'aaa@bbb.cccc',
+        'aaa@bbb.1234',
+        'aaa@bbb.c1',
+        'aaa@.ccc',
+        '@bbbb.ccc',
+        'a\na@bbb.ccc',
+        'aaa@b_b.ccc',
+        'aaa@[[bbb.ccc',
+        'aaa@bbb.ccc]]',
+        'aaa@bbb.ccc\n\n',
+        'aaa@bbb.\xe9\xe9',
+        'aaa@bbb.\u0663\u0663',
     ])
     def test_email_field_invalid(self, test):
         field_object = field.EmailField(field_name='test')
@@ -73,6 +175,9 @@ class TestSuite(unittest.TestCase):
         'abcdefghjik',
         '7123456789',
         '81234567890',
+        '7123456789\n\n',
+        '71234 67890',
+        '+7123456789',
     ])
     def test_phone_field_invalid(self, test):
         field_object = field.PhoneField(field_name='test')
@@ -173,6 +278,10 @@ class TestSuite(unittest.TestCase):
     @cases([
         ('aaa@bbb.ccc', 'aaa@bbb.ccc'),
         ('123 aaa@bbb.ccc', '123 aaa@bbb.ccc'),
+        ('a@b@[10.0.0.1]', 'a@b@[10.0.0.1]'),
+        ('aaa@bbb.ccc\n', 'aaa@bbb.ccc\n'),
+        ('aaa@-.-.1', 'aaa@-.-.1'),
+        ('\xe9\xe9@[bbb.cc', '\xe9\xe9@[bbb.cc'),
     ])
     def test_email_field_valid(self, test, value):
         field_object = field.EmailField(field_name='test')
@@ -183,6 +292,9 @@ class TestSuite(unittest.TestCase):
     @cases([
         ('71234567890', '71234567890'),
         (71234567890, '71234567890'),
+        ('7123456789\n', '7123456789\n'),
+        ('7\u0661\u0662\u0663\u0664\u0665\u0666\u0667\u0668\u0669\u0660',
+         '7\u0661\u0662\u0663\u0664\u0665\u0666\u0667\u0668\u0669\u0660'),
     ])
     def test_phone_field_valid(self, test, value):
         field_object = field.PhoneField(field_name='test')
@@ -229,3 +341,113 @@ class TestSuite(unittest.TestCase):
         struct = {'test': test}
         self.assertListEqual(
             field_object.validate(struct), value, msg="{!s} / {!s} -> {!s}".format(type(field_object), test, value))
+
+    @cases([
+        '1',
+        1.5,
+        True,
+    ])
+    def test_integer_field_invalid(self, test):
+        field_object = field.IntegerField(field_name='test')
+        with self.assertRaises(ValueError, msg="{!s} / {!s}".format(type(field_object), test)):
+            field_object.validate({'test': test})
+
+    @cases([
+        {},
+        ['a', 1],
+    ])
+    def test_interests_field_invalid(self, test):
+        field_object = field.InterestsField(field_name='test')
+        with self.assertRaises(ValueError, msg="{!s} / {!s}".format(type(field_object), test)):
+            field_object.validate({'test': test})
+
+    @cases([
+        (field.IntegerField, 0),
+        (field.IntegerField, -5),
+        (field.InterestsField, []),
+        (field.InterestsField, ['cars', 'pets']),
+    ])
+    def test_list_and_integer_field_valid(self, field_class, test):
+        field_object = field_class(field_name='test')
+        self.assertEqual(field_object.validate({'test': test}), test)
+
+    def test_holder_invalid_keeps_no_state(self):
+        class Holder(field.FieldHolder):
+            name = field.CharField(required=False, nullable=True)
+            email = field.EmailField(required=False, nullable=True)
+            client_ids = field.ClientIDsField(required=True)
+
+        holder = Holder({'name': 'a', 'email': 'ab@cd.ru'})
+        with self.assertRaises(ValueError):
+            holder.validate()
+        self.assertFalse(hasattr(holder, 'struct'))
+        self.assertFalse(hasattr(holder, 'name'))
+
+        holder = Holder({'name': 'a', 'email': 'ab@cd.ru', 'client_ids': [1]})
+        holder.validate()
+        self.assertEqual(holder.struct['name'], 'a')
+        self.assertEqual(holder.email, 'ab@cd.ru')
+        self.assertEqual(holder.struct, {'name': 'a', 'email': 'ab@cd.ru', 'client_ids': [1]})
+
+    def test_email_same_as_regex(self):
+        for email in synthetic_emails(30000, seed=1):
+            self.assertEqual(field.EmailField.is_valid_email(email), is_valid_email_re(email), msg=repr(email))
+
+    def test_phone_same_as_regex(self):
+        for phone in synthetic_phones(30000, seed=1):
+            self.assertEqual(field.PhoneField.is_valid_phone(phone), is_valid_phone_re(phone), msg=repr(phone))
+
+    def test_phone_digits_same_as_regex(self):
+        # \d of the regex is every unicode decimal digit, check each code point
+        for code in range(sys.maxunicode + 1):
+            phone = '7123456789' + chr(code)
+            self.assertEqual(field.PhoneField.is_valid_phone(phone), is_valid_phone_re(phone), msg=repr(phone))
+
+    @cases([
+        'a' * 1000000,
+        'a@' * 500000,
+        '@' + 'a.' * 500000 + '!',
+        'a@' + '1.' * 500000 + '1111',
+        'a@[' + 'a-' * 500000 + '.com]]',
+        '\n' * 1000000,
+    ])
+    def test_email_pathological(self, email):
+        started = time.perf_counter()
+        self.assertEqual(field.EmailField.is_valid_email(email), is_valid_email_re(email))
+        self.assertFalse(field.EmailField.is_valid_email(email + '@'))
+        self.assertLess(time.perf_counter() - started, 1.0)
+
+    @unittest.skipUnless(os.environ.get('SCORING_BENCHMARK'), 'set SCORING_BENCHMARK=1 to run benchmarks')
+    def test_benchmark(self):
+        values = [('email', list(synthetic_emails(200000)), field.EmailField.is_valid_email, is_valid_email_re),
+                  ('phone', list(synthetic_phones(200000)), field.PhoneField.is_valid_phone, is_valid_phone_re)]
+        for name, samples, validate, validate_re in values:
+            timings = []
+            for check in [validate_re, validate]:
+                started = time.perf_counter()
+                for value in samples:
+                    check(value)
+                timings.append(time.perf_counter() - started)
+            print('\n200K {:s}: regex {:.3f}s, validator {:.3f}s'.format(name, *timings))
+
+    def test_validate_many(self):
+        structs = list(bulk_structs(500, seed=1))
+        expected = []
+        for struct in structs:
+            holder = BulkHolder(struct)
+            try:
+                holder.validate()
+            except ValueError as e:
+                expected.append(bulk_result(None, e))
+            else:
+                expected.append(bulk_result(holder, None))
+        self.assertEqual(set(kind for kind, _ in expected), {'valid', 'error'})
+        # a birthday out of range fails the row, as any other invalid value
+        self.assertTrue(all(kind == 'error' for struct, (kind, _) in zip(structs, expected)
+                            if struct.get('birthday') == '01.01.1800'))
+        results = [bulk_result(holder, error) for holder, error in BulkHolder.validate_many(iter(structs))]
+        self.assertEqual(results, expected)
+        results = [bulk_result(holder, error)
+                   for holder, error in BulkHolder.validate_many(iter(structs), processes=2, chunk_size=7)]
+        self.assertEqual(results, expected)
+        self.assertEqual(list(BulkHolder.validate_many([], processes=2)), [])
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import base64
+import pathlib
+import shutil
+import unittest
+import unittest.mock
+
+import compression
+import filestorage
+from test_base import cases
+
+
+class TestSuite(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path('./test_filestorage')
+        if self.root.is_dir():
+            shutil.rmtree(str(self.root))
+        self.root.mkdir(parents=True)
+
+    def tearDown(self):
+        if self.root.is_dir():
+            shutil.rmtree(str(self.root))
+
+    def write_legacy(self, key, value):
+        name = base64.b64encode(key.encode('utf-8')).decode('utf-8') + '.rec'
+        (self.root / name).write_text(json.dumps(value))
+
+    @cases([
+        ('i:1', ['cars', 'pets']),
+        ('?>?>', {'a': 1}),
+        ('ключ', None),
+    ])
+    def test_set_get(self, key, value):
+        storage = filestorage.FileStorage(self.root)
+        storage.set(key, value, 'test')
+        self.assertEqual(storage.get(key), value)
+        relative = pathlib.Path(storage.path(key)).relative_to(self.root)
+        self.assertEqual(len(relative.parts), 3)
+        self.assertTrue(all(len(part) == 2 for part in relative.parts[:2]))
+        self.assertEqual(list(self.root.glob('**/*.tmp')), [])
+
+    def test_get_missing(self):
+        storage = filestorage.FileStorage(self.root)
+        with self.assertRaises(KeyError):
+            storage.get('i:1')
+
+    def test_legacy_read_migrates(self):
+        self.write_legacy('i:1', ['cars'])
+        storage = filestorage.FileStorage(self.root)
+        self.assertEqual(storage.get('i:1'), ['cars'])
+        self.assertEqual(list(self.root.glob('*.rec')), [])
+        self.assertTrue(os.path.isfile(storage.path('i:1')))
+
+    def test_migrate(self):
+        for cid in range(10):
+            self.write_legacy('i:%d' % cid, [str(cid)])
+        storage = filestorage.FileStorage(self.root)
+        storage.set('i:0', ['new'], 'test')
+        self.assertEqual(storage.migrate(), 10)
+        self.assertEqual(list(self.root.glob('*.rec')), [])
+        self.assertEqual(storage.get('i:0'), ['new'])
+        for cid in range(1, 10):
+            self.assertEqual(storage.get('i:%d' % cid), [str(cid)])
+
+    def test_set_interests_over_legacy(self):
+        self.write_legacy('i:1', ['cars', 'pets'])
+        storage = filestorage.FileStorage(self.root)
+        storage.index.update(1, [], storage.categories.encode(['cars', 'pets']))
+        codes = storage.categories.codes
+        # set reads the legacy record in place to drop its codes from the
+        # index, the flat file is left to migrate
+        storage.set('i:1', ['pets'], 'test')
+        self.assertEqual(len(list(self.root.glob('*.rec'))), 1)
+        self.assertEqual(storage.index.query([codes['cars']]), ([], None))
+        self.assertEqual(storage.index.query([codes['pets']]), ([1], None))
+        self.assertEqual(storage.get('i:1'), ['pets'])
+        self.assertEqual(storage.migrate(), 1)
+        self.assertEqual(list(self.root.glob('*.rec')), [])
+        self.assertEqual(storage.get('i:1'), ['pets'])
+
+    def test_migrate_keeps_fresh_record(self):
+        self.write_legacy('k:1', ['stale'])
+        storage = filestorage.FileStorage(self.root)
+        link = os.link
+
+        def racing_link(src, dst):
+            # a set of the key lands between the miss and the migration
+            storage.set('k:1', ['fresh'], 'test')
+            link(src, dst)
+        with unittest.mock.patch('os.link', side_effect=racing_link):
+            self.assertTrue(storage.migrate_key('k:1'))
+        self.assertEqual(list(self.root.glob('*.rec')), [])
+        self.assertEqual(storage.get('k:1'), ['fresh'])
+
+    def test_missing_key_makes_no_directories(self):
+        storage = filestorage.FileStorage(self.root)
+        with unittest.mock.patch('os.makedirs') as makedirs:
+            with self.assertRaises(KeyError):
+                storage.get('k:1')
+        makedirs.assert_not_called()
+        self.assertEqual(list(self.root.iterdir()), [])
+
+    def test_fd_cache(self):
+        storage = filestorage.FileStorage(self.root, fd_cache_size=2)
+        for cid in range(3):
+            storage.set('i:%d' % cid, [str(cid)], 'test')
+            self.assertEqual(storage.get('i:%d' % cid), [str(cid)])
+        self.assertEqual(list(storage.fd_cache), ['i:1', 'i:2'])
+        self.assertEqual(storage.get('i:2'), ['2'])
+        storage.set('i:2', ['changed'], 'test')
+        self.assertNotIn('i:2', storage.fd_cache)
+        self.assertEqual(storage.get('i:2'), ['changed'])
+        storage.close()
+        self.assertEqual(len(storage.fd_cache), 0)
+
+    def test_fd_cache_concurrent_write(self):
+        storage = filestorage.FileStorage(self.root, fd_cache_size=2)
+        storage.set('k:1', ['old'], 'test')
+        read_fd = storage.read_fd
+
+        def racing_read_fd(fd):
+            # a set replaces the file after the reader opened it
+            data = read_fd(fd)
+            storage.set('k:1', ['new'], 'test')
+            return data
+        with unittest.mock.patch.object(storage, 'read_fd', side_effect=racing_read_fd):
+            self.assertEqual(storage.get('k:1'), ['old'])
+        self.assertNotIn('k:1', storage.fd_cache)
+        self.assertEqual(storage.get('k:1'), ['new'])
+        self.assertIn('k:1', storage.fd_cache)
+        self.assertEqual(storage.get('k:1'), ['new'])
+        storage.close()
+
+    def test_compressed(self):
+        value = ['cars', 'pets'] * 100
+        storage = filestorage.FileStorage(self.root, codec=compression.RecordCodec(True))
+        storage.set('i:1', value, 'test')
+        self.assertLess(os.path.getsize(storage.path('i:1')), len(json.dumps(value)))
+        self.assertEqual(filestorage.FileStorage(self.root).get('i:1'), value)
+
+    def test_interests_encoded(self):
+        storage = filestorage.FileStorage(self.root)
+        storage.set('i:1', '["cars", "pets"]', 'test')
+        storage.set('i:2', ['pets', 'tv'], 'test')
+        storage.set('x:1', ['pets', 'tv'], 'test')
+        self.assertEqual(list(storage.get_codes('i:1')), [0, 1])
+        self.assertEqual(list(storage.get_codes('i:2')), [1, 2])
+        self.assertIsNone(storage.get_codes('x:1'))
+        storage = filestorage.FileStorage(self.root)
+        self.assertEqual(storage.get('i:1'), '["cars", "pets"]')
+        self.assertEqual(storage.get('i:2'), ['pets', 'tv'])
+
+    def test_interests_index(self):
+        storage = filestorage.FileStorage(self.root)
+        storage.set('i:1', ['cars', 'pets'], 'test')
+        storage.set('i:2', ['pets'], 'test')
+        storage.set('i:x', ['pets'], 'test')
+        codes = storage.categories.codes
+        self.assertEqual(storage.index.query([codes['pets']]), ([1, 2], None))
+        storage.set('i:1', ['tv'], 'test')
+        self.assertEqual(storage.index.query([codes['pets']]), ([2], None))
+        storage.set('i:2', 'not interests', 'test')
+        self.assertEqual(storage.index.query([codes['pets']]), ([], None))
+        self.write_legacy('i:3', ['pets'])
+        storage = filestorage.FileStorage(self.root)
+        self.assertEqual(storage.build_indexes(), 2)
+        self.assertEqual(storage.index.query([codes['tv']], [codes['pets']]), ([], None))
+        self.assertEqual(storage.index.query([], [codes['tv'], codes['pets']]), ([1, 3], None))
+        self.assertEqual(sorted(storage.keys()), ['i:1', 'i:2', 'i:3', 'i:x'])
+
+    def test_build_indexes_keeps_writes(self):
+        # kvs.py serves while the indexes are built, what is written meanwhile stays indexed
+        storage = filestorage.FileStorage(self.root)
+        storage.set('i:1', ['cars'], 'test')
+        storage.set('k:1', 1, 'test')
+        storage = filestorage.FileStorage(self.root)
+        self.assertFalse(storage.indexes_ready.is_set())
+        storage.set('i:2', ['cars'], 'test')
+        storage.set('i:1', ['pets'], 'test')
+        storage.set('k:2', 2, 'test')
+        storage.build_indexes()
+        self.assertTrue(storage.indexes_ready.is_set())
+        codes = storage.categories.codes
+        self.assertEqual(storage.index.query([codes['cars']]), ([2], None))
+        self.assertEqual(storage.index.query([codes['pets']]), ([1], None))
+        self.assertEqual([key for key, _ in storage.scan()], ['i:1', 'i:2', 'k:1', 'k:2'])
+
+    def test_scan_drops_missing_keys(self):
+        storage = filestorage.FileStorage(self.root)
+        for key in ['a:1', 'a:2', 'a:3']:
+            storage.set(key, key, 'test')
+        os.unlink(storage.path('a:2'))
+        self.assertEqual(list(storage.scan()), [('a:1', 'a:1'), ('a:3', 'a:3')])
+        self.assertNotIn('a:2', storage.key_index)
+        self.assertEqual(len(storage.key_index), 2)
+
+    @cases([
+        ({}, ['a:1', 'a:2', 'a:3', 'b:1', 'i:1']),
+        ({'prefix': 'a:'}, ['a:1', 'a:2', 'a:3']),
+        ({'prefix': 'a:', 'start': 'a:2'}, ['a:2', 'a:3']),
+        ({'prefix': 'a:', 'cursor': 'a:2'}, ['a:3']),
+        ({'start': 'a:2', 'end': 'b:2'}, ['a:2', 'a:3', 'b:1']),
+        ({'start': 'a:3', 'cursor': 'a:1'}, ['a:3', 'b:1', 'i:1']),
+        ({'prefix': 'c:'}, []),
+    ])
+    def test_scan(self, bounds, keys):
+        storage = filestorage.FileStorage(self.root)
+        for key in ['b:1', 'a:3', 'a:1', 'i:1', 'a:2']:
+            storage.set(key, key, 'test')
+        self.assertEqual(list(storage.scan(**bounds)), [(key, key) for key in keys])
+        storage = filestorage.FileStorage(self.root)
+        storage.build_indexes()
+        self.assertEqual(list(storage.scan(**bounds)), [(key, key) for key in keys])
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import pathlib
+import shutil
+import unittest
+
+import interests
+from test_base import cases
+
+
+class TestSuite(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path('./test_interests')
+        if self.root.is_dir():
+            shutil.rmtree(str(self.root))
+        self.root.mkdir(parents=True)
+
+    def tearDown(self):
+        if self.root.is_dir():
+            shutil.rmtree(str(self.root))
+
+    def test_table_persist(self):
+        path = str(self.root / 'categories.jsonl')
+        table = interests.CategoryTable(path)
+        self.assertEqual(list(table.encode(['cars', 'pets', 'cars'])), [0, 1, 0])
+        table = interests.CategoryTable(path)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(list(table.encode(['pets', 'tv'])), [1, 2])
+        self.assertEqual(table.since(1), ['pets', 'tv'])
+
+    @cases([
+        ['cars', 'pets'],
+        '["cars", "pets"]',
+        [],
+        '[]',
+    ])
+    def test_record_roundtrip(self, value):
+        table = interests.CategoryTable()
+        record = interests.encode_record(value, table)
+        self.assertTrue(interests.is_record(record))
+        self.assertEqual(interests.decode_record(record, table), value)
+        self.assertEqual(len(interests.decode_codes(record)), len(interests.parse(value)))
+
+    @cases([
+        'cars',
+        '{"cars": 1}',
+        '["cars",   "pets"]',
+        [1, 2],
+        {'a': 'b'},
+    ])
+    def test_record_not_encodable(self, value):
+        self.assertIsNone(interests.encode_record(value, interests.CategoryTable()))
+
+    def test_record_compact(self):
+        table = interests.CategoryTable()
+        value = '["cars", "pets", "travel", "hi-tech"]'
+        self.assertLess(len(interests.encode_record(value, table)), len(value) // 3)
+
+    def test_decode_interned(self):
+        table = interests.CategoryTable()
+        first = interests.decode_record(interests.encode_record(['cars'], table), table)
+        second = interests.decode_record(interests.encode_record([''.join(['ca', 'rs'])], table), table)
+        self.assertIs(first[0], second[0])
+
+    def test_index_query(self):
+        index = interests.InterestIndex()
+        index.update(1, [], [0, 1])
+        index.update(2, [], [1, 2])
+        index.update(3, [], [2])
+        index.update(3, [2], [0])
+        self.assertEqual(index.query([1]), ([1, 2], None))
+        self.assertEqual(index.query([0, 1]), ([1], None))
+        self.assertEqual(index.query([], [0, 2]), ([1, 2, 3], None))
+        self.assertEqual(index.query([1], [2]), ([2], None))
+        self.assertEqual(index.query([5]), ([], None))
+        self.assertEqual(index.query(), ([], None))
+        self.assertEqual(index.query([], [0, 1], limit=2), ([1, 2], 2))
+        self.assertEqual(index.query([], [0, 1], cursor=2, limit=2), ([3], None))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import random
+import unittest
+import unittest.mock
+
+import keyindex
+from test_base import cases
+
+
+class TestSuite(unittest.TestCase):
+    def make_keys(self, count):
+        generator = random.Random(count)
+        return ['k:{:d}'.format(generator.randrange(count * 10)) for _ in range(count)]
+
+    @cases([0, 1, 10, 1000])
+    def test_iter_from(self, count):
+        keys = self.make_keys(count)
+        with unittest.mock.patch('keyindex.KeyIndex.BLOCK_SIZE', 4):
+            index = keyindex.KeyIndex(keys[:count // 2])
+            for key in keys[count // 2:]:
+                index.add(key)
+        ordered = sorted(set(keys))
+        self.assertEqual(len(index), len(ordered))
+        self.assertEqual(list(index.iter_from()), ordered)
+        for start in ordered[::max(1, count // 10)] + ['', 'k:5', 'z']:
+            self.assertEqual(list(index.iter_from(start)), [key for key in ordered if key >= start])
+            self.assertEqual(list(index.iter_from(start, inclusive=False)), [key for key in ordered if key > start])
+
+    def test_contains(self):
+        index = keyindex.KeyIndex(['b', 'd'])
+        index.add('a')
+        self.assertIn('a', index)
+        self.assertIn('d', index)
+        self.assertNotIn('c', index)
+        self.assertNotIn('e', index)
+
+    @cases([0, 10, 1000])
+    def test_update(self, count):
+        keys = self.make_keys(count)
+        with unittest.mock.patch('keyindex.KeyIndex.BLOCK_SIZE', 4):
+            index = keyindex.KeyIndex()
+            for key in keys[:count // 3] + ['a', 'z']:
+                index.add(key)
+            index.update(keys)
+            index.add('k:0')
+        ordered = sorted(set(keys) | {'a', 'z', 'k:0'})
+        self.assertEqual(len(index), len(ordered))
+        self.assertEqual(list(index.iter_from()), ordered)
+        self.assertEqual(list(index.iter_from('k:5')), [key for key in ordered if key >= 'k:5'])
+
+    def test_discard(self):
+        keys = ['k:{:02d}'.format(num) for num in range(20)]
+        with unittest.mock.patch('keyindex.KeyIndex.BLOCK_SIZE', 4):
+            index = keyindex.KeyIndex(keys)
+            for key in keys[4:8] + ['k:19', 'k:10', 'missing', 'z']:
+                index.discard(key)
+            index.add('k:05')
+        ordered = sorted(set(keys) - set(keys[4:8] + ['k:19', 'k:10']) | {'k:05'})
+        self.assertEqual(len(index), len(ordered))
+        self.assertEqual(list(index.iter_from()), ordered)
+        self.assertEqual(list(index.iter_from('k:04')), [key for key in ordered if key >= 'k:04'])
+        self.assertNotIn('k:19', index)
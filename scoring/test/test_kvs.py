@@ -6,7 +6,15 @@ import json
 import time
 import pathlib
 import shutil
+import socket
+import zlib
+import tempfile
+import http.client
+import unittest.mock
 
+import compression
+import filestorage
+import kvs
 from test_base import ManageKVS
 
 
@@ -73,11 +81,32 @@ class TestSuite(unittest.TestCase):
         self.assertEqual(response_decoded['code'], 200)
         self.assertIsNone(response_decoded['response'])
 
+    def test_request_id(self):
+        # a client id is echoed and logged, but never used in file names
+        headers = {'X-Request-Id': '../../escape'}
+        response = self.kvs.make_request('/data_set', '{"key": "123", "value": 1}', headers)
+        response.read()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('X-Request-Id'), '../../escape')
+        self.assertEqual([path for path in self.root.parent.glob('*.tmp')], [])
+        response = self.kvs.make_request('/data_get', '{"key": "123"}')
+        self.assertEqual(json.loads(response.read().decode('utf-8'))['response'], 1)
+        self.assertTrue(response.getheader('X-Request-Id'))
+
+    def test_profile_disabled(self):
+        connect = http.client.HTTPConnection('localhost', 8010, 1)
+        try:
+            connect.request('GET', '/debug/profile?seconds=1')
+            response = connect.getresponse()
+            self.assertEqual(json.loads(response.read().decode('utf-8'))['code'], 404)
+        finally:
+            connect.close()
+
     def test_data_empty(self):
         response = self.kvs.make_request('/data_get', '{"key": "123_empty"}')
         response_decoded = json.loads(response.read().decode('utf-8'))
-        self.assertEqual(response.status, 422)
-        self.assertEqual(response_decoded['code'], 422)
+        self.assertEqual(response.status, 404)
+        self.assertEqual(response_decoded['code'], 404)
 
     def test_data_set(self):
         response = self.kvs.make_request('/data_set', '{"key": "123_set", "value": { "a": 1, "b": 2 } }')
@@ -100,3 +129,206 @@ class TestSuite(unittest.TestCase):
         self.assertEqual(response.status, 200)
         self.assertEqual(response_decoded['code'], 200)
         self.assertDictEqual(response_decoded['response'], {"a": 1, "b": 2})
+
+    def test_deadline_exceeded(self):
+        headers = {'X-Request-Deadline': str(time.time() - 1)}
+        response = self.kvs.make_request('/data_set', '{"key": "123_deadline", "value": 1}', headers)
+        response_decoded = json.loads(response.read().decode('utf-8'))
+        self.assertEqual(response.status, 504)
+        self.assertEqual(response_decoded['code'], 504)
+
+        response = self.kvs.make_request('/data_get', '{"key": "123_deadline"}')
+        self.assertEqual(response.status, 404)
+
+    def test_compressed_response(self):
+        value = json.dumps(['cars'] * 1000)
+        response = self.kvs.make_request('/data_set', json.dumps({"key": "123_large", "value": value}))
+        self.assertEqual(response.status, 200)
+        self.assertIn('deflate', response.getheader('Accept-Encoding'))
+
+        response = self.kvs.make_request('/data_get', '{"key": "123_large"}', {'Accept-Encoding': 'deflate'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'deflate')
+        response_decoded = json.loads(zlib.decompress(response.read()).decode('utf-8'))
+        self.assertEqual(response_decoded['response'], value)
+
+    def test_compressed_request(self):
+        body = zlib.compress(b'{"key": "123_deflate", "value": 1}')
+        response = self.kvs.make_request('/data_set', body, {'Content-Encoding': 'deflate'})
+        self.assertEqual(response.status, 200)
+
+        response = self.kvs.make_request('/data_get', '{"key": "123_deflate"}')
+        response_decoded = json.loads(response.read().decode('utf-8'))
+        self.assertEqual(response_decoded['response'], 1)
+
+    def test_compressed_request_too_large(self):
+        body = zlib.compress(b'{"key": "123_bomb", "value": "' + b'0' * (compression.BODY_MAX_SIZE + 1) + b'"}', 9)
+        response = self.kvs.make_request('/data_set', body, {'Content-Encoding': 'deflate'})
+        self.assertEqual(response.status, 413)
+
+        response = self.kvs.make_request('/data_get', '{"key": "123_bomb"}')
+        self.assertEqual(response.status, 404)
+
+    def test_interests_codes(self):
+        response = self.kvs.make_request('/data_set', '{"key": "i:1", "value": "[\\"cars\\", \\"pets\\"]"}')
+        self.assertEqual(response.status, 200)
+
+        response = self.kvs.make_request('/data_get', '{"key": "i:1", "encoding": "codes"}')
+        response_decoded = json.loads(response.read().decode('utf-8'))
+        self.assertEqual(response_decoded['response'], {'codes': [0, 1]})
+
+        response = self.kvs.make_request('/categories_get', '{"offset": 1}')
+        response_decoded = json.loads(response.read().decode('utf-8'))
+        self.assertEqual(response_decoded['response'], ['pets'])
+
+        response = self.kvs.make_request('/data_get', '{"key": "i:1"}')
+        response_decoded = json.loads(response.read().decode('utf-8'))
+        self.assertEqual(response_decoded['response'], '["cars", "pets"]')
+
+    def test_data_scan(self):
+        for key in ['s:1', 's:2', 's:3', 't:1']:
+            response = self.kvs.make_request('/data_set', json.dumps({"key": key, "value": key}))
+            self.assertEqual(response.status, 200)
+
+        response = self.kvs.make_request('/data_scan', '{"prefix": "s:", "limit": 2}')
+        response_decoded = json.loads(response.read().decode('utf-8'))
+        self.assertEqual(response_decoded['code'], 200)
+        self.assertEqual(response_decoded['response'], {'items': [['s:1', 's:1'], ['s:2', 's:2']], 'cursor': 's:2'})
+
+        response = self.kvs.make_request('/data_scan', '{"prefix": "s:", "limit": 2, "cursor": "s:2"}')
+        response_decoded = json.loads(response.read().decode('utf-8'))
+        self.assertEqual(response_decoded['response'], {'items': [['s:3', 's:3']], 'cursor': None})
+
+        response = self.kvs.make_request('/data_scan', '{"limit": 0}')
+        self.assertEqual(response.status, 422)
+
+    def test_data_scan_chunks(self):
+        keys = ['c:{:03d}'.format(num) for num in range(250)]
+        for key in keys:
+            self.kvs.make_request('/data_set', json.dumps({"key": key, "value": 1}))
+
+        response = self.kvs.make_request('/data_scan', '{"prefix": "c:", "limit": 1000}')
+        response_decoded = json.loads(response.read().decode('utf-8'))
+        self.assertEqual([item[0] for item in response_decoded['response']['items']], keys)
+        self.assertIsNone(response_decoded['response']['cursor'])
+
+    def corrupt(self, key):
+        path = filestorage.FileStorage(self.root).path(key)
+        with open(path, 'wb') as record:
+            record.write(b'{not json')
+
+    def test_data_scan_error(self):
+        keys = ['c:{:03d}'.format(num) for num in range(250)]
+        for key in keys:
+            self.kvs.make_request('/data_set', json.dumps({"key": key, "value": 1}))
+
+        self.corrupt('c:000')
+        response = self.kvs.make_request('/data_scan', '{"prefix": "c:", "limit": 1000}')
+        self.assertEqual(response.status, 500)
+        self.assertEqual(json.loads(response.read().decode('utf-8'))['code'], 500)
+
+        # the status is sent with the first chunk, a failure after it leaves
+        # the body without its last chunk
+        self.corrupt('c:150')
+        connect = self.kvs.make_connection(5)
+        try:
+            connect.request('POST', '/data_scan', '{"prefix": "c:", "start": "c:001", "limit": 1000}')
+            response = connect.getresponse()
+            self.assertEqual(response.status, 200)
+            with self.assertRaises(http.client.IncompleteRead):
+                response.read()
+        finally:
+            connect.close()
+        response = self.kvs.make_request('/data_scan', '{"prefix": "c:2", "limit": 1000}')
+        self.assertEqual(len(json.loads(response.read().decode('utf-8'))['response']['items']), 50)
+
+    def get_metrics(self):
+        connect = self.kvs.make_connection(1)
+        try:
+            connect.request('GET', '/metrics')
+            return json.loads(connect.getresponse().read().decode('utf-8'))['response']
+        finally:
+            connect.close()
+
+    def test_keep_alive(self):
+        connect = self.kvs.make_connection(1)
+        try:
+            for num in range(3):
+                connect.request('POST', '/cache_set', json.dumps({"key": "k", "value": num}))
+                response = connect.getresponse()
+                self.assertEqual(response.getheader('Content-Length'), str(len(response.read())))
+                self.assertFalse(response.will_close)
+                if num == 0:
+                    sock = connect.sock
+                self.assertIs(connect.sock, sock)
+            metrics = self.get_metrics()
+            self.assertEqual(metrics['connections_active'], 2)
+            self.assertGreaterEqual(metrics['requests_reused'], 2)
+        finally:
+            connect.close()
+
+    def test_pipelining(self):
+        requests = [json.dumps({"key": "p", "value": 1}), json.dumps({"key": "p"})]
+        data = b''.join(
+            'POST /{:s} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {:d}\r\n\r\n{:s}'.format(
+                path, len(request), request).encode('utf-8')
+            for path, request in zip(['cache_set', 'cache_get'], requests))
+        with socket.create_connection(('localhost', 8010), 1) as sock, sock.makefile('rb') as rfile:
+            sock.sendall(data)
+            responses = []
+            for _ in requests:
+                self.assertTrue(rfile.readline().startswith(b'HTTP/1.1 200'))
+                headers = http.client.parse_headers(rfile)
+                responses.append(json.loads(rfile.read(int(headers['Content-Length'])).decode('utf-8')))
+        self.assertEqual(responses, [{"response": None, "code": 200}, {"response": 1, "code": 200}])
+
+    def test_max_requests(self):
+        self.kvs.stop()
+        self.kvs = ManageKVS(8010, self.root, options='--max-requests 2')
+        self.kvs.start()
+        connect = self.kvs.make_connection(1)
+        try:
+            connect.request('GET', '/ping')
+            response = connect.getresponse()
+            response.read()
+            self.assertIsNone(response.getheader('Connection'))
+            connect.request('GET', '/ping')
+            response = connect.getresponse()
+            response.read()
+            self.assertEqual(response.getheader('Connection'), 'close')
+            self.assertIsNone(connect.sock)
+        finally:
+            connect.close()
+
+    def test_idle_timeout(self):
+        self.kvs.stop()
+        self.kvs = ManageKVS(8010, self.root, options='--idle-timeout 0.2')
+        self.kvs.start()
+        with socket.create_connection(('localhost', 8010), 1) as sock:
+            time.sleep(0.4)
+            self.assertEqual(sock.recv(1), b'')
+        self.assertEqual(self.get_metrics()['connections_active'], 1)
+
+    def test_bad_request_closes_connection(self):
+        with socket.create_connection(('localhost', 8010), 1) as sock:
+            sock.sendall(b'POST /cache_get HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            response = http.client.HTTPResponse(sock)
+            response.begin()
+            self.assertEqual(response.status, 400)
+            self.assertEqual(response.getheader('Connection'), 'close')
+
+
+class TestIndexWaitSuite(unittest.TestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        patcher = unittest.mock.patch.multiple(kvs, storage=filestorage.FileStorage(root.name), INDEX_WAIT=0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_not_ready(self):
+        kvs.storage.set('i:1', ['cars'], 'test')
+        self.assertEqual(kvs.index_query({'all': ['cars']}, {}, {})[1], kvs.SERVICE_UNAVAILABLE)
+        self.assertEqual(kvs.data_scan({}, {}, {})[1], kvs.SERVICE_UNAVAILABLE)
+        kvs.storage.build_indexes()
+        self.assertEqual(kvs.index_query({'all': ['cars']}, {}, {}), ({'ids': [1], 'cursor': None}, kvs.OK))
+        self.assertEqual(list(kvs.data_scan({}, {}, {})[0].items), [('i:1', ['cars'])])
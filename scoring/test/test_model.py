@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime
+import json
+import os
+import pathlib
+import shutil
+import unittest
+import unittest.mock
+
+import model
+from test_base import cases
+
+PRESENCE_SPEC = {
+    "version": "presence-file",
+    "features": {
+        "phone": {"field": "phone", "transform": "present"},
+        "email": {"field": "email", "transform": "present"},
+        "birthday": {"field": "birthday", "transform": "present"},
+        "gender": {"field": "gender", "transform": "present"},
+        "first_name": {"field": "first_name", "transform": "present"},
+        "last_name": {"field": "last_name", "transform": "present"},
+    },
+    "terms": [
+        {"weight": 1.5, "features": ["phone"]},
+        {"weight": 1.5, "features": ["email"]},
+        {"weight": 1.5, "features": ["birthday", "gender"]},
+        {"weight": 0.5, "features": ["first_name", "last_name"]},
+    ],
+}
+
+WEIGHTED_SPEC = {
+    "version": "weighted-1",
+    "bias": 0.25,
+    "features": {
+        "has_phone": {"field": "phone", "transform": "present"},
+        "young": {"field": "birthday", "transform": "age_between", "min": 18, "max": 30},
+        "female": {"field": "gender", "transform": "equals", "value": 2},
+    },
+    "terms": [
+        {"weight": 1.5, "features": ["has_phone"]},
+        {"weight": 0.75, "features": ["young", "female"]},
+    ],
+}
+
+
+class TestSuite(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path('./test_model')
+        if self.root.is_dir():
+            shutil.rmtree(str(self.root))
+        self.root.mkdir(parents=True)
+
+    def tearDown(self):
+        if self.root.is_dir():
+            shutil.rmtree(str(self.root))
+
+    def write_model(self, spec, mtime):
+        path = self.root / 'model.json'
+        path.write_text(spec if isinstance(spec, str) else json.dumps(spec))
+        os.utime(str(path), (mtime, mtime))
+        return str(path)
+
+    def test_score_is_abstract(self):
+        class NoScoreModel(model.ScoreModel):
+            version = 'none-1'
+
+        with self.assertRaises(TypeError):
+            NoScoreModel()
+
+    def test_presence_compiled_to_table(self):
+        compiled = model.compile_model(PRESENCE_SPEC)
+        builtin = model.PresenceScoreModel()
+        self.assertEqual(compiled.cost, model.COST_CHEAP)
+        self.assertEqual(compiled.version, 'presence-file')
+        for mask in range(1 << len(model.FIELDS)):
+            values = ['x' if mask & (1 << bit) else None for bit in range(len(model.FIELDS))]
+            self.assertEqual(compiled.score(*values), builtin.score(*values), msg=values)
+
+    @cases([
+        ({}, 0.25),
+        ({'phone': '79175002040'}, 1.75),
+        ({'birthday': 20, 'gender': 2}, 1.0),
+        ({'birthday': 20, 'gender': 1}, 0.25),
+        ({'birthday': 40, 'gender': 2}, 0.25),
+    ])
+    def test_weighted_model(self, arguments, score):
+        compiled = model.compile_model(WEIGHTED_SPEC)
+        self.assertEqual(compiled.cost, model.COST_EXPENSIVE)
+        arguments = dict({'phone': None, 'email': None}, **arguments)
+        if 'birthday' in arguments:
+            today = datetime.date.today()
+            arguments['birthday'] = today.replace(year=today.year - arguments['birthday'])
+        self.assertEqual(compiled.score(**arguments), score)
+
+    @cases([
+        {"version": 1, "features": {"f": {"field": "age", "transform": "present"}}, "terms": []},
+        {"version": 1, "features": {"f": {"field": "phone", "transform": "log"}}, "terms": []},
+    ])
+    def test_invalid_model(self, spec):
+        with self.assertRaises(ValueError):
+            model.compile_model(spec)
+
+    def test_holder_reload_on_change(self):
+        holder = model.ModelHolder(model.PresenceScoreModel(), check_interval=0)
+        holder.watch(self.write_model(PRESENCE_SPEC, 1000))
+        self.assertEqual(holder.current().version, 'presence-file')
+        self.write_model(WEIGHTED_SPEC, 2000)
+        self.assertEqual(holder.current().version, 'weighted-1')
+
+    def test_holder_keep_model_on_error(self):
+        holder = model.ModelHolder(model.PresenceScoreModel(), check_interval=0)
+        holder.watch(self.write_model(WEIGHTED_SPEC, 1000))
+        self.write_model('{"version": ', 2000)
+        with unittest.mock.patch('logging.exception'):
+            self.assertFalse(holder.reload())
+            self.assertEqual(holder.current().version, 'weighted-1')
+
+    @cases([
+        {"version": 1, "features": ["phone"], "terms": []},
+        {"version": 1, "features": {}, "terms": [1]},
+        [WEIGHTED_SPEC],
+    ])
+    def test_holder_keep_model_on_wrong_shape(self, spec):
+        holder = model.ModelHolder(model.PresenceScoreModel(), check_interval=0)
+        holder.watch(self.write_model(WEIGHTED_SPEC, 1000))
+        self.write_model(spec, 2000)
+        with unittest.mock.patch('logging.exception') as log_exception:
+            self.assertEqual(holder.current().version, 'weighted-1')
+            self.assertFalse(holder.reload())
+        self.assertEqual(log_exception.call_count, 2)
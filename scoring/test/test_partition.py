@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import tempfile
+import unittest
+import unittest.mock
+
+import partition
+
+
+def make_body(response, code=200):
+    return json.dumps({"response": response, "code": code}).encode('utf-8')
+
+
+class TestSuite(unittest.TestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.dispatcher = partition.Dispatcher(root.name, 3)
+
+    def test_partition(self):
+        self.assertEqual(partition.partition('i:1', 3), partition.partition('i:1', 3))
+        counts = [0] * 4
+        for num in range(4000):
+            counts[partition.partition('k:%d' % num, 4)] += 1
+        self.assertTrue(all(800 < count < 1200 for count in counts), counts)
+
+    def test_query_index(self):
+        bodies = [
+            (200, make_body({'ids': [1, 4, 7], 'cursor': 7})),
+            (200, make_body({'ids': [2, 5], 'cursor': None})),
+            (200, make_body({'ids': [3], 'cursor': None})),
+        ]
+        with unittest.mock.patch.object(self.dispatcher, 'broadcast', return_value=bodies) as mock_broadcast:
+            self.assertEqual(self.dispatcher.query_index({'all': ['a'], 'limit': 4}, {}, 4, 'r-1'),
+                             ({'ids': [1, 2, 3, 4], 'cursor': 4}, 200))
+            mock_broadcast.assert_called_once_with('/index_query', {'all': ['a'], 'limit': 5}, {}, 'r-1')
+            self.assertEqual(self.dispatcher.query_index({}, {}, 6), ({'ids': [1, 2, 3, 4, 5, 7], 'cursor': None}, 200))
+
+    def test_scan(self):
+        bodies = [
+            (200, make_body({'items': [['a', 1], ['d', 4]], 'cursor': 'd'})),
+            (200, make_body({'items': [['b', 2]], 'cursor': None})),
+            (200, make_body({'items': [], 'cursor': None})),
+        ]
+        with unittest.mock.patch.object(self.dispatcher, 'broadcast', return_value=bodies):
+            self.assertEqual(self.dispatcher.scan({}, {}, 2), ([('a', 1), ('b', 2), ('d', 4)], 200))
+            self.assertEqual(self.dispatcher.scan({}, {}, 3), ([('a', 1), ('b', 2), ('d', 4), (None, None)], 200))
+            self.assertEqual(self.dispatcher.scan({}, {}, 4), ([('a', 1), ('b', 2), ('d', 4)], 200))
+
+    def test_worker_error(self):
+        bodies = [(200, make_body({'ids': [], 'cursor': None})), (422, make_body(None, 422))]
+        with unittest.mock.patch.object(self.dispatcher, 'broadcast', return_value=bodies):
+            self.assertEqual(self.dispatcher.query_index({}, {}, 4)[1], 422)
+
+    def test_translate_codes(self):
+        with unittest.mock.patch.object(self.dispatcher, 'request', autospec=True) as mock_request:
+            mock_request.side_effect = [(200, make_body(['b', 'a'])), (200, make_body(['c', 'a']))]
+            self.dispatcher.categories.extend(['a'])
+            self.assertEqual(self.dispatcher.translate_codes(0, [0, 1], {}), [1, 0])
+            self.assertEqual(self.dispatcher.translate_codes(1, [1, 0], {}), [0, 2])
+            self.assertEqual(self.dispatcher.translate_codes(0, [1], {}), [0])
+            self.assertEqual(mock_request.call_count, 2)
+
+    def test_request_id_forwarded(self):
+        # the workers get the id of the request even when the client sent none
+        # and from the threads of the executor as well
+        sent = []
+        for worker in self.dispatcher.workers:
+            worker.request = lambda method, body, headers: sent.append(headers) or (200, make_body(None))
+        headers = {'X-Request-Deadline': '1.5', 'X-Request-Id': 'from-client'}
+        self.dispatcher.forward('k:1', '/cache_get', {}, headers, 'r-1')
+        self.dispatcher.broadcast('/index_query', {}, headers, 'r-2')
+        self.dispatcher.forward('k:1', '/cache_get', {}, {})
+        self.assertEqual([sent_headers.get('X-Request-Id') for sent_headers in sent], ['r-1'] + ['r-2'] * 3 + [None])
+        self.assertEqual([sent_headers.get('X-Request-Deadline') for sent_headers in sent], ['1.5'] * 4 + [None])
+
+    def test_worker_pool(self):
+        with unittest.mock.patch('transport.UnixHTTPConnection') as mock_connection:
+            mock_connection.side_effect = lambda path, timeout: unittest.mock.Mock(sock=None)
+            worker = partition.WorkerClient('worker.sock', 1)
+            connects = [worker.acquire() for _ in range(partition.WorkerClient.POOL_SIZE + 2)]
+            self.assertEqual(mock_connection.call_count, partition.WorkerClient.POOL_SIZE + 2)
+            for connect in connects:
+                worker.release(connect)
+            self.assertEqual(len(worker.pool), partition.WorkerClient.POOL_SIZE)
+            self.assertEqual([connect.close.call_count for connect in connects[-2:]], [1, 1])
+
+            connect = worker.pool[-1]
+            connect.getresponse.return_value.status = 200
+            connect.getresponse.return_value.read.return_value = make_body(1)
+            self.assertEqual(worker.request('/cache_get', '{}', {}), (200, make_body(1)))
+            self.assertIs(worker.pool[-1], connect)
+            self.assertEqual(mock_connection.call_count, partition.WorkerClient.POOL_SIZE + 2)
+            worker.close()
+            self.assertEqual(worker.pool, [])
+            connect.close.assert_called_once_with()
+
+
+if __name__ == "__main__":
+    unittest.main()
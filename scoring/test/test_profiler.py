@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import pstats
+import shutil
+import pathlib
+import tempfile
+import threading
+import unittest
+
+import api
+import profiler
+from test_base import cases, ManageAPI, ManageKVS
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def run_busy(func):
+    stop = threading.Event()
+    thread = threading.Thread(target=busy_loop, args=(stop,))
+    thread.start()
+    try:
+        return func()
+    finally:
+        stop.set()
+        thread.join()
+
+
+class TestSuite(unittest.TestCase):
+    def test_sampler(self):
+        sampler = run_busy(lambda: profiler.Sampler(0.001).run(0.2))
+        self.assertGreater(sampler.samples, 10)
+        busy = [stack for stack in sampler.stacks if 'busy_loop' in [name for _, _, name in stack]]
+        self.assertTrue(busy)
+        # the sampling thread itself is left out
+        self.assertFalse([stack for stack in sampler.stacks if stack[-1][2] == 'sample'])
+        lines = sampler.collapsed().splitlines()
+        self.assertEqual(sum(int(line.rsplit(' ', 1)[1]) for line in lines), sum(sampler.stacks.values()))
+        self.assertTrue(any(line.rsplit(' ', 1)[0].endswith('busy_loop (test_profiler.py:{:d})'.format(
+            busy_loop.__code__.co_firstlineno)) for line in lines))
+
+    def test_sampler_pstats(self):
+        sampler = run_busy(lambda: profiler.Sampler(0.001).run(0.2))
+        with tempfile.NamedTemporaryFile() as dump:
+            dump.write(sampler.dump(profiler.PSTATS))
+            dump.flush()
+            stats = pstats.Stats(dump.name)
+        functions = {name: values for (_, _, name), values in stats.stats.items()}
+        cc, nc, tt, ct, callers = functions['busy_loop']
+        # busy_loop is not always the innermost frame, stop.is_set may be
+        samples = sum(count for stack, count in sampler.stacks.items()
+                      if 'busy_loop' in [name for _, _, name in stack])
+        innermost = sum(count for stack, count in sampler.stacks.items() if stack[-1][2] == 'busy_loop')
+        self.assertEqual(nc, samples)
+        self.assertAlmostEqual(tt, innermost * 0.001)
+        self.assertIn('run', [name for _, _, name in callers])
+        self.assertAlmostEqual(stats.total_tt, sum(sampler.stacks.values()) * 0.001)
+
+    @cases([
+        ('/debug/profile', (profiler.DEFAULT_SECONDS, profiler.DEFAULT_INTERVAL, profiler.COLLAPSED)),
+        ('/debug/profile?seconds=2&interval=0.01&format=pstats', (2.0, 0.01, profiler.PSTATS)),
+        ('/debug/profile?seconds=0', ValueError),
+        ('/debug/profile?seconds=1000', ValueError),
+        ('/debug/profile?seconds=x', ValueError),
+        ('/debug/profile?interval=0', ValueError),
+        ('/debug/profile?format=svg', ValueError),
+    ])
+    def test_parse_query(self, path, expected):
+        if expected is ValueError:
+            with self.assertRaises(ValueError):
+                profiler.parse_query(path)
+        else:
+            self.assertEqual(profiler.parse_query(path), expected)
+
+    def test_profile_collector(self):
+        collector = profiler.ProfileCollector()
+        threads = [threading.Thread(target=collector.runcall, args=(sum, range(1000))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'profile')
+            collector.dump(path)
+            stats = pstats.Stats(path)
+        calls = [values[1] for (_, _, name), values in stats.stats.items() if name == "<built-in method builtins.sum>"]
+        self.assertEqual(calls, [3])
+
+
+class TestEndpointSuite(unittest.TestCase):
+    def setUp(self):
+        self.root = pathlib.Path('./test_profiler')
+        if self.root.is_dir():
+            shutil.rmtree(str(self.root))
+        self.root.mkdir(parents=True)
+        self.profile = self.root / 'kvs.prof'
+        self.kvs = ManageKVS(8017, self.root, self.root / 'kvs.sock',
+                             options='--profile-endpoint --profile {!s}'.format(self.profile))
+        self.kvs.start()
+
+    def tearDown(self):
+        self.kvs.stop()
+        if self.root.is_dir():
+            shutil.rmtree(str(self.root))
+
+    def get(self, path, service=None, headers=None):
+        connect = (service or self.kvs).make_connection(5)
+        try:
+            connect.request('GET', path, headers=headers or {})
+            response = connect.getresponse()
+            return response.status, response.getheader('Content-Type'), response.read()
+        finally:
+            connect.close()
+
+    def test_profile(self):
+        result = {}
+        thread = threading.Thread(target=lambda: result.update(
+            collapsed=self.get('/debug/profile?seconds=0.5&interval=0.002')))
+        thread.start()
+        time.sleep(0.1)
+        self.assertEqual(self.get('/debug/profile?seconds=0.1')[0], profiler.CONFLICT)
+        for _ in range(20):
+            self.kvs.make_request('/cache_set', '{"key": "123", "value": 1}').read()
+        thread.join()
+        status, content_type, body = result['collapsed']
+        self.assertEqual(status, profiler.OK)
+        self.assertTrue(content_type.startswith('text/plain'))
+        self.assertIn('serve_forever', body.decode('utf-8'))
+
+        status, content_type, body = self.get('/debug/profile?seconds=0.1&format=pstats')
+        self.assertEqual((status, content_type), (profiler.OK, 'application/octet-stream'))
+        status, _, body = self.get('/debug/profile?seconds=-1')
+        self.assertEqual(status, profiler.BAD_REQUEST)
+        self.assertEqual(json.loads(self.kvs.make_request('/cache_get', '{"key": "123"}').read())['response'], 1)
+
+        self.kvs.stop()
+        stats = pstats.Stats(str(self.profile))
+        self.assertIn('cache_set', [name for _, _, name in stats.stats])
+
+    def test_kvs_tcp_forbidden(self):
+        kvs = ManageKVS(8018, self.root, options='--profile-endpoint')
+        kvs.start()
+        try:
+            self.assertEqual(self.get('/debug/profile?seconds=0.1', kvs)[0], profiler.FORBIDDEN)
+        finally:
+            kvs.stop()
+
+    @cases([
+        (None, profiler.FORBIDDEN),
+        ('0' * 128, profiler.FORBIDDEN),
+        (api.admin_token, profiler.OK),
+    ])
+    def test_api_needs_admin_token(self, token, status):
+        service = ManageAPI(8088, self.root, 'localhost,8017,10,3', options='--profile-endpoint --no-prewarm')
+        service.start()
+        try:
+            headers = {profiler.TOKEN_HEADER: token() if callable(token) else token} if token else {}
+            self.assertEqual(self.get('/debug/profile?seconds=0.1', service, headers)[0], status)
+        finally:
+            service.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import time
+import uuid
+import logging
+import threading
+import unittest
+
+import requestid
+from test_base import cases
+
+
+class TestSuite(unittest.TestCase):
+    def tearDown(self):
+        requestid.local.__dict__.clear()
+
+    def test_generate_unique(self):
+        ids = []
+
+        def worker():
+            ids.extend(requestid.generate() for _ in range(10000))
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(ids)), 40000)
+        self.assertTrue(ids[0].startswith('{:x}-'.format(os.getpid())))
+
+    def test_generate_after_fork(self):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            os.write(write_fd, requestid.generate().encode('ascii'))
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd, 'rb') as pipe:
+            child_id = pipe.read().decode('ascii')
+        os.waitpid(pid, 0)
+        self.assertTrue(child_id.startswith('{:x}-'.format(pid)))
+        self.assertNotEqual(child_id.rsplit('-', 1)[0], requestid.generate().rsplit('-', 1)[0])
+
+    @cases([
+        ({requestid.HEADER: 'trace-1'}, True),
+        ({}, False),
+        ({requestid.HEADER: ''}, False),
+        ({requestid.HEADER: 'a' * (requestid.MAX_LENGTH + 1)}, False),
+        ({requestid.HEADER: 'a\x1bb'}, False),
+    ])
+    def test_begin(self, headers, kept):
+        request_id = requestid.begin(headers)
+        self.assertEqual(request_id == headers.get(requestid.HEADER), kept)
+        self.assertEqual(requestid.current(), request_id)
+
+    def test_log_pipeline(self):
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter('%(request_id)s %(message)s'))
+        pipeline = requestid.LogPipeline(handler)
+        logger = logging.getLogger('test_requestid')
+        logger.propagate = False
+        logger.addHandler(pipeline.queue_handler)
+        logger.setLevel(logging.INFO)
+
+        def worker(num):
+            requestid.begin({requestid.HEADER: 'request-{:d}'.format(num)})
+            logger.info('served %d', num)
+        try:
+            logger.info('outside')
+            threads = [threading.Thread(target=worker, args=(num,)) for num in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            pipeline.stop()
+            logger.removeHandler(pipeline.queue_handler)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(lines[0], '- outside')
+        self.assertEqual(sorted(lines[1:]), sorted('request-{:d} served {:d}'.format(num, num) for num in range(8)))
+
+    @unittest.skipUnless(os.environ.get('SCORING_BENCHMARK'), 'set SCORING_BENCHMARK=1 to run benchmarks')
+    def test_benchmark(self):
+        timings = {}
+        for name, generate in [('uuid4', lambda: uuid.uuid4().hex), ('generate', requestid.generate)]:
+            started = time.perf_counter()
+            for _ in range(1000000):
+                generate()
+            timings[name] = time.perf_counter() - started
+        print('\n1M ids: uuid4 {uuid4:.2f}s, generate {generate:.2f}s'.format(**timings))
+        self.assertLess(timings['generate'], timings['uuid4'])
+
+
+if __name__ == "__main__":
+    unittest.main()
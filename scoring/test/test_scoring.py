@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime
+import unittest
+import unittest.mock
+
+import model
+import scoring
+import store
+from test_base import cases
+
+
+class ExpensiveScoreModel(model.ScoreModel):
+    version = 'test-1'
+
+    def score(self, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+        return 7.0
+
+
+class TestSuite(unittest.TestCase):
+    @cases([
+        ({}, 0),
+        ({'phone': '79175002040'}, 1.5),
+        ({'phone': '79175002040', 'email': 'stupnikov@otus.ru'}, 3.0),
+        ({'birthday': datetime.date(2000, 1, 1)}, 0),
+        ({'birthday': datetime.date(2000, 1, 1), 'gender': 1}, 1.5),
+        ({'birthday': datetime.date(2000, 1, 1), 'gender': 0}, 0),
+        ({'first_name': 'a', 'last_name': 'b'}, 0.5),
+        ({
+            'phone': '79175002040',
+            'email': 'stupnikov@otus.ru',
+            'birthday': datetime.date(2000, 1, 1),
+            'gender': 2,
+            'first_name': 'a',
+            'last_name': 'b'
+        }, 5.0),
+    ])
+    def test_presence_model(self, arguments, score):
+        store_object = unittest.mock.Mock()
+        arguments = dict({'phone': None, 'email': None}, **arguments)
+        self.assertEqual(scoring.get_score(store_object, **arguments), score)
+        self.assertFalse(store_object.method_calls)
+
+    def test_expensive_model_cached(self):
+        store_object = store.StoreMemory()
+        score_model = ExpensiveScoreModel()
+        self.assertEqual(scoring.get_score(store_object, '79175002040', None, model=score_model), 7.0)
+        self.assertEqual(len(store_object.cache), 1)
+        key = next(iter(store_object.cache))
+        store_object.cache_set(key, 9.0, None)
+        self.assertEqual(scoring.get_score(store_object, '79175002040', None, model=score_model), 9.0)
+
+    def test_expensive_model_version_key(self):
+        store_object = store.StoreMemory()
+        score_model = ExpensiveScoreModel()
+        scoring.get_score(store_object, '79175002040', None, model=score_model)
+        score_model.version = 'test-2'
+        scoring.get_score(store_object, '79175002040', None, model=score_model)
+        self.assertEqual(sorted(key.split(':')[1] for key in store_object.cache), ['test-1', 'test-2'])
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+import unittest.mock
+import multiprocessing
+
+import shmcache
+
+
+class TestSuite(unittest.TestCase):
+    def setUp(self):
+        self.cache = shmcache.SharedCache(64, 4, ttl=60)
+
+    def tearDown(self):
+        self.cache.unlink()
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('uid:1'))
+        self.cache.set('uid:1', 3.5)
+        self.cache.set('uid:2', 1)
+        self.assertEqual(self.cache.get('uid:1'), 3.5)
+        self.assertEqual(self.cache.get('uid:2'), 1.0)
+        self.cache.set('uid:1', 2.0)
+        self.assertEqual(self.cache.get('uid:1'), 2.0)
+
+    def test_expire(self):
+        with unittest.mock.patch('time.time', return_value=100):
+            self.cache.set('uid:1', 3.0, 10)
+            self.cache.set('uid:2', 3.0, 3600)
+        with unittest.mock.patch('time.time', return_value=105):
+            self.assertEqual(self.cache.get('uid:1'), 3.0)
+        with unittest.mock.patch('time.time', return_value=111):
+            self.assertIsNone(self.cache.get('uid:1'))
+            self.assertEqual(self.cache.get('uid:2'), 3.0)
+        with unittest.mock.patch('time.time', return_value=161):
+            self.assertIsNone(self.cache.get('uid:2'))
+
+    def test_clock_eviction(self):
+        cache = shmcache.SharedCache(4, 1)
+        try:
+            for i in range(4):
+                cache.set('uid:%d' % i, i)
+            cache.get('uid:0')
+            cache.set('uid:4', 4)
+            self.assertEqual(cache.get('uid:0'), 0)
+            self.assertEqual(cache.get('uid:4'), 4)
+            self.assertEqual(sum(cache.get('uid:%d' % i) is not None for i in range(5)), 4)
+        finally:
+            cache.unlink()
+
+    def test_capacity(self):
+        for i in range(1000):
+            self.cache.set('uid:%d' % i, i)
+        values = [self.cache.get('uid:%d' % i) for i in range(1000)]
+        self.assertEqual(sum(value is not None for value in values), self.cache.slots)
+        self.assertTrue(all(value == i for i, value in enumerate(values) if value is not None))
+
+    def test_shared_between_processes(self):
+        def worker(first):
+            for i in range(first, 64, 4):
+                self.cache.set('uid:%d' % i, i)
+            os._exit(0)
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=worker, args=(i,)) for i in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        hits = [i for i in range(64) if self.cache.get('uid:%d' % i) == i]
+        self.assertGreater(len(hits), 32)
+
+    def test_counters_shared_between_processes(self):
+        self.cache.set('uid:1', 1.0)
+
+        def worker():
+            for _ in range(10):
+                self.cache.get('uid:1')
+                self.cache.get('uid:2')
+            os._exit(0)
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=worker) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual((self.cache.hits(), self.cache.misses()), (40, 40))
+
+
+if __name__ == "__main__":
+    unittest.main()
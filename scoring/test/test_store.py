@@ -51,3 +51,21 @@ class TestSuite(object):
         store_object = self.make_store()
         store_object.set("123", ['a', 1, 'b', 2])
         self.assertListEqual(store_object.get("123"), ['a', 1, 'b', 2])
+
+    @cases([
+        ('["cars", "pets"]', ['cars', 'pets']),
+        (['cars', 'pets'], ['cars', 'pets']),
+        ('', []),
+    ])
+    def test_get_interests(self, value, names):
+        store_object = self.make_store()
+        store_object.set("i:123", value)
+        self.assertEqual(store_object.get_interests("i:123"), names)
+
+    def test_scan(self):
+        store_object = self.make_store()
+        for key in ['scan:b', 'scan:a', 'scan:c', 'scan_other']:
+            store_object.set(key, key)
+        self.assertEqual(list(store_object.scan('scan:', page_size=2)), [('scan:a', 'scan:a'), ('scan:b', 'scan:b'),
+                                                                         ('scan:c', 'scan:c')])
+        self.assertEqual(list(store_object.scan('scan:', start='scan:b', end='scan:c')), [('scan:b', 'scan:b')])
@@ -3,7 +3,11 @@
 
 import unittest
 import unittest.mock
+import time
+import threading
+import http.client
 
+import shmcache
 import store
 from test_base import cases
 
@@ -25,6 +29,9 @@ class TestSuite(unittest.TestCase):
                 def read(self):
                     return self.content.encode('utf-8')
 
+                def getheader(self, name, default=None):
+                    return default
+
             mock_connection.return_value.getresponse.side_effect = [
                 ConnectionError(),
                 HTTPResponseMock(400, '{"code":400, "'),
@@ -34,9 +41,9 @@ class TestSuite(unittest.TestCase):
             store_object = store.StoreKVS('localhost', 8010)
             response = store_object.make_request('/test', {'test': 'test'})
             mock_connection.return_value.request.assert_has_calls([
-                unittest.mock.call('POST', '/test', '{"test": "test"}'),
-                unittest.mock.call('POST', '/test', '{"test": "test"}'),
-                unittest.mock.call('POST', '/test', '{"test": "test"}')
+                unittest.mock.call('POST', '/test', '{"test": "test"}', {'Accept-Encoding': 'deflate'}),
+                unittest.mock.call('POST', '/test', '{"test": "test"}', {'Accept-Encoding': 'deflate'}),
+                unittest.mock.call('POST', '/test', '{"test": "test"}', {'Accept-Encoding': 'deflate'})
             ])
             self.assertEqual(response, 'response')
 
@@ -52,11 +59,25 @@ class TestSuite(unittest.TestCase):
             with self.assertRaises(ConnectionError):
                 store_object.make_request('/test', {'test': 'test'})
             mock_connection.return_value.request.assert_has_calls([
-                unittest.mock.call('POST', '/test', '{"test": "test"}'),
-                unittest.mock.call('POST', '/test', '{"test": "test"}'),
-                unittest.mock.call('POST', '/test', '{"test": "test"}')
+                unittest.mock.call('POST', '/test', '{"test": "test"}', {'Accept-Encoding': 'deflate'}),
+                unittest.mock.call('POST', '/test', '{"test": "test"}', {'Accept-Encoding': 'deflate'}),
+                unittest.mock.call('POST', '/test', '{"test": "test"}', {'Accept-Encoding': 'deflate'})
             ])
 
+    def test_stale_connection(self):
+        with unittest.mock.patch('http.client.HTTPConnection', autospec=True) as mock_connection:
+            response = unittest.mock.Mock(status=200)
+            response.read.return_value = b'{"code": 200, "response": "response"}'
+            response.getheader.return_value = None
+            mock_connection.return_value.sock = unittest.mock.Mock()
+            mock_connection.return_value.getresponse.side_effect = [http.client.RemoteDisconnected(), response]
+
+            store_object = store.StoreKVS('localhost', 8010, tries=1)
+            self.assertEqual(store_object.make_request('/test', {'test': 'test'}), 'response')
+            mock_connection.return_value.close.assert_called_once_with()
+            self.assertEqual(mock_connection.return_value.request.call_count, 2)
+            self.assertEqual(store_object.nodes[0].breaker.failures, 0)
+
     def test_cache_get_success(self):
         with unittest.mock.patch('store.StoreKVS.make_request', autospec=True) as mock_make_request:
             mock_make_request.return_value = 'response'
@@ -91,6 +112,24 @@ class TestSuite(unittest.TestCase):
                 'timeout': 789
             })
 
+    def test_near_cache(self):
+        near_cache = shmcache.SharedCache(64, 4)
+        self.addCleanup(near_cache.unlink)
+        with unittest.mock.patch('store.StoreKVS.make_request', autospec=True) as mock_make_request:
+            mock_make_request.return_value = 3.0
+            store_object = store.StoreKVS('localhost', 8010, near_cache=near_cache)
+            self.assertEqual(store_object.cache_get('uid:1'), 3.0)
+            self.assertEqual(store_object.cache_get('uid:1'), 3.0)
+            mock_make_request.assert_called_once_with(store_object, '/cache_get', {'key': 'uid:1'})
+            store_object.cache_set('uid:2', 1.5, 60)
+            self.assertEqual(store_object.with_deadline(None).cache_get('uid:2'), 1.5)
+            self.assertEqual(mock_make_request.call_count, 2)
+            # only score keys are kept near
+            store_object.cache_set('123', 2.5, 60)
+            self.assertEqual(store_object.cache_get('123'), 3.0)
+            self.assertEqual(mock_make_request.call_count, 4)
+            self.assertEqual((near_cache.hits(), near_cache.misses()), (2, 1))
+
     def test_cache_set_fail(self):
         with unittest.mock.patch('store.StoreKVS.make_request', autospec=True) as mock_make_request:
             mock_make_request.side_effect = ConnectionError
@@ -139,3 +178,228 @@ class TestSuite(unittest.TestCase):
             with self.assertRaises(ConnectionError):
                 store_object.set('123', 456)
             mock_make_request.assert_called_once_with(store_object, '/data_set', {'key': '123', 'value': 456})
+
+    def test_circuit_breaker(self):
+        breaker = store.CircuitBreaker(failure_threshold=2, reset_timeout=5)
+        with unittest.mock.patch('time.monotonic', return_value=0):
+            self.assertTrue(breaker.allow())
+            breaker.failure()
+            self.assertEqual(breaker.state, store.CircuitBreaker.CLOSED)
+            breaker.failure()
+            self.assertEqual(breaker.state, store.CircuitBreaker.OPEN)
+            self.assertFalse(breaker.allow())
+        with unittest.mock.patch('time.monotonic', return_value=6):
+            self.assertTrue(breaker.allow())
+            self.assertEqual(breaker.state, store.CircuitBreaker.HALF_OPEN)
+            self.assertFalse(breaker.allow())
+            breaker.failure()
+            self.assertEqual(breaker.state, store.CircuitBreaker.OPEN)
+        with unittest.mock.patch('time.monotonic', return_value=12):
+            self.assertTrue(breaker.allow())
+            breaker.success()
+            self.assertEqual(breaker.state, store.CircuitBreaker.CLOSED)
+            self.assertTrue(breaker.allow())
+
+    def test_circuit_open_fail_fast(self):
+        with unittest.mock.patch('http.client.HTTPConnection', autospec=True) as mock_connection:
+            mock_connection.return_value.getresponse.side_effect = ConnectionError()
+            store_object = store.StoreKVS('localhost', 8010, tries=1)
+            for _ in range(store_object.nodes[0].breaker.failure_threshold):
+                with self.assertRaises(ConnectionError):
+                    store_object.make_request('/test', {'test': 'test'})
+            mock_connection.return_value.request.reset_mock()
+            with self.assertRaises(store.CircuitOpenError):
+                store_object.make_request('/test', {'test': 'test'})
+            mock_connection.return_value.request.assert_not_called()
+            self.assertIsNone(store_object.cache_get('123'))
+
+    def test_retry_request_budget(self):
+        with unittest.mock.patch('http.client.HTTPConnection', autospec=True) as mock_connection:
+            mock_connection.return_value.getresponse.side_effect = ConnectionError()
+            store_object = store.StoreKVS('localhost', 8010, tries=3, budget=0.15)
+            with self.assertRaises(ConnectionError):
+                store_object.make_request('/test', {'test': 'test'})
+            self.assertEqual(mock_connection.return_value.request.call_count, 2)
+
+    def test_hedged_read(self):
+        def node_request(node, method, request_str, timeout, headers=None):
+            if node.port == 8010:
+                time.sleep(0.5)
+                return 200, {'code': 200, 'response': 'primary'}
+            return 200, {'code': 200, 'response': 'replica'}
+
+        with unittest.mock.patch('http.client.HTTPConnection', autospec=True):
+            store_object = store.StoreKVS('localhost', 8010, replicas=['localhost:8020'])
+            store_object.nodes[0].latencies.extend([0.01] * store.KVSNode.LATENCY_WINDOW)
+            with unittest.mock.patch('store.KVSNode.request', autospec=True, side_effect=node_request):
+                started = time.monotonic()
+                self.assertEqual(store_object.get('123'), 'replica')
+                self.assertLess(time.monotonic() - started, 0.5)
+                self.assertEqual(store_object.cache_get('123'), 'primary')
+
+    def test_codes_read_not_hedged(self):
+        def node_request(node, method, request_str, timeout, headers=None):
+            if method == '/categories_get':
+                return 200, {'code': 200, 'response': ['cars', 'pets']}
+            if node.port == 8010:
+                time.sleep(0.2)
+                return 200, {'code': 200, 'response': {'codes': [0, 1]}}
+            # the replica numbered its categories the other way round
+            return 200, {'code': 200, 'response': {'codes': [1, 0]}}
+
+        with unittest.mock.patch('http.client.HTTPConnection', autospec=True):
+            store_object = store.StoreKVS('localhost', 8010, replicas=['localhost:8020'])
+            store_object.nodes[0].latencies.extend([0.01] * store.KVSNode.LATENCY_WINDOW)
+            with unittest.mock.patch('store.KVSNode.request', autospec=True, side_effect=node_request) as request:
+                self.assertEqual(store_object.get_interests('i:1'), ['cars', 'pets'])
+            self.assertEqual({call[0][0].port for call in request.call_args_list}, {8010})
+
+    def test_hedged_read_failover(self):
+        def node_request(node, method, request_str, timeout, headers=None):
+            if node.port == 8010:
+                raise ConnectionError()
+            return 200, {'code': 200, 'response': 'replica'}
+
+        with unittest.mock.patch('http.client.HTTPConnection', autospec=True):
+            store_object = store.StoreKVS('localhost', 8010, replicas=[('localhost', 8020)])
+            with unittest.mock.patch('store.KVSNode.request', autospec=True, side_effect=node_request):
+                self.assertEqual(store_object.get('123'), 'replica')
+
+    def test_latency_p95(self):
+        with unittest.mock.patch('http.client.HTTPConnection', autospec=True):
+            node = store.KVSNode('localhost', 8010, 10)
+        node.latencies.extend([0.01] * (store.KVSNode.LATENCY_MIN_SAMPLES - 1))
+        self.assertIsNone(node.latency_p95())
+        node.latencies.extend(i / 1000 for i in range(store.KVSNode.LATENCY_WINDOW))
+        self.assertEqual(node.latency_p95(), 0.094)
+
+    def test_latency_p95_concurrent(self):
+        response = unittest.mock.Mock(status=200, getheader=lambda name, default=None: default)
+        response.read.return_value = b'{"code": 200, "response": 1}'
+        errors = []
+
+        def requests():
+            try:
+                for _ in range(2000):
+                    node.request('/cache_get', '{}', 1)
+            except Exception as e:
+                errors.append(e)
+        with unittest.mock.patch('http.client.HTTPConnection', autospec=True) as mock_connection:
+            mock_connection.return_value.getresponse.return_value = response
+            node = store.KVSNode('localhost', 8010, 10)
+            threads = [threading.Thread(target=requests) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            while any(thread.is_alive() for thread in threads):
+                node.latency_p95()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        self.assertIsNotNone(node.latency_p95())
+
+    def test_deadline_exceeded(self):
+        with unittest.mock.patch('http.client.HTTPConnection', autospec=True) as mock_connection:
+            store_object = store.StoreKVS('localhost', 8010).with_deadline(time.time() - 1)
+            with self.assertRaises(store.DeadlineExceeded):
+                store_object.cache_get('123')
+            mock_connection.return_value.request.assert_not_called()
+
+    def test_deadline_propagation(self):
+        with unittest.mock.patch('http.client.HTTPConnection', autospec=True) as mock_connection:
+
+            class HTTPResponseMock:
+                status = 504
+
+                def read(self):
+                    return b'{"code": 504, "error": "request deadline exceeded"}'
+
+                def getheader(self, name, default=None):
+                    return default
+
+            mock_connection.return_value.getresponse.return_value = HTTPResponseMock()
+            deadline = time.time() + 10
+            store_object = store.StoreKVS('localhost', 8010).with_deadline(deadline)
+            with self.assertRaises(store.DeadlineExceeded):
+                store_object.get('123')
+            mock_connection.return_value.request.assert_called_once_with(
+                'POST', '/data_get', '{"key": "123"}', {
+                    'Accept-Encoding': 'deflate',
+                    'X-Request-Deadline': repr(deadline)
+                })
+            self.assertEqual(store_object.nodes[0].breaker.state, store.CircuitBreaker.CLOSED)
+
+    def test_request_id_propagation(self):
+        with unittest.mock.patch('http.client.HTTPConnection', autospec=True) as mock_connection:
+
+            class HTTPResponseMock:
+                status = 200
+
+                def read(self):
+                    return b'{"code": 200, "response": 1.5}'
+
+                def getheader(self, name, default=None):
+                    return default
+
+            mock_connection.return_value.getresponse.return_value = HTTPResponseMock()
+            store_object = store.StoreKVS('localhost', 8010)
+            self.assertEqual(store_object.with_request_id('trace-1').cache_get('uid:1'), 1.5)
+            mock_connection.return_value.request.assert_called_once_with(
+                'POST', '/cache_get', '{"key": "uid:1"}', {
+                    'Accept-Encoding': 'deflate',
+                    'X-Request-Id': 'trace-1'
+                })
+            self.assertIsNone(store_object.request_id)
+
+    def test_not_found_negative_cache(self):
+        with unittest.mock.patch('http.client.HTTPConnection', autospec=True) as mock_connection:
+
+            class HTTPResponseMock:
+                status = 404
+
+                def read(self):
+                    return b'{"code": 404, "error": "no data found"}'
+
+                def getheader(self, name, default=None):
+                    return default
+
+            mock_connection.return_value.getresponse.return_value = HTTPResponseMock()
+            store_object = store.StoreKVS('localhost', 8010)
+            for _ in range(3):
+                with self.assertRaises(store.NotFoundError):
+                    store_object.get('123')
+            mock_connection.return_value.request.assert_called_once_with('POST', '/data_get', '{"key": "123"}',
+                                                                          {'Accept-Encoding': 'deflate'})
+            self.assertEqual(store_object.nodes[0].breaker.state, store.CircuitBreaker.CLOSED)
+
+            with unittest.mock.patch('store.StoreKVS.make_request', autospec=True):
+                store_object.set('123', 1)
+            self.assertNotIn('123', store_object.not_found)
+
+    def test_negative_cache_bounds(self):
+        negative_cache = store.NegativeCache(2, 5)
+        with unittest.mock.patch('time.monotonic', return_value=0):
+            for key in ['1', '2', '3']:
+                negative_cache.add(key)
+            self.assertNotIn('1', negative_cache)
+            self.assertIn('2', negative_cache)
+            self.assertIn('3', negative_cache)
+        with unittest.mock.patch('time.monotonic', return_value=6):
+            self.assertNotIn('2', negative_cache)
+            self.assertEqual(len(negative_cache.expires), 1)
+
+    @cases([
+        ('localhost,8010,10,3', ['localhost', '8010', '10', '3']),
+        ('unix:/tmp/kvs.sock,10,3', ['unix:/tmp/kvs.sock', 0, '10', '3']),
+        ('unix:/tmp/kvs.sock,10,3,1', ['unix:/tmp/kvs.sock', 0, '10', '3', '1']),
+    ])
+    def test_parse_storage_config(self, config, args):
+        self.assertEqual(store.parse_storage_config(config), args)
+
+    def test_connect_unix(self):
+        with unittest.mock.patch('transport.UnixHTTPConnection', autospec=True) as mock_connection:
+            store_object = store.StoreKVS(*store.parse_storage_config('unix:/tmp/kvs.sock'),
+                                          replicas=['unix:/tmp/kvs2.sock'])
+            mock_connection.assert_has_calls([
+                unittest.mock.call('/tmp/kvs.sock', 10),
+                unittest.mock.call('/tmp/kvs2.sock', 10),
+            ])
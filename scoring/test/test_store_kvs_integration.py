@@ -28,7 +28,9 @@ class TestSuite(test_store.TestSuite, unittest.TestCase):
             shutil.rmtree(str(cls.root))
 
     def make_store(self):
-        return store.StoreKVS('localhost', 8011)
+        store_object = store.StoreKVS('localhost', 8011)
+        self.addCleanup(store_object.close)
+        return store_object
 
     def test_cache_expire(self):
         store_object = self.make_store()
@@ -36,3 +38,95 @@ class TestSuite(test_store.TestSuite, unittest.TestCase):
         self.assertEqual(store_object.cache_get("123"), 123)
         time.sleep(1)
         self.assertIsNone(store_object.cache_get("123"))
+
+    def test_compressed_transport(self):
+        value = ['cars'] * 1000
+        store_object = self.make_store()
+        store_object.set('i:large', value)
+        self.assertTrue(store_object.nodes[0].compress_requests)
+        store_object.set('i:large', value)
+        self.assertEqual(store_object.get('i:large'), value)
+
+    def test_interests_codes(self):
+        store_object = self.make_store()
+        store_object.set('i:1', '["cars", "pets"]')
+        store_object.set('i:2', ['pets', 'travel'])
+        self.assertEqual(store_object.get('i:1'), '["cars", "pets"]')
+        self.assertEqual(store_object.get_interests('i:1'), ['cars', 'pets'])
+        self.assertEqual(store_object.get_interests('i:2'), ['pets', 'travel'])
+        self.assertIs(store_object.get_interests('i:1')[1], store_object.get_interests('i:2')[0])
+
+
+class TestWorkersSuite(TestSuite):
+    @classmethod
+    def setUpClass(cls):
+        cls.root = pathlib.Path('./test_store_kvs_integration_workers')
+        if cls.root.is_dir():
+            shutil.rmtree(str(cls.root))
+        cls.root.mkdir(parents=True)
+        cls.kvs = ManageKVS(8016, cls.root, options='--workers 3')
+        cls.kvs.start()
+
+    def make_store(self):
+        store_object = store.StoreKVS('localhost', 8016)
+        self.addCleanup(store_object.close)
+        return store_object
+
+    def test_partitioned(self):
+        store_object = self.make_store()
+        for num in range(30):
+            store_object.set('p:{:02d}'.format(num), num)
+        self.assertEqual(store_object.get('p:07'), 7)
+        workers = [path for path in self.root.glob('worker-*') if path.is_dir()]
+        self.assertEqual(len(workers), 3)
+        for path in workers:
+            self.assertTrue(list(path.glob('*/*/*.rec')))
+
+    def test_scan_workers(self):
+        store_object = self.make_store()
+        keys = ['w:{:03d}'.format(num) for num in range(50)]
+        for key in keys:
+            store_object.set(key, key)
+        self.assertEqual([key for key, value in store_object.scan('w:', page_size=7)], keys)
+        self.assertEqual([key for key, value in store_object.scan('w:', page_size=50)], keys)
+
+    def test_query_interests_workers(self):
+        store_object = self.make_store()
+        for cid in range(100, 140):
+            store_object.set('i:{:d}'.format(cid), ['workers', 'odd' if cid % 2 else 'even'])
+        self.assertEqual(store_object.query_interests(['workers', 'odd'], limit=100)[0], list(range(101, 140, 2)))
+        ids, cursor = store_object.query_interests(['workers'], limit=15)
+        found = list(ids)
+        while cursor is not None:
+            ids, cursor = store_object.query_interests(['workers'], cursor=cursor, limit=15)
+            found.extend(ids)
+        self.assertEqual(found, list(range(100, 140)))
+        self.assertEqual(store_object.get_interests('i:101'), ['workers', 'odd'])
+        self.assertEqual(store_object.get_interests('i:102'), ['workers', 'even'])
+
+
+class TestUnixSuite(test_store.TestSuite, unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.root = pathlib.Path('./test_store_kvs_integration_unix')
+        if cls.root.is_dir():
+            shutil.rmtree(str(cls.root))
+        cls.root.mkdir(parents=True)
+        cls.kvs = ManageKVS(8013, cls.root, cls.root / 'kvs.sock')
+        cls.kvs.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.kvs.stop()
+        if cls.root.is_dir():
+            shutil.rmtree(str(cls.root))
+
+    def make_store(self):
+        store_object = store.StoreKVS(*store.parse_storage_config('unix:{!s},10,3'.format(self.root / 'kvs.sock')))
+        self.addCleanup(store_object.close)
+        return store_object
+
+    def test_socket_removed(self):
+        self.kvs.stop()
+        self.assertFalse((self.root / 'kvs.sock').exists())
+        self.kvs.start()
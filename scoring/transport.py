@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import stat
+import socket
+import threading
+import socketserver
+import http.client
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+UNIX_PREFIX = 'unix:'
+
+
+class UnixHTTPServer(HTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        # a socket file left by a killed server would make bind fail
+        try:
+            if stat.S_ISSOCK(os.stat(self.server_address).st_mode):
+                os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        # handlers expect a (host, port) client address
+        return request, ('unix', 0)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, UnixHTTPServer):
+    daemon_threads = True
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.unix_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class ConnectionStats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.opened = 0
+        self.requests = 0
+        self.reused = 0
+
+    def open(self):
+        with self.lock:
+            self.active += 1
+            self.opened += 1
+
+    def close(self):
+        with self.lock:
+            self.active -= 1
+
+    def request(self, reused):
+        with self.lock:
+            self.requests += 1
+            if reused:
+                self.reused += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'connections_active': self.active,
+                'connections_total': self.opened,
+                'requests_total': self.requests,
+                'requests_reused': self.reused,
+            }
+
+
+class PersistentHTTPRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 handler keeping connections open between requests; requests
+    # of a connection, pipelined or not, are read one after another from the
+    # same buffered stream, so every response must carry Content-Length or be
+    # chunked, and a request body which can not be framed closes the connection
+    protocol_version = 'HTTP/1.1'
+    timeout = 5.0
+    max_requests = 1000
+    connection_stats = None
+    # a profiler.ProfileCollector when the server runs under --profile
+    profile_collector = None
+    # serve GET /debug/profile, see profiler.serve_profile
+    profile_endpoint = False
+
+    def setup(self):
+        super().setup()
+        self.requests_served = 0
+        if self.connection_stats is not None:
+            self.connection_stats.open()
+
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            if self.connection_stats is not None:
+                self.connection_stats.close()
+
+    def handle(self):
+        if self.profile_collector is None:
+            return super().handle()
+        return self.profile_collector.runcall(super().handle)
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        self.requests_served += 1
+        if self.connection_stats is not None:
+            self.connection_stats.request(self.requests_served > 1)
+        return True
+
+    def end_headers(self):
+        if self.max_requests and self.requests_served >= self.max_requests:
+            self.close_connection = True
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        super().end_headers()
+
+    def chunked(self):
+        return self.request_version != 'HTTP/1.0'
+
+    def write_chunk(self, data):
+        if not data:
+            return
+        if self.chunked():
+            self.wfile.write(b'%x\r\n%b\r\n' % (len(data), data))
+        else:
+            self.wfile.write(data)
+
+    def end_chunks(self):
+        if self.chunked():
+            self.wfile.write(b'0\r\n\r\n')
+
+
+def is_unix(address):
+    return isinstance(address, str) and address.startswith(UNIX_PREFIX)
+
+
+def unix_path(address):
+    return address[len(UNIX_PREFIX):]